@@ -1,234 +1,648 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify
 from flask_cors import CORS
+from werkzeug.formparser import FormDataParser, MultiPartParser
 import os
+import hmac
+import json
+import time
+import functools
 import sys
 import torch
 import numpy as np
-import pickle
-import json
 import logging
-import whisper
 from faq_model_utils import (
-    clean_text, encode_text, cosine_sim, pad_sequence,
-    SiameseNetwork, Vocab, check_small_talk
+    clean_text, encode_text, encode_texts, pad_sequence, batch_tensor,
+    SiameseNetwork, Vocab
 )
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-import re
-import tempfile
-import ffmpeg
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from fast_match import TIERS, exact_match, near_match
+from model_registry import ModelRegistry
+from faq_collections import CollectionStore, UnknownCollectionError
+from batching import MicroBatcher, QueueFullError
+from query_cache import QueryCache, make_backend
+from faq_admin import FAQEditError, add_faq, delete_faq, update_faq
+from observability import CONTENT_TYPE as METRICS_CONTENT_TYPE, CallbackMetric, Counter, Histogram, configure_logging, log_event, render as render_metrics
+from transcription import AudioDecodeError, FFmpegDecodeStream, TranscriptionPool, decode_audio, WHISPER_PRELOAD
+
+# Configure logging (FAQ_LOG_LEVEL, FAQ_LOG_FORMAT, FAQ_LOG_SAMPLE_RATE; see observability.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+# Uploads to these paths are piped into ffmpeg while the multipart body is
+# parsed, instead of being spooled to a file first
+STREAMING_UPLOAD_PATHS = {'/api/transcribe', '/api/voice-faq'}
+
+class AudioMultiPartParser(MultiPartParser):
+    """Pipes the first ``audio`` part into ffmpeg; other file parts use the default stream."""
+
+    audio_stream = None
+
+    def start_file_streaming(self, event, total_content_length):
+        if event.name == 'audio' and self.audio_stream is None:
+            self.audio_stream = FFmpegDecodeStream()
+            return self.audio_stream
+        return super().start_file_streaming(event, total_content_length)
+
+    def parse(self, stream, boundary, content_length):
+        try:
+            return super().parse(stream, boundary, content_length)
+        except BaseException:
+            # A body cut off mid-upload never reaches decode_upload; stop ffmpeg here
+            if self.audio_stream is not None:
+                self.audio_stream.close()
+            raise
+
+class AudioFormDataParser(FormDataParser):
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        # Same as FormDataParser._parse_multipart with the parser swapped
+        parser = AudioMultiPartParser(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+        )
+        boundary = options.get('boundary', '').encode('ascii')
+        if not boundary:
+            raise ValueError("Missing boundary")
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+class FAQRequest(Request):
+    @property
+    def form_data_parser_class(self):
+        return AudioFormDataParser if self.path in STREAMING_UPLOAD_PATHS else FormDataParser
 
 app = Flask(__name__)
+app.request_class = FAQRequest
 CORS(app)
 
-# Initialize the FAQ model
-model = None
-vocab = None
-embeddings = None
-faq_data = None
-max_len = None
-device = None
-whisper_model = None
-
-def load_model():
-    global model, vocab, embeddings, faq_data, max_len, device, whisper_model
-    
-    try:
-        logger.info("Starting model loading...")
-        
-        # Set device
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        logger.info(f"Using device: {device}")
-        
-        # Load vocabulary
-        vocab_path = os.path.join(os.path.dirname(__file__), 'vocab.pkl')
-        logger.debug(f"Loading vocabulary from {vocab_path}")
-        with open(vocab_path, 'rb') as f:
-            vocab = pickle.load(f)
-        
-        # Load FAQ data
-        faq_path = os.path.join(os.path.dirname(__file__), 'faq_data.json')
-        logger.debug(f"Loading FAQ data from {faq_path}")
-        with open(faq_path, 'r', encoding='utf-8') as f:
-            faq_data = json.load(f)
-        
-        # Calculate max length
-        max_len = max(len(item['question'].split()) for item in faq_data) + 2
-        logger.debug(f"Max sequence length: {max_len}")
-        
-        # Load model weights
-        model_path = os.path.join(os.path.dirname(__file__), 'siamese_faq_model.pt')
-        logger.debug(f"Loading model from {model_path}")
-        model = SiameseNetwork(len(vocab), 50, 64).to(device)
-        model.load_state_dict(torch.load(model_path, map_location=device))
-        model.eval()
-        
-        # Load embeddings
-        embeddings_path = os.path.join(os.path.dirname(__file__), 'faq_embeddings.npy')
-        logger.debug(f"Loading embeddings from {embeddings_path}")
-        embeddings = np.load(embeddings_path)
-        
-        # Load Whisper model
-        whisper_model = None
-        
-        logger.info("Model loading completed successfully")
-    except Exception as e:
-        logger.error(f"Error loading model: {str(e)}")
-        raise
+# Resident FAQ model; loaded once and hot-reloaded when artifacts change
+registry = ModelRegistry()
+
+# Per-tenant FAQ collections on top of the registry's model, loaded on demand
+collection_store = CollectionStore()
+
+# Pool of preloaded Whisper workers behind a bounded job queue
+transcription_pool = TranscriptionPool()
+
+MAX_BATCH_QUERIES = int(os.environ.get('FAQ_MAX_BATCH', '5000'))
+MAX_TOP_K = int(os.environ.get('FAQ_MAX_TOP_K', '100'))
+BATCH_ENCODE_SIZE = int(os.environ.get('FAQ_ENCODE_BATCH_SIZE', '256'))
+
+# Answers keyed on the cleaned query; dropped whenever the model reloads
+query_cache = QueryCache(
+    max_size=int(os.environ.get('FAQ_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('FAQ_CACHE_TTL', '300')),
+    backend=make_backend(os.environ.get('FAQ_CACHE_BACKEND', '')),
+)
+registry.add_listener(lambda artifacts: query_cache.clear())
+
+# Micro-batching of concurrent single-query encodes (opt-in)
+MICROBATCH_ENABLED = os.environ.get('FAQ_MICROBATCH', '0') == '1'
+
+def load_model(backend=None):
+    """Load the model now; ``backend`` overrides ``FAQ_INFERENCE_BACKEND`` (see inference_export.py)."""
+    if backend is not None:
+        registry.backend = backend
+    return registry.load()
+
+def encode_cleaned_batch(items):
+    # Items are (artifacts, cleaned_query) pairs; group them per snapshot so
+    # a reload in the middle of a window never mixes two model versions
+    results = [None] * len(items)
+    groups = {}
+    for i, (artifacts, _) in enumerate(items):
+        groups.setdefault(id(artifacts), (artifacts, []))[1].append(i)
+    for artifacts, positions in groups.values():
+        embs = encode_texts(
+            artifacts.model, [items[i][1] for i in positions], artifacts.vocab,
+            artifacts.max_len, BATCH_ENCODE_SIZE, artifacts.device, clean=False
+        )
+        for i, emb in zip(positions, embs):
+            results[i] = emb
+    return results
+
+encode_batcher = MicroBatcher(
+    encode_cleaned_batch,
+    max_batch_size=int(os.environ.get('FAQ_MICROBATCH_MAX_SIZE', '32')),
+    max_wait_ms=float(os.environ.get('FAQ_MICROBATCH_WAIT_MS', '2')),
+    max_queue=int(os.environ.get('FAQ_MICROBATCH_MAX_QUEUE', '1024')),
+)
 
-def get_faq_response(query):
+# === Metrics (served on /metrics, see observability.py) ===
+
+REQUEST_SECONDS = Histogram('faq_request_seconds', 'Time to build an endpoint response', ['endpoint'])
+REQUESTS = Counter('faq_requests_total', 'Responses by endpoint and HTTP status', ['endpoint', 'status'])
+STAGE_SECONDS = Histogram('faq_stage_seconds', 'Time spent in each stage of answering a query', ['stage'])
+LOW_CONFIDENCE = Counter('faq_low_confidence_total', 'Matches below the confidence threshold forwarded to the helpdesk')
+SMALL_TALK = Counter('faq_small_talk_total', 'Queries answered as small talk')
+TIER_MATCHES = Counter('faq_match_tier_total', 'Queries answered per matching tier (see fast_match.py)', ['tier', 'kind'])
+CallbackMetric('faq_cache_hits_total', 'Answer cache hits', lambda: query_cache.hits, kind='counter')
+CallbackMetric('faq_cache_misses_total', 'Answer cache misses', lambda: query_cache.misses, kind='counter')
+CallbackMetric('faq_microbatch_queue_depth', 'Queries waiting for the micro-batcher',
+               lambda: encode_batcher.metrics()['queue_depth'] if MICROBATCH_ENABLED else None)
+CallbackMetric('faq_transcription_queue_depth', 'Audio jobs waiting for a Whisper worker',
+               lambda: transcription_pool.stats()['queued'])
+CallbackMetric('faq_model_info', 'Resident model snapshot (always 1)',
+               lambda: {(str(s['version']), s['fingerprint']): 1} if 'version' in (s := registry.status()) else None,
+               labelnames=('version', 'fingerprint'))
+CallbackMetric('faq_model_faqs', 'FAQs in the resident snapshot', lambda: registry.status().get('faq_count'))
+CallbackMetric('faq_confidence_threshold', 'Confidence threshold of the resident snapshot',
+               lambda: registry.status().get('confidence_threshold'))
+CallbackMetric('faq_collections_loaded', 'FAQ collections resident in memory', lambda: collection_store.stats()['loaded'])
+CallbackMetric('faq_collections_bytes', 'Estimated memory of the resident FAQ collections',
+               lambda: collection_store.stats()['bytes'])
+CallbackMetric('faq_collection_loads_total', 'FAQ collections loaded (first use, change or after eviction)',
+               lambda: collection_store.loads, kind='counter')
+CallbackMetric('faq_collection_evictions_total', 'FAQ collections evicted to stay within the memory budget',
+               lambda: collection_store.evictions, kind='counter')
+CallbackMetric('faq_model_reloads_total', 'Successful hot reloads', lambda: registry.reload_count, kind='counter')
+
+def instrumented(endpoint):
+    """Record latency and status of a ``*_payload`` function (used by both Flask and ASGI)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start, status = time.perf_counter(), 500
+            try:
+                payload, status = fn(*args, **kwargs)
+                return payload, status
+            finally:
+                REQUEST_SECONDS.since(start, endpoint)
+                REQUESTS.inc(endpoint, str(status))
+        return timed
+    return wrap
+
+def answer_for_match(artifacts, best_idx, best_score, tier='model'):
+    """``(answer, score)`` for a FAQ match, forwarding low-confidence model matches.
+
+    The threshold is a cosine one that belongs to the snapshot (calibrated
+    for its weights, see calibration.py), so it only gates the model tier.
+    Exact and near-duplicate hits were already accepted on their own cutoff
+    and their score is a text ratio; the tier is reported next to it.
+    """
+    if tier == 'model' and best_score < artifacts.threshold:
+        LOW_CONFIDENCE.inc()
+        return "I'm not confident I have the right answer for this question. I've forwarded your query to our help desk team, and they'll get back to you shortly.", best_score
+    return artifacts.faq_data[best_idx]['answer'], best_score
+
+def match_fast_tiers(cleaned, artifacts):
+    """Run the exact and near-duplicate tiers (fast_match.py); returns a Match or None.
+
+    With ``artifacts`` None only small talk is matched.
+    """
+    matcher = artifacts.matcher if artifacts is not None else None
+    for tier, lookup in (('exact', exact_match), ('near', near_match)):
+        start = time.perf_counter()
+        match = lookup(cleaned, matcher)
+        STAGE_SECONDS.since(start, tier)
+        if match is not None:
+            TIER_MATCHES.inc(tier, match.kind)
+            if match.kind == 'small_talk':
+                SMALL_TALK.inc()
+            return match
+    return None
+
+def snapshot_for(collection=None):
+    """The snapshot answering ``collection`` (None: the default FAQs); raises UnknownCollectionError."""
+    if collection is None:
+        return registry.get()
+    return collection_store.get(collection, registry.get())
+
+def get_faq_response(query, collection=None):
     try:
-        logger.debug(f"Processing query: {query}")
-        
-        # Check for small talk first
-        small_talk_response = check_small_talk(query)
-        if small_talk_response:
-            logger.debug("Small talk detected")
-            return small_talk_response, 1.0
-        
-        # Process the query using the FAQ model
+        # Clean once and share the result between all tiers
+        start = time.perf_counter()
         cleaned = clean_text(query)
-        logger.debug(f"Cleaned query: {cleaned}")
-        
-        # Ensure the encoded sequence is on the correct device
-        encoded = pad_sequence(vocab.encode(cleaned), max_len)
-        seq_tensor = torch.tensor([encoded], dtype=torch.long).to(device)
-        
-        # Get query embedding
-        with torch.no_grad():
-            query_emb = model.forward_once(seq_tensor).cpu().numpy()[0]
-        
-        # Calculate similarities
-        sims = [cosine_sim(query_emb, emb) for emb in embeddings]
-        best_idx = int(np.argmax(sims))
-        best_score = float(sims[best_idx])  # Convert numpy float32 to Python float
-        
-        logger.debug(f"Best match index: {best_idx}, Confidence score: {best_score}")
-        
-        if best_score < 0.87:
-            logger.debug("Low confidence, forwarding to helpdesk")
-            return "I'm not confident I have the right answer for this question. I've forwarded your query to our help desk team, and they'll get back to you shortly.", best_score
+        STAGE_SECONDS.since(start, 'clean')
+
+        # Hold on to one snapshot for the whole request so a concurrent
+        # reload can't mix artifacts from two versions. Loaded before the fast
+        # tiers so that cold-start requests get the exact and near FAQ tiers too
+        artifacts = snapshot_for(collection)
+        match = match_fast_tiers(cleaned, artifacts)
+        if match is not None:
+            if match.kind == 'small_talk':
+                return match.response, 1.0, match.tier
+            return (*answer_for_match(artifacts, match.row, match.score, match.tier), match.tier)
+
+        model_start = time.perf_counter()
+        TIER_MATCHES.inc('model', 'faq')
+        model, vocab = artifacts.model, artifacts.vocab
+        max_len, device = artifacts.max_len, artifacts.device
+
+        cached = query_cache.get(artifacts.fingerprint, cleaned)
+        if cached is not None:
+            STAGE_SECONDS.since(model_start, 'model')
+            return (*cached, 'model')
+
+        stage_start = time.perf_counter()
+        if MICROBATCH_ENABLED:
+            # Coalesce with other in-flight queries into one padded batch
+            query_emb = encode_batcher.submit((artifacts, cleaned))
         else:
-            logger.debug(f"Found answer: {faq_data[best_idx]['answer']}")
-            return faq_data[best_idx]['answer'], best_score
+            # Packed models need no padding here; fixed-padding ones get max_len
+            seq_tensor = batch_tensor(model, [vocab.encode(cleaned)], max_len).to(device)
+
+            # Get query embedding
+            with torch.no_grad():
+                query_emb = model.forward_once(seq_tensor).cpu().numpy()[0]
+        
+        search_start = time.perf_counter()
+        STAGE_SECONDS.observe(search_start - stage_start, 'encode')
+
+        # Dense similarity search fused with BM25 (lexical.py)
+        best_idx, best_score = artifacts.search(query_emb, cleaned, k=1)[0]
+        STAGE_SECONDS.since(search_start, 'search')
+        STAGE_SECONDS.since(model_start, 'model')
+        log_event(logger, logging.DEBUG, "faq match", cleaned=cleaned, index=best_idx, score=best_score)
+
+        result = answer_for_match(artifacts, best_idx, best_score)
+        query_cache.set(artifacts.fingerprint, cleaned, result)
+        return (*result, 'model')
+    except UnknownCollectionError:
+        raise
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
         raise
 
-@app.route('/api/faq', methods=['POST'])
-def handle_faq_request():
-    try:
-        load_model()
-    except Exception as e:
-        logger.error(f"Failed to initialize the FAQ model: {e}")
+def get_faq_responses(queries, top_k=1, artifacts=None):
+    """Answer many queries with batched encoding and one similarity product.
+
+    Returns a list of ``(answer, confidence_score, matches, tier)`` tuples where
+    ``matches`` holds the ``top_k`` ``(index, score)`` pairs (empty for small talk)
+    and ``tier`` is the matching tier (see fast_match.py).
+    """
+    results = [None] * len(queries)
+    pending = []
+    cleaned = [clean_text(query) for query in queries]
+    artifacts = artifacts or registry.get()
+    # FAQ fast-path hits carry a single match, so they only answer top_k=1 requests
+    faq_artifacts = artifacts if top_k <= 1 else None
+    for i in range(len(queries)):
+        match = match_fast_tiers(cleaned[i], faq_artifacts)
+        if match is None:
+            pending.append(i)
+        elif match.kind == 'small_talk':
+            results[i] = (match.response, 1.0, [], match.tier)
+        else:
+            answer, score = answer_for_match(artifacts, match.row, match.score, match.tier)
+            results[i] = (answer, score, [(match.row, match.score)], match.tier)
 
+    if pending:
+        TIER_MATCHES.inc('model', 'faq', amount=len(pending))
+        query_embs = encode_texts(
+            artifacts.model, [cleaned[i] for i in pending], artifacts.vocab,
+            artifacts.max_len, BATCH_ENCODE_SIZE, artifacts.device, clean=False
+        )
+        matches_per_query = artifacts.search_batch(query_embs, [cleaned[i] for i in pending], k=max(1, top_k))
+        for i, matches in zip(pending, matches_per_query):
+            best_idx, best_score = matches[0]
+            answer, score = answer_for_match(artifacts, best_idx, best_score)
+            results[i] = (answer, score, matches, 'model')
+    return results
+
+@instrumented('faq')
+def faq_response_payload(data):
+    """Build the ``/api/faq`` response for a parsed JSON body; returns ``(payload, status)``.
+
+    An optional ``collection`` answers from that tenant's FAQs (see
+    faq_collections.py). Shared by the Flask routes and the ASGI app in asgi.py.
+    """
     try:
-        logger.info("Received FAQ request")
-        data = request.get_json()
-        logger.debug(f"Request data: {data}")
-        
         query = data.get('message', '')
-        logger.debug(f"Query: {query}")
-        
         if not query:
-            logger.warning("Empty query received")
-            return jsonify({
+            log_event(logger, logging.INFO, "empty faq query")
+            return {
                 'error': 'No query provided',
                 'answer': 'Please provide a question to get an answer.',
                 'confidence_score': 0.0
-            })
+            }, 200
         
-        answer, confidence_score = get_faq_response(query)
-        logger.debug(f"Response: {answer}, Confidence: {confidence_score}")
-        
-        return jsonify({
+        answer, confidence_score, tier = get_faq_response(query, data.get('collection'))
+        log_event(logger, logging.DEBUG, "faq answered", query=query, answer=answer, confidence=confidence_score,
+                  tier=tier)
+
+        return {
             'answer': answer,
-            'confidence_score': confidence_score
-        })
+            'confidence_score': confidence_score,
+            'tier': tier
+        }, 200
         
+    except UnknownCollectionError as e:
+        return {'error': f'Unknown collection {e.args[0]!r}', 'answer': '', 'confidence_score': 0.0}, 404
+    except QueueFullError as e:
+        logger.warning(f"Rejecting FAQ request: {e}")
+        return {
+            'error': 'Server busy',
+            'answer': 'Sorry, we are receiving too many questions right now. Please try again in a moment.',
+            'confidence_score': 0.0
+        }, 503
     except Exception as e:
         logger.error(f"Error handling request: {str(e)}")
-        return jsonify({
+        return {
             'error': str(e),
             'answer': 'Sorry, I encountered an error while processing your question.',
             'confidence_score': 0.0
-        })
+        }, 200
 
-@app.route('/api/transcribe', methods=['POST'])
-def transcribe():
-    global whisper_model
+@instrumented('faq_batch')
+def faq_batch_payload(data):
+    """Build the ``/api/faq/batch`` response; returns ``(payload, status)``."""
     try:
-        logger.info("Received transcription request")
-        
-        if 'audio' not in request.files:
-            logger.warning("No audio file provided")
-            return jsonify({'error': 'No audio file provided'}), 400
+        queries = data.get('messages')
+        log_event(logger, logging.INFO, "faq batch", messages=len(queries) if isinstance(queries, list) else 0)
+
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            return {'error': '"messages" must be a list of strings'}, 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return {'error': f'At most {MAX_BATCH_QUERIES} messages per batch'}, 413
+        top_k = data.get('top_k', 1)
+        if isinstance(top_k, str) and top_k.strip().isdigit():
+            top_k = int(top_k)
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+            return {'error': f'"top_k" must be an integer from 1 to {MAX_TOP_K}'}, 400
+
+        artifacts = snapshot_for(data.get('collection'))
+        faq_data = artifacts.faq_data
+        results = []
+        for query, (answer, confidence_score, matches, tier) in zip(queries, get_faq_responses(queries, top_k, artifacts)):
+            result = {'message': query, 'answer': answer, 'confidence_score': confidence_score, 'tier': tier}
+            if top_k > 1:
+                result['matches'] = [
+                    {'index': idx, 'question': faq_data[idx]['question'], 'score': score}
+                    for idx, score in matches
+                ]
+            results.append(result)
+
+        return {'results': results}, 200
+
+    except UnknownCollectionError as e:
+        return {'error': f'Unknown collection {e.args[0]!r}', 'results': []}, 404
+    except Exception as e:
+        logger.error(f"Error handling batch request: {str(e)}")
+        return {'error': str(e), 'results': []}, 500
+
+def faq_stats_payload():
+    return {
+        'microbatch': dict(encode_batcher.metrics(), enabled=MICROBATCH_ENABLED),
+        'cache': query_cache.stats(),
+        'transcription': transcription_pool.stats(),
+        'tiers': tier_stats(),
+        'collections': collection_store.stats(),
+    }
 
-        audio_file = request.files['audio']
+def tier_stats():
+    """Queries answered per matching tier, with each tier's share of all queries."""
+    counts = {tier: {kind: TIER_MATCHES.value(tier, kind) for kind in ('small_talk', 'faq')} for tier in TIERS}
+    total = sum(sum(kinds.values()) for kinds in counts.values())
+    return {
+        tier: dict(kinds, hit_rate=round(sum(kinds.values()) / total, 4) if total else 0.0)
+        for tier, kinds in counts.items()
+    }
+
+# Shared secret for /api/admin/faqs; the admin API is disabled when unset
+ADMIN_TOKEN = os.environ.get('FAQ_ADMIN_TOKEN', '')
+
+@instrumented('admin')
+def admin_faq_payload(method, data, authorization):
+    """List (GET), add (POST), update (PUT) or delete (DELETE) FAQs; returns ``(payload, status)``.
+
+    Edits go through faq_admin.py, so only new or changed questions are
+    encoded. This process reloads right away; other workers pick the change
+    up through hot reload.
+    """
+    if not ADMIN_TOKEN:
+        return {'error': 'Admin API disabled'}, 403
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        return {'error': 'Unauthorized'}, 401
+    try:
+        if method == 'GET':
+            faq_data = registry.get().faq_data
+            return {'faqs': [dict(item, position=i) for i, item in enumerate(faq_data)]}, 200
+        if not isinstance(data, dict):
+            return {'error': 'Request body must be a JSON object'}, 400
+        if method == 'POST':
+            report = add_faq(registry.base_dir, data.get('question'), data.get('answer'))
+        elif method == 'PUT':
+            report = update_faq(registry.base_dir, data.get('position'), data.get('question'), data.get('answer'))
+        else:
+            report = delete_faq(registry.base_dir, data.get('position'))
+        registry.load()
+        logger.info(f"FAQ {method} applied: {report['encoded']} encoded, {report['faq_count']} FAQs")
+        return report, 201 if method == 'POST' else 200
+    except FAQEditError as e:
+        return {'error': str(e)}, e.status
+    except Exception as e:
+        logger.error(f"Error editing FAQs: {str(e)}")
+        return {'error': str(e)}, 500
+
+def decode_upload(files):
+    """Validate and decode the ``audio`` upload in ``files``.
+
+    Returns ``(audio, None)`` on success or ``(None, (payload, status))``.
+    """
+    if 'audio' not in files:
+        logger.warning("No audio file provided")
+        return None, ({'error': 'No audio file provided'}, 400)
+
+    audio_file = files['audio']
+    audio_stream = audio_file.stream
+    try:
         if not audio_file.filename.endswith('.wav'):
             logger.warning("File format not supported")
-            return jsonify({'error': 'Only WAV files are supported'}), 400
+            return None, ({'error': 'Only WAV files are supported'}, 400)
 
-        # Save the audio file temporarily
-        temp_path = "temp_audio.wav"
-        audio_file.save(temp_path)
-        logger.debug(f"Saved temporary audio file to {temp_path}")
+        # Decode in memory; streamed uploads are already inside ffmpeg
+        if isinstance(audio_stream, FFmpegDecodeStream):
+            audio = audio_stream.finish()
+        else:
+            audio = decode_audio(audio_stream)
+        log_event(logger, logging.DEBUG, "audio decoded", seconds=len(audio) / 16000)
+        return audio, None
+    except AudioDecodeError as e:
+        logger.warning(f"Could not decode audio: {e}")
+        return None, ({'error': 'Could not decode audio file'}, 400)
+    finally:
+        if isinstance(audio_stream, FFmpegDecodeStream):
+            audio_stream.close()
 
-        try:
+@instrumented('transcribe')
+def transcribe_payload(files):
+    """Transcribe the ``audio`` upload in ``files``; returns ``(payload, status)``."""
+    try:
+        audio, error = decode_upload(files)
+        if error:
+            return error
+
+        transcription = transcription_pool.transcribe(audio)["text"]
+        log_event(logger, logging.INFO, "transcribed", seconds=round(len(audio) / 16000, 2), chars=len(transcription))
 
-            # Lazy load Whisper model
-            if whisper_model is None:
-                logger.info("Loading Whisper model for the first time...")
-                whisper_model = whisper.load_model("base")
-                logger.info("Whisper model loaded successfully.")
-
-            # Transcribe the audio using Whisper
-            logger.info("Transcribing audio...")
-            result = whisper_model.transcribe(temp_path)
-            transcription = result["text"]
-            logger.info(f"Transcription complete: {transcription}")
-
-            # Clean up the temporary file
-            os.remove(temp_path)
-            logger.debug("Removed temporary audio file")
-
-            return jsonify({
-                'text': transcription
-            })
-
-        except Exception as e:
-            # Clean up the temporary file in case of error
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            logger.error(f"Error during transcription: {str(e)}")
-            raise e
+        return {
+            'text': transcription
+        }, 200
 
+    except QueueFullError as e:
+        logger.warning(f"Rejecting transcription request: {e}")
+        return {'error': 'Transcription service busy, please retry shortly'}, 503
     except Exception as e:
         logger.error(f"Error handling transcription request: {str(e)}")
+        return {'error': 'Failed to transcribe audio'}, 500
+
+def _ms_since(start):
+    return (time.perf_counter() - start) * 1000
+
+def answer_transcript(transcript, timings, started, collection=None):
+    """Answer a transcript and attach the per-stage timings (milliseconds)."""
+    faq_started = time.perf_counter()
+    if transcript:
+        answer, confidence_score, tier = get_faq_response(transcript, collection)
+    else:
+        answer, confidence_score, tier = "Sorry, I couldn't hear a question in that recording.", 0.0, None
+    timings['faq'] = _ms_since(faq_started)
+    timings['total'] = _ms_since(started)
+    for stage in ('decode', 'transcribe_queue', 'transcribe'):
+        if stage in timings:
+            STAGE_SECONDS.observe(timings[stage] / 1000, stage)
+    return {
+        'text': transcript,
+        'answer': answer,
+        'confidence_score': confidence_score,
+        'tier': tier,
+        'timings_ms': timings,
+    }
+
+def _whisper_timings(timings, whisper):
+    timings['transcribe_queue'] = whisper.get('queue_ms', 0.0)
+    timings['transcribe'] = whisper.get('inference_ms', 0.0)
+
+def voice_faq_events(audio, timings, started, collection=None):
+    """Yield a ``partial`` event per transcribed window, then the ``answer`` event."""
+    whisper, texts = {}, []
+    try:
+        for text in transcription_pool.transcribe_windows(audio, timings=whisper):
+            if text:
+                texts.append(text)
+            yield {'event': 'partial', 'text': ' '.join(texts)}
+        _whisper_timings(timings, whisper)
+        yield dict(event='answer', **answer_transcript(' '.join(texts), timings, started, collection))
+    except QueueFullError as e:
+        logger.warning(f"Rejecting voice FAQ request: {e}")
+        yield {'event': 'error', 'error': 'Transcription service busy, please retry shortly'}
+    except Exception as e:
+        logger.error(f"Error handling voice FAQ request: {str(e)}")
+        yield {'event': 'error', 'error': 'Failed to answer audio question'}
+
+@instrumented('voice_faq')
+def voice_faq_payload(files, stream=False, started=None, collection=None):
+    """Transcribe the ``audio`` upload and answer it in one call; returns ``(payload, status)``.
+
+    With ``stream=True`` the payload is an iterator of events (see
+    ``voice_faq_events``) to be sent as newline-delimited JSON.
+    """
+    started = started or time.perf_counter()
+    timings = {}
+    try:
+        if collection is not None:
+            # Fail before spending a Whisper slot, and load the collection meanwhile
+            snapshot_for(collection)
+        decode_started = time.perf_counter()
+        audio, error = decode_upload(files)
+        if error:
+            return error
+        timings['decode'] = _ms_since(decode_started)
+
+        if stream:
+            return voice_faq_events(audio, timings, started, collection), 200
+
+        whisper = {}
+        transcript = transcription_pool.transcribe(audio, timings=whisper)["text"].strip()
+        _whisper_timings(timings, whisper)
+        log_event(logger, logging.DEBUG, "voice faq transcript", transcript=transcript)
+        return answer_transcript(transcript, timings, started, collection), 200
+
+    except UnknownCollectionError as e:
+        return {'error': f'Unknown collection {e.args[0]!r}'}, 404
+    except QueueFullError as e:
+        logger.warning(f"Rejecting voice FAQ request: {e}")
+        return {'error': 'Transcription service busy, please retry shortly'}, 503
+    except Exception as e:
+        logger.error(f"Error handling voice FAQ request: {str(e)}")
+        return {'error': 'Failed to answer audio question'}, 500
+
+def ndjson_lines(events):
+    for event in events:
+        yield json.dumps(event) + '\n'
+
+@app.route('/api/faq', methods=['POST'])
+def handle_faq_request():
+    payload, status = faq_response_payload(request.get_json(silent=True) or {})
+    return jsonify(payload), status
+
+@app.route('/api/faq/batch', methods=['POST'])
+def handle_faq_batch_request():
+    payload, status = faq_batch_payload(request.get_json(silent=True) or {})
+    return jsonify(payload), status
+
+@app.route('/api/faq/stats', methods=['GET'])
+def faq_stats():
+    return jsonify(faq_stats_payload())
+
+@app.route('/api/admin/faqs', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def admin_faqs():
+    payload, status = admin_faq_payload(
+        request.method, request.get_json(silent=True) or {}, request.headers.get('Authorization', '')
+    )
+    return jsonify(payload), status
+
+@app.route('/api/transcribe', methods=['POST'])
+def transcribe():
+    try:
+        files = request.files
+    except Exception as e:
+        # Starting ffmpeg for the streamed upload failed
+        logger.error(f"Error reading transcription upload: {str(e)}")
         return jsonify({'error': 'Failed to transcribe audio'}), 500
+    payload, status = transcribe_payload(files)
+    return jsonify(payload), status
+
+@app.route('/api/voice-faq', methods=['POST'])
+def voice_faq():
+    started = time.perf_counter()
+    try:
+        files = request.files
+    except Exception as e:
+        logger.error(f"Error reading voice FAQ upload: {str(e)}")
+        return jsonify({'error': 'Failed to answer audio question'}), 500
+    stream = request.args.get('stream') == '1'
+    payload, status = voice_faq_payload(files, stream, started, request.args.get('collection'))
+    if stream and status == 200:
+        return Response(ndjson_lines(payload), mimetype='application/x-ndjson')
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({'message': 'FAQ backend is up and running! ✅'}), 200
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up, whatever the model state
+    return jsonify(registry.status()), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: only accept traffic once the model is resident
+    status = registry.status()
+    return jsonify(status), 200 if registry.ready else 503
+
 if __name__ == '__main__':
     # Load the model when the application starts
     load_model()
+    if WHISPER_PRELOAD:
+        transcription_pool.start()
     logger.info("Starting Flask server...")
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port) 
\ No newline at end of file
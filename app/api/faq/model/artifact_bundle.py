@@ -0,0 +1,319 @@
+# artifact_bundle.py
+
+"""
+Versioned, memory-mappable artifact bundle for the FAQ service.
+
+A bundle is one directory under ``bundles/<version>/`` holding everything the
+service needs, described by a ``manifest.json`` with SHA-256 checksums:
+
+- ``embeddings.npy``  L2-normalized float32 FAQ embeddings
+- ``vocab.npy``       vocabulary words ordered by id (fixed-width unicode)
+- ``weights.pt``      SiameseNetwork state dict
+- ``faq_data.json``   FAQ questions and answers
+- ``faq_index.pkl``   optional search index built over the embeddings
+- ``faq_index_rows.npy``
+                      embeddings in IVF list order, with an ``ivf`` index
+- ``encoder*.ts``, ``encoder.onnx``, ``exports.json``
+                      optional compiled inference exports (inference_export.py)
+
+Arrays are opened with ``np.load(mmap_mode='r')`` and weights with
+``torch.load(mmap=True)``, so every worker maps the same file pages through
+the OS cache instead of holding a private copy; the search index runs on those
+mapped rows and its checksum is taken from the manifest rather than rehashed. ``bundles/CURRENT`` names the
+active version and is replaced atomically after a bundle is fully written.
+
+    python artifact_bundle.py build    # bundle the legacy artifacts in this directory
+    python artifact_bundle.py verify   # check the current bundle's checksums
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+import torch
+
+from faq_model_utils import SiameseNetwork, Vocab
+from retrieval import embeddings_checksum, normalize_rows, save_index, load_index
+from inference_export import write_exports
+from atomic_write import write_text_atomic
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_ROOT = os.path.join(BASE_DIR, 'bundles')
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+# Written next to the legacy files by siamese_faq_train.py; absent for older models
+MODEL_CONFIG_FILE = 'model_config.json'
+# Written next to the legacy files by calibration.py; absent until calibrated
+THRESHOLD_FILE = 'faq_threshold.json'
+FORMAT_VERSION = 1
+
+EMBEDDING_DIM = 50
+HIDDEN_DIM = 64
+
+
+def _sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _new_version(root):
+    version = time.strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(root, version if suffix == 1 else f"{version}-{suffix}")):
+        suffix += 1
+    return version if suffix == 1 else f"{version}-{suffix}"
+
+
+def _publish(root, bundle_dir, version, config, known=None, index=None):
+    """Checksum the bundle's files, write its manifest and make it current.
+
+    ``known`` maps file names to manifest entries that are already known to
+    be correct (files linked from another bundle), which are not re-hashed.
+    ``index`` describes ``faq_index.pkl`` (kind and embeddings checksum).
+    """
+    known = known or {}
+    files = {}
+    for fname in sorted(os.listdir(bundle_dir)):
+        path = os.path.join(bundle_dir, fname)
+        files[fname] = known.get(fname) or {'sha256': _sha256(path), 'bytes': os.path.getsize(path)}
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': config,
+        'files': files,
+    }
+    if index is not None:
+        manifest['index'] = index
+    write_text_atomic(os.path.join(bundle_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+    # Flip the pointer last so readers never see a half-written bundle
+    write_text_atomic(os.path.join(root, CURRENT_FILE), version + '\n')
+    return bundle_dir
+
+
+def _write_faq_rows(bundle_dir, faq_data, embeddings, index):
+    """Write the FAQ-dependent files; returns the manifest's index entry."""
+    rows = normalize_rows(embeddings)
+    np.save(os.path.join(bundle_dir, 'embeddings.npy'), rows)
+    with open(os.path.join(bundle_dir, 'faq_data.json'), 'w', encoding='utf-8') as f:
+        json.dump(faq_data, f, indent=4)
+    if index is None:
+        return None
+    checksum = save_index(index, os.path.join(bundle_dir, 'faq_index.pkl'), embeddings_checksum(rows))
+    if index.kind == 'ivf':
+        np.save(os.path.join(bundle_dir, IVF_ROWS_FILE), rows[index.list_ids])
+    return {'kind': index.kind, 'embeddings_sha1': checksum}
+
+
+def write_bundle(root, model, vocab, faq_data, embeddings, max_len, index=None, version=None, exports=()):
+    """Write a new bundle version under ``root`` and make it current.
+
+    ``exports`` lists compiled inference backends to include (see
+    inference_export.py). Returns the bundle directory.
+    """
+    os.makedirs(root, exist_ok=True)
+    version = version or _new_version(root)
+    bundle_dir = os.path.join(root, version)
+    os.makedirs(bundle_dir, exist_ok=False)
+
+    index_meta = _write_faq_rows(bundle_dir, faq_data, embeddings, index)
+    np.save(os.path.join(bundle_dir, 'vocab.npy'), np.array(vocab.words(), dtype=np.str_))
+    torch.save({k: v.cpu() for k, v in model.state_dict().items()}, os.path.join(bundle_dir, 'weights.pt'))
+    if exports:
+        write_exports(model, bundle_dir, max_len, exports)
+
+    config = {
+        'vocab_size': len(vocab),
+        'embedding_dim': model.embedding.embedding_dim,
+        'hidden_dim': model.fc.out_features,
+        'max_len': max_len,
+        'packed': bool(getattr(model, 'packed', False)),
+        'faq_count': len(faq_data),
+    }
+    return _publish(root, bundle_dir, version, config, index=index_meta)
+
+
+# Files that depend on the FAQ rows; everything else is shared between versions
+IVF_ROWS_FILE = 'faq_index_rows.npy'
+FAQ_ROW_FILES = ('embeddings.npy', 'faq_data.json', 'faq_index.pkl', IVF_ROWS_FILE)
+
+
+def derive_bundle(root, base_dir, faq_data, embeddings, index=None, version=None):
+    """New bundle version with different FAQ rows but the model of ``base_dir``.
+
+    Weights, vocabulary and inference exports are hard-linked from the base
+    bundle (copied where links are not supported) and keep their manifest
+    checksums; only the FAQ rows are written. Returns the bundle directory.
+    """
+    base_manifest = read_manifest(base_dir)
+    version = version or _new_version(root)
+    bundle_dir = os.path.join(root, version)
+    os.makedirs(bundle_dir, exist_ok=False)
+
+    known = {}
+    for fname, meta in base_manifest['files'].items():
+        if fname in FAQ_ROW_FILES:
+            continue
+        src, dst = os.path.join(base_dir, fname), os.path.join(bundle_dir, fname)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+        known[fname] = meta
+    index_meta = _write_faq_rows(bundle_dir, faq_data, embeddings, index)
+
+    config = dict(base_manifest['config'], faq_count=len(faq_data))
+    return _publish(root, bundle_dir, version, config, known, index_meta)
+
+
+def current_bundle_dir(root=BUNDLE_ROOT):
+    """Directory of the active bundle, or ``None`` when there is none."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    bundle_dir = os.path.join(root, version)
+    return bundle_dir if os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE)) else None
+
+
+def read_manifest(bundle_dir):
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verify_bundle(bundle_dir):
+    """Raise ``ValueError`` if any file does not match its manifest checksum."""
+    manifest = read_manifest(bundle_dir)
+    for fname, meta in manifest['files'].items():
+        path = os.path.join(bundle_dir, fname)
+        if not os.path.exists(path):
+            raise ValueError(f"Bundle file missing: {path}")
+        if _sha256(path) != meta['sha256']:
+            raise ValueError(f"Checksum mismatch for {path}")
+    return manifest
+
+
+def load_bundle(bundle_dir, device=None, verify=False):
+    """Load a bundle; returns a dict with model, vocab, faq_data, embeddings, max_len, index, manifest."""
+    if device is None:
+        device = torch.device('cpu')
+    manifest = verify_bundle(bundle_dir) if verify else read_manifest(bundle_dir)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} in {bundle_dir}")
+    config = manifest['config']
+
+    embeddings = np.load(os.path.join(bundle_dir, 'embeddings.npy'), mmap_mode='r')
+    vocab = Vocab.from_words(np.load(os.path.join(bundle_dir, 'vocab.npy'), mmap_mode='r').tolist())
+    with open(os.path.join(bundle_dir, 'faq_data.json'), 'r', encoding='utf-8') as f:
+        faq_data = json.load(f)
+
+    state_dict = torch.load(os.path.join(bundle_dir, 'weights.pt'), map_location='cpu', mmap=True, weights_only=True)
+    model = SiameseNetwork(config['vocab_size'], config['embedding_dim'], config['hidden_dim'],
+                           packed=config.get('packed', False))
+    # assign=True keeps the memory-mapped tensors instead of copying into fresh ones
+    model.load_state_dict(state_dict, assign=device.type == 'cpu')
+    model.to(device).eval()
+
+    index = None
+    index_path = os.path.join(bundle_dir, 'faq_index.pkl')
+    if os.path.exists(index_path):
+        # The stored rows are unit-norm, so the index searches the memmap in
+        # place; older manifests without an index entry fall back to hashing
+        grouped = None
+        rows_path = os.path.join(bundle_dir, IVF_ROWS_FILE)
+        if os.path.exists(rows_path):
+            grouped = np.load(rows_path, mmap_mode='r')
+        index = load_index(index_path, embeddings, normalized=True,
+                           checksum=manifest.get('index', {}).get('embeddings_sha1'), grouped=grouped)
+
+    return {
+        'model': model,
+        'vocab': vocab,
+        'faq_data': faq_data,
+        'embeddings': embeddings,
+        'max_len': config['max_len'],
+        'index': index,
+        'manifest': manifest,
+    }
+
+
+def read_model_config(base_dir):
+    """Model options saved with the legacy artifacts (``{}`` when there are none)."""
+    try:
+        with open(os.path.join(base_dir, MODEL_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def read_threshold(base_dir):
+    """Calibrated confidence threshold settings (``{}`` when there are none)."""
+    try:
+        with open(os.path.join(base_dir, THRESHOLD_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def weights_digest(base_dir):
+    """SHA-256 of the legacy model weights; bundles record theirs in the manifest."""
+    return _sha256(os.path.join(base_dir, 'siamese_faq_model.pt'))
+
+
+def bundle_legacy_artifacts(base_dir=BASE_DIR, root=None, version=None, exports=()):
+    """Convert vocab.pkl/faq_data.json/siamese_faq_model.pt/faq_embeddings.npy into a bundle."""
+    import pickle
+    with open(os.path.join(base_dir, 'vocab.pkl'), 'rb') as f:
+        vocab = pickle.load(f)
+    with open(os.path.join(base_dir, 'faq_data.json'), 'r', encoding='utf-8') as f:
+        faq_data = json.load(f)
+    config = read_model_config(base_dir)
+    max_len = config.get('max_len') or max(len(item['question'].split()) for item in faq_data) + 2
+    model = SiameseNetwork(len(vocab), EMBEDDING_DIM, HIDDEN_DIM, packed=config.get('packed', False))
+    model.load_state_dict(torch.load(os.path.join(base_dir, 'siamese_faq_model.pt'), map_location='cpu'))
+    embeddings = np.load(os.path.join(base_dir, 'faq_embeddings.npy'))
+    index = None
+    index_path = os.path.join(base_dir, 'faq_index.pkl')
+    if os.path.exists(index_path):
+        index = load_index(index_path, embeddings)
+    return write_bundle(root or os.path.join(base_dir, 'bundles'), model, vocab, faq_data, embeddings, max_len,
+                        index, version, exports)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify the FAQ artifact bundle")
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--root', default=BUNDLE_ROOT, help="Bundle root directory")
+    parser.add_argument('--version', help="Version name for 'build' (default: timestamp)")
+    parser.add_argument('--export', nargs='*', default=['torchscript', 'torchscript-int8'],
+                        choices=['torchscript', 'torchscript-int8', 'onnx'],
+                        help="Compiled inference exports to include in 'build'")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        bundle_dir = bundle_legacy_artifacts(BASE_DIR, args.root, args.version, args.export)
+        print(f"Wrote bundle {bundle_dir}")
+    else:
+        bundle_dir = current_bundle_dir(args.root)
+        if bundle_dir is None:
+            print(f"No current bundle under {args.root}")
+            sys.exit(1)
+        try:
+            manifest = verify_bundle(bundle_dir)
+        except ValueError as e:
+            print(f"Bundle verification failed: {e}")
+            sys.exit(1)
+        print(f"Bundle {manifest['version']} OK ({len(manifest['files'])} files)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+# asgi.py
+"""
+Asynchronous serving mode for the FAQ service:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Exposes the same routes as the Flask app in app.py and reuses its request
+handlers, but runs every CPU-bound call (encoder, Whisper) in a bounded
+per-endpoint thread pool. A slow transcription therefore only occupies the
+transcription pool while FAQ lookups keep their own workers. When an
+endpoint's pool and queue are full new requests are rejected right away with
+429 and a ``Retry-After`` header instead of piling up; 503 is returned while
+the model cannot be loaded.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as service
+from observability import CallbackMetric
+from transcription import WHISPER_PRELOAD
+
+logger = logging.getLogger(__name__)
+
+MAX_JSON_BODY = int(os.environ.get('FAQ_ASGI_MAX_JSON_BYTES', str(4 * 1024 * 1024)))
+MAX_AUDIO_BODY = int(os.environ.get('FAQ_ASGI_MAX_AUDIO_BYTES', str(32 * 1024 * 1024)))
+
+
+class Overloaded(Exception):
+    """An endpoint already has as many requests running and queued as allowed."""
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class EndpointPool:
+    """Bounded thread pool plus admission limit for one endpoint.
+
+    At most ``workers`` calls run concurrently and at most ``max_queue`` more
+    wait for a thread; anything beyond that raises ``Overloaded``. The
+    in-flight counter is only touched from the event loop thread.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"asgi-{name}")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one admission slot for the duration of the block."""
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise Overloaded(self.name)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def call(self, fn, *args):
+        """Run ``fn`` on the pool's threads without taking a slot (the caller holds one)."""
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def run(self, fn, *args):
+        async with self.slot():
+            return await self.call(fn, *args)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'capacity': self.capacity,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+
+faq_pool = EndpointPool(
+    'faq',
+    workers=int(os.environ.get('FAQ_ASGI_FAQ_WORKERS', '4')),
+    max_queue=int(os.environ.get('FAQ_ASGI_FAQ_QUEUE', '256')),
+)
+transcribe_pool = EndpointPool(
+    'transcribe',
+    workers=int(os.environ.get('FAQ_ASGI_TRANSCRIBE_WORKERS', '1')),
+    max_queue=int(os.environ.get('FAQ_ASGI_TRANSCRIBE_QUEUE', '4')),
+)
+
+CallbackMetric('faq_asgi_in_flight', 'Requests running or queued per endpoint pool',
+               lambda: {(p.name,): p.in_flight for p in (faq_pool, transcribe_pool)}, labelnames=('pool',))
+CallbackMetric('faq_asgi_rejected_total', 'Requests rejected with 429 per endpoint pool',
+               lambda: {(p.name,): p.rejected for p in (faq_pool, transcribe_pool)}, kind='counter',
+               labelnames=('pool',))
+
+
+# === HTTP helpers ===
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, DELETE, OPTIONS'),
+]
+
+
+async def send_json(send, status, payload, headers=()):
+    await send_body(send, status, json.dumps(payload).encode('utf-8'), b'application/json', headers)
+
+
+async def send_body(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type),
+            (b'content-length', str(len(body)).encode()),
+            *CORS_HEADERS,
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive, limit):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError("Client disconnected")
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def read_json(receive):
+    body = await read_body(receive, MAX_JSON_BODY)
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+# === Routes ===
+
+async def faq(scope, receive, send):
+    payload, status = await faq_pool.run(service.faq_response_payload, await read_json(receive))
+    await send_json(send, status, payload)
+
+
+async def faq_batch(scope, receive, send):
+    payload, status = await faq_pool.run(service.faq_batch_payload, await read_json(receive))
+    await send_json(send, status, payload)
+
+
+class BodyPipe:
+    """Blocking file object over a request body that the event loop is still receiving.
+
+    ``fill`` runs on the loop and queues chunks as they arrive; ``read`` runs on
+    the parsing thread and returns whatever is queued, so the multipart parser
+    (and ffmpeg behind it) works through the upload while it is in transit.
+    """
+
+    def __init__(self):
+        self._chunks = queue.SimpleQueue()
+        self._buffer = b''
+        self._eof = False
+
+    async def fill(self, receive, limit):
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionError("Client disconnected")
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                raise BodyTooLarge()
+            if chunk:
+                self._chunks.put(chunk)
+            if not message.get('more_body', False):
+                self._chunks.put(b'')
+                return
+
+    def abort(self):
+        """Make the reader fail instead of waiting for chunks that won't come."""
+        self._chunks.put(None)
+
+    def _next_chunk(self):
+        chunk = self._chunks.get()
+        if chunk is None:
+            raise ConnectionError("Upload aborted")
+        if not chunk:
+            self._eof = True
+        self._buffer += chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._eof:
+                self._next_chunk()
+        elif not self._buffer and not self._eof:
+            self._next_chunk()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _parse_upload(pipe, content_type):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': content_type,
+        'wsgi.input': pipe,
+        # Read to the end of the pipe; the size limit is enforced by BodyPipe.fill
+        'wsgi.input_terminated': True,
+    }
+    _, _, files = service.AudioFormDataParser().parse_from_environ(environ)
+    return files
+
+
+async def receive_upload(scope, receive):
+    """Parse the multipart audio upload while it arrives; returns its files.
+
+    The parse runs on the loop's default executor rather than the
+    transcription pool, so slow uploads don't hold Whisper's threads.
+    """
+    pipe = BodyPipe()
+    parsing = asyncio.get_running_loop().run_in_executor(
+        None, _parse_upload, pipe, header(scope, b'content-type'))
+    try:
+        await pipe.fill(receive, MAX_AUDIO_BODY)
+    except BaseException:
+        pipe.abort()
+        with contextlib.suppress(Exception):
+            await parsing
+        raise
+    return await parsing
+
+
+def close_uploads(files):
+    # Stops ffmpeg for an upload that never reached decode_upload (a no-op otherwise)
+    for storage in files.values():
+        storage.close()
+
+
+async def transcribe(scope, receive, send):
+    # The slot is taken before the upload is read, so a full pool rejects it up front
+    async with transcribe_pool.slot():
+        files = await receive_upload(scope, receive)
+        try:
+            payload, status = await transcribe_pool.call(service.transcribe_payload, files)
+        finally:
+            close_uploads(files)
+    await send_json(send, status, payload)
+
+
+async def voice_faq(scope, receive, send):
+    started = time.perf_counter()
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    stream = params.get('stream') == ['1']
+    collection = params['collection'][0] if 'collection' in params else None
+    # A streamed answer keeps transcribing after the first response, so the
+    # slot is held until the generator is exhausted or closed
+    async with transcribe_pool.slot():
+        files = await receive_upload(scope, receive)
+        try:
+            payload, status = await transcribe_pool.call(
+                service.voice_faq_payload, files, stream, started, collection)
+        finally:
+            close_uploads(files)
+        if not stream or status != 200:
+            await send_json(send, status, payload)
+            return
+        await send_events(send, payload)
+
+
+async def send_events(send, events):
+    """Stream ``events`` as newline-delimited JSON: partial transcripts first, the answer last."""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'application/x-ndjson'), *CORS_HEADERS],
+    })
+    pending = None
+    try:
+        while True:
+            # Each window blocks on Whisper, so advance the generator off the loop;
+            # shielded so a disconnect can't leave it running unnoticed
+            pending = transcribe_pool.call(next, events, None)
+            try:
+                event = await asyncio.shield(pending)
+            except Exception as e:
+                # The 200 is already out, so report the failure in the body
+                # instead of letting app() start a second response
+                logger.error(f"Error streaming voice FAQ events: {e}")
+                event = {'event': 'error', 'error': str(e)}
+                await send({'type': 'http.response.body', 'body': (json.dumps(event) + '\n').encode('utf-8'),
+                            'more_body': True})
+                break
+            if event is None:
+                break
+            await send({'type': 'http.response.body', 'body': (json.dumps(event) + '\n').encode('utf-8'),
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # On a disconnect, wait for the window in progress, then close the
+        # generator so its Whisper decoding stops before the slot is released
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+        await transcribe_pool.call(events.close)
+
+
+async def admin_faqs(scope, receive, send):
+    data = await read_json(receive)
+    payload, status = await faq_pool.run(
+        service.admin_faq_payload, scope['method'], data, header(scope, b'authorization')
+    )
+    await send_json(send, status, payload)
+
+
+async def home(scope, receive, send):
+    await send_json(send, 200, {'message': 'FAQ backend is up and running! ✅'})
+
+
+async def healthz(scope, receive, send):
+    await send_json(send, 200, service.registry.status())
+
+
+async def readyz(scope, receive, send):
+    await send_json(send, 200 if service.registry.ready else 503, service.registry.status())
+
+
+async def stats(scope, receive, send):
+    payload = service.faq_stats_payload()
+    payload['asgi'] = {'faq': faq_pool.stats(), 'transcribe': transcribe_pool.stats()}
+    await send_json(send, 200, payload)
+
+
+async def metrics(scope, receive, send):
+    await send_body(send, 200, service.render_metrics().encode('utf-8'), service.METRICS_CONTENT_TYPE.encode())
+
+
+ROUTES = {
+    ('POST', '/api/faq'): faq,
+    ('POST', '/api/faq/batch'): faq_batch,
+    ('GET', '/api/faq/stats'): stats,
+    ('POST', '/api/transcribe'): transcribe,
+    ('POST', '/api/voice-faq'): voice_faq,
+    ('GET', '/api/admin/faqs'): admin_faqs,
+    ('POST', '/api/admin/faqs'): admin_faqs,
+    ('PUT', '/api/admin/faqs'): admin_faqs,
+    ('DELETE', '/api/admin/faqs'): admin_faqs,
+    ('GET', '/'): home,
+    ('GET', '/healthz'): healthz,
+    ('GET', '/readyz'): readyz,
+    ('GET', '/metrics'): metrics,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if os.environ.get('FAQ_PRELOAD', '1') == '1':
+                try:
+                    await faq_pool.run(service.registry.load)
+                except Exception as e:
+                    # Stay up; /readyz reports 503 and requests retry the load
+                    logger.error(f"Failed to preload FAQ model: {e}")
+            if WHISPER_PRELOAD:
+                service.transcription_pool.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            faq_pool.executor.shutdown(wait=False)
+            transcribe_pool.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path'].rstrip('/') or '/'
+    if method == 'OPTIONS':
+        # CORS preflight
+        status = 204 if any(p == path for _, p in ROUTES) else 404
+        await send({'type': 'http.response.start', 'status': status, 'headers': CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    handler = ROUTES.get((method, path))
+    if handler is None:
+        allowed = any(p == path for _, p in ROUTES)
+        await send_json(send, 405 if allowed else 404, {'error': 'Method not allowed' if allowed else 'Not found'})
+        return
+
+    try:
+        await handler(scope, receive, send)
+    except Overloaded as e:
+        logger.warning(f"Rejecting request to {path}: {e} pool is full")
+        await send_json(send, 429, {'error': 'Server busy, please retry shortly'}, [(b'retry-after', b'1')])
+    except BodyTooLarge:
+        await send_json(send, 413, {'error': 'Request body too large'})
+    except ConnectionError:
+        pass
+    except Exception as e:
+        logger.error(f"Error handling {path}: {e}")
+        status = 503 if not service.registry.ready else 500
+        await send_json(send, status, {'error': str(e)})
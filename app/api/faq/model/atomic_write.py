@@ -0,0 +1,56 @@
+# atomic_write.py
+
+"""
+Atomic file replacement for everything the service reloads or resumes from:
+bundles, legacy artifacts, collections, the calibrated threshold and
+bulk-scoring checkpoints.
+
+Content goes to a unique temp file in the target's directory
+(``tempfile.mkstemp``), so concurrent writers, threads of one worker
+included, never share one, and is renamed over the target with
+``os.replace``: readers see the old file or the new one, never a partial
+write. The temp file is removed when anything fails.
+"""
+import os
+import json
+import tempfile
+import contextlib
+
+# mkstemp creates files owner-only; the service may read them as another user
+FILE_MODE = 0o644
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Temp path next to ``path`` that replaces it when the block succeeds.
+
+    For writers that take a path rather than a file object (e.g. ``save_index``).
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp
+        os.chmod(tmp, FILE_MODE)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+
+
+def write_atomic(path, write, binary=True):
+    """Replace ``path`` with what ``write(f)`` writes to the open temp file."""
+    with atomic_path(path) as tmp:
+        with open(tmp, 'wb') if binary else open(tmp, 'w', encoding='utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_text_atomic(path, text):
+    write_atomic(path, lambda f: f.write(text), binary=False)
+
+
+def write_json_atomic(path, data, indent=None):
+    write_atomic(path, lambda f: json.dump(data, f, indent=indent), binary=False)
@@ -0,0 +1,166 @@
+# batching.py
+
+"""
+In-process micro-batching for concurrent FAQ queries.
+
+Request threads submit one item each and block on a future. A single
+worker thread drains the queue: it takes the first waiting item, keeps
+collecting until ``max_batch_size`` items are queued or ``max_wait_ms`` has
+passed, runs the whole batch through one call of ``batch_fn`` and fans the
+results back out to the waiting requests.
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised by ``submit`` when the batcher is already at ``max_queue``."""
+
+
+class BatcherStats:
+    """Running counters for queue depth, batch size and queue wait time."""
+
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.max_batch_size = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.batch_ms_total = 0.0
+        self.batch_size_hist = {b: 0 for b in self.BATCH_SIZE_BUCKETS}
+        self.batch_size_hist['+Inf'] = 0
+
+    def record_submit(self, depth):
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_batch(self, size, waits_ms, batch_ms, failed=False):
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.errors += int(failed)
+            self.max_batch_size = max(self.max_batch_size, size)
+            self.wait_ms_total += sum(waits_ms)
+            self.wait_ms_max = max(self.wait_ms_max, max(waits_ms))
+            self.batch_ms_total += batch_ms
+            for bucket in self.BATCH_SIZE_BUCKETS:
+                if size <= bucket:
+                    self.batch_size_hist[bucket] += 1
+                    break
+            else:
+                self.batch_size_hist['+Inf'] += 1
+
+    def snapshot(self, queue_depth):
+        with self._lock:
+            return {
+                'queue_depth': queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted,
+                'batches': self.batches,
+                'errors': self.errors,
+                'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'batch_size_hist': {str(k): v for k, v in self.batch_size_hist.items()},
+                'avg_wait_ms': self.wait_ms_total / self.items if self.items else 0.0,
+                'max_wait_ms': self.wait_ms_max,
+                'avg_batch_ms': self.batch_ms_total / self.batches if self.batches else 0.0,
+            }
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item calls into batched ``batch_fn`` calls.
+
+    ``batch_fn(items)`` must return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=32, max_wait_ms=2.0, max_queue=1024, name="faq-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self.name = name
+        self.stats = BatcherStats()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        # Started lazily (and restarted after fork) so a pre-forking server
+        # doesn't inherit a dead worker thread from its master process.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit_async(self, item):
+        """Queue ``item`` and return a Future for its result."""
+        self._ensure_worker()
+        depth = self._queue.qsize()
+        if depth >= self.max_queue:
+            raise QueueFullError(f"{self.name} queue is full ({depth} items)")
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        self.stats.record_submit(depth + 1)
+        return future
+
+    def submit(self, item, timeout=None):
+        """Queue ``item`` and block until its batch has been processed."""
+        return self.submit_async(item).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            waits_ms = [(started - queued_at) * 1000.0 for _, _, queued_at in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logger.error(f"Micro-batch of {len(items)} failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = False
+            self.stats.record_batch(len(batch), waits_ms, (time.perf_counter() - started) * 1000.0, failed)
+
+    def metrics(self):
+        return self.stats.snapshot(self._queue.qsize())
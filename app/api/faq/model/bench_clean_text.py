@@ -0,0 +1,112 @@
+# bench_clean_text.py
+"""
+Parity check and microbenchmark for the fast ``clean_text`` pipeline.
+
+Every FAQ question (plus punctuation/casing variants and the small-talk
+phrases) is cleaned with both ``clean_text`` and the original NLTK pipeline
+``clean_text_reference``; any difference is reported and the script exits
+non-zero. It then times both implementations on the same inputs.
+
+    python bench_clean_text.py [--repeat 20] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faq_model_utils
+from faq_model_utils import clean_text, clean_text_reference, load_dataset, NORMALIZED_PHRASES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_PATHS = [
+    os.path.join(BASE_DIR, 'faq_data.json'),
+    os.path.join(BASE_DIR, '..', 'python', 'data', 'Ecommerce_FAQ_Chatbot_dataset.json'),
+]
+
+
+def load_questions():
+    questions = []
+    for path in DATASET_PATHS:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        items = data if isinstance(data, list) else load_dataset(path)
+        questions.extend(item['question'] for item in items)
+    return questions
+
+
+def make_corpus(questions):
+    texts = list(questions) + list(NORMALIZED_PHRASES)
+    for q in questions:
+        texts += [
+            q.upper(),
+            q.rstrip('?.!'),
+            f"  {q}   please!! ",
+            f"hi, {q.lower()}",
+            f"hi,,{q.lower()}",
+            f"what's this? i can't {q.lower()}",
+            q.replace(' ', ', ', 1),
+            q.replace(' ', '-', 1),
+            f"{q} costs 1,000 dollars e.g. today.",
+            f"i cannot {q.lower()}..",
+        ]
+    return texts
+
+
+def check_parity(texts):
+    mismatches = []
+    for text in texts:
+        fast, reference = clean_text(text), clean_text_reference(text)
+        if fast != reference:
+            mismatches.append({'text': text, 'clean_text': fast, 'reference': reference})
+    return mismatches
+
+
+def time_per_call(fn, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    questions = load_questions()
+    texts = make_corpus(questions)
+    mismatches = check_parity(texts)
+
+    # Warm both paths (lemma memo, NLTK lazy loaders) before timing
+    time_per_call(clean_text_reference, texts, 1)
+    time_per_call(clean_text, texts, 1)
+    faq_model_utils.clean_text_stats.update(fast_path=0, nltk_path=0)
+
+    results = {
+        'texts': len(texts),
+        'mismatches': len(mismatches),
+        'reference_us_per_call': time_per_call(clean_text_reference, texts, args.repeat),
+        'fast_us_per_call': time_per_call(clean_text, texts, args.repeat),
+        'questions_fast_us_per_call': time_per_call(clean_text, questions, args.repeat),
+    }
+    stats = faq_model_utils.clean_text_stats
+    results['fast_path_ratio'] = stats['fast_path'] / max(1, stats['fast_path'] + stats['nltk_path'])
+    results['speedup'] = results['reference_us_per_call'] / results['fast_us_per_call']
+
+    for m in mismatches[:20]:
+        print(f"MISMATCH {m['text']!r}: {m['clean_text']!r} != {m['reference']!r}")
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(results, mismatch_examples=mismatches[:100]), f, indent=2)
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# bench_cold_start.py
+"""
+Cold-start benchmark: time from a fresh interpreter to the first answered
+``/api/faq`` request.
+
+Each run starts a new Python process with network downloads disabled,
+imports ``app``, loads the model and answers one query through the Flask
+test client. The median total is compared with a budget and the script
+exits non-zero when it is exceeded, so the number can be tracked in CI.
+
+    python bench_cold_start.py [--runs 5] [--budget-ms 5000] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter()
+app.registry.load()
+t_load = time.perf_counter()
+resp = app.app.test_client().post('/api/faq', json={'message': 'How can I track my order?'})
+t_first = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t_import - t0) * 1000,
+    'load_ms': (t_load - t_import) * 1000,
+    'first_request_ms': (t_first - t_load) * 1000,
+    'status': resp.status_code,
+    'answered': 'error' not in resp.get_json(),
+    'heavy_modules_imported': [m for m in ('whisper', 'ffmpeg') if m in sys.modules],
+}))
+'''
+
+
+def run_once():
+    env = dict(os.environ, FAQ_NLTK_DOWNLOAD='0', FAQ_RELOAD_INTERVAL='0')
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=BASE_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    total_ms = (time.perf_counter() - start) * 1000
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['total_ms'] = total_ms
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import-to-first-answer cold start time")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('FAQ_COLD_START_BUDGET_MS', '5000')))
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {
+        key: statistics.median(r[key] for r in runs)
+        for key in ('total_ms', 'import_ms', 'load_ms', 'first_request_ms')
+    }
+    summary.update({
+        'runs': args.runs,
+        'budget_ms': args.budget_ms,
+        'within_budget': summary['total_ms'] <= args.budget_ms,
+        'all_answered': all(r['answered'] for r in runs),
+        'heavy_modules_imported': sorted({m for r in runs for m in r['heavy_modules_imported']}),
+    })
+
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'runs': runs}, f, indent=2)
+
+    ok = summary['within_budget'] and summary['all_answered'] and not summary['heavy_modules_imported']
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# bench_inference.py
+"""
+Parity check and latency benchmark for the inference backends in
+inference_export.py.
+
+The fp32 model is loaded from the current artifacts; every backend is built
+from it (using the exports on disk when they are up to date) and compared
+with it on the FAQ questions from ``faq_data.json`` and their bench_clean_text
+variants. Latency is measured for single queries (the ``/api/faq`` path) and
+for full batches. Exits non-zero when a backend fails the parity check.
+
+    python bench_inference.py [--backends eager int8 torchscript ...] [--repeat 200] [--json results.json]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import torch
+
+from bench_clean_text import make_corpus
+from faq_model_utils import batch_tensor, clean_text
+from inference_export import BACKENDS, build_inference_model, parity_report
+from model_registry import BASE_DIR, BUNDLE_DIR, load_artifacts
+from artifact_bundle import current_bundle_dir
+
+
+def latency_ms(model, seqs, repeat):
+    times = []
+    with torch.inference_mode():
+        model.forward_once(seqs)  # warm up
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model.forward_once(seqs)
+            times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {'p50': statistics.median(times), 'p95': times[int(0.95 * (len(times) - 1))]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference backends with the fp32 model")
+    parser.add_argument('--backends', nargs='*', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--threads', type=int, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    artifacts = load_artifacts(BASE_DIR, torch.device('cpu'), backend='eager')
+    reference, vocab, max_len = artifacts.model, artifacts.vocab, artifacts.max_len
+    artifact_dir = current_bundle_dir(f"{BASE_DIR}/{BUNDLE_DIR}") or BASE_DIR
+
+    questions = [item['question'] for item in artifacts.faq_data]
+    texts = [clean_text(t) for t in make_corpus(questions)]
+    single = batch_tensor(reference, [vocab.encode(texts[0])], max_len)
+    batch = batch_tensor(reference, [vocab.encode(t) for t in texts[:args.batch_size]], max_len)
+
+    results, failed = {}, []
+    for backend in args.backends:
+        try:
+            model = build_inference_model(reference, backend, artifact_dir)
+        except Exception as e:
+            results[backend] = {'error': str(e)}
+            continue
+        report = parity_report(reference, model, texts, vocab, max_len, artifacts.embeddings)
+        report['faq_questions_top1_agreement'] = parity_report(
+            reference, model, [clean_text(q) for q in questions], vocab, max_len, artifacts.embeddings
+        )['top1_agreement']
+        report['single_ms'] = latency_ms(model, single, args.repeat)
+        report[f'batch{len(batch)}_ms'] = latency_ms(model, batch, max(1, args.repeat // 10))
+        results[backend] = report
+        if not report['ok']:
+            failed.append(backend)
+
+    eager = results.get('eager', {}).get('single_ms')
+    for backend, report in results.items():
+        if eager and 'single_ms' in report:
+            report['single_speedup'] = eager['p50'] / report['single_ms']['p50']
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'threads': torch.get_num_threads(), 'texts': len(texts), 'results': results}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
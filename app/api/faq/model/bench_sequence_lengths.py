@@ -0,0 +1,134 @@
+# bench_sequence_lengths.py
+"""
+Parity check and short/long-query benchmark for variable-length encoding.
+
+1. Parity: the deployed (fixed-padding) model must produce bit-identical
+   embeddings through ``encode_text``/``encode_texts`` and the original
+   pad-everything-to-``max_len`` loop; any difference fails the run.
+2. Speed: the same weights are run as a fixed-padding model and as a packed
+   model (``SiameseNetwork(packed=True)``) on a short-query workload (1-4
+   tokens) and a long-query workload (several questions joined, mostly
+   longer than ``max_len``), one query at a time and as batches.
+3. Padding: share of pad positions in batches of FAQ questions drawn at
+   random versus bucketed by length (as ``LengthBucketSampler`` does).
+
+    python bench_sequence_lengths.py [--repeat 3] [--threads 1] [--json results.json]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+import torch
+
+from faq_model_utils import (
+    SiameseNetwork, clean_text, encode_text, encode_texts, length_buckets, pad_sequence,
+)
+from model_registry import BASE_DIR, load_artifacts
+
+
+def reference_encode(model, texts, vocab, max_len, batch_size=256):
+    """The original encode_texts: every input padded to max_len, in input order."""
+    encoded = [pad_sequence(vocab.encode(t), max_len) for t in texts]
+    outputs = []
+    with torch.inference_mode():
+        for start in range(0, len(encoded), batch_size):
+            outputs.append(model.forward_once(torch.tensor(encoded[start:start + batch_size], dtype=torch.long)).numpy())
+    return np.concatenate(outputs)
+
+
+def workloads(questions, seed=0):
+    rng = random.Random(seed)
+    words = [q.split() for q in questions]
+    short = [' '.join(w[:rng.randint(1, 4)]) for w in words]
+    long = [' '.join(rng.sample(questions, rng.randint(2, 4))) for _ in questions]
+    return {'short': short, 'long': long}
+
+
+def time_workload(model, texts, vocab, max_len, repeat, batch_size):
+    encode_texts(model, texts, vocab, max_len, batch_size, clean=False)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            encode_text(model, text, vocab, max_len)
+    single_ms = (time.perf_counter() - start) / (repeat * len(texts)) * 1000
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode_texts(model, texts, vocab, max_len, batch_size, clean=False)
+    batch_qps = repeat * len(texts) / (time.perf_counter() - start)
+    return {'single_ms': single_ms, 'batch_qps': batch_qps}
+
+
+def pad_ratio(batches, lengths):
+    real = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+    return 1 - real / padded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Variable-length encoding parity check and benchmark")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--threads', type=int, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    artifacts = load_artifacts(BASE_DIR, torch.device('cpu'), backend='eager')
+    vocab, max_len = artifacts.vocab, artifacts.max_len
+    fixed = artifacts.model
+    packed = SiameseNetwork(len(vocab), fixed.embedding.embedding_dim, fixed.fc.out_features, packed=True)
+    packed.load_state_dict(fixed.state_dict())
+    packed.eval()
+
+    questions = [clean_text(item['question']) for item in artifacts.faq_data]
+    loads = workloads(questions)
+
+    # 1. Deployed model: new code paths vs the original loop
+    texts = questions + loads['short'] + loads['long']
+    ref = reference_encode(fixed, texts, vocab, max_len)
+    batched = encode_texts(fixed, texts, vocab, max_len, clean=False)
+    single = np.stack([encode_text(fixed, t, vocab, max_len) for t in texts])
+    parity = {
+        'texts': len(texts),
+        'encode_texts_identical': bool(np.array_equal(ref, batched)),
+        'encode_text_identical': bool(np.array_equal(reference_encode(fixed, texts, vocab, max_len, batch_size=1), single)),
+    }
+
+    # 2. Fixed vs packed on short and long queries
+    speed = {}
+    for name, workload in loads.items():
+        lengths = [len(vocab.encode(t)) for t in workload]
+        speed[name] = {
+            'mean_tokens': float(np.mean(lengths)),
+            'truncated_by_max_len': sum(n > max_len for n in lengths),
+            'fixed': time_workload(fixed, workload, vocab, max_len, args.repeat, args.batch_size),
+            'packed': time_workload(packed, workload, vocab, max_len, args.repeat, args.batch_size),
+        }
+        speed[name]['single_speedup'] = speed[name]['fixed']['single_ms'] / speed[name]['packed']['single_ms']
+        speed[name]['batch_speedup'] = speed[name]['packed']['batch_qps'] / speed[name]['fixed']['batch_qps']
+
+    # 3. Padding in training batches
+    lengths = [max(1, len(vocab.encode(q))) for q in questions]
+    order = list(range(len(lengths)))
+    random.shuffle(order)
+    padding = {
+        'random_batches': pad_ratio([order[i:i + 16] for i in range(0, len(order), 16)], lengths),
+        'bucketed_batches': pad_ratio(length_buckets(lengths, 16, shuffle=True), lengths),
+        'fixed_max_len': 1 - sum(min(n, max_len) for n in lengths) / (len(lengths) * max_len),
+    }
+
+    results = {'max_len': max_len, 'threads': torch.get_num_threads(), 'parity': parity, 'speed': speed, 'padding': padding}
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if parity['encode_texts_identical'] and parity['encode_text_identical'] else 1)
+
+
+if __name__ == '__main__':
+    main()
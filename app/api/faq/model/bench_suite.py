@@ -0,0 +1,336 @@
+# bench_suite.py
+"""
+Offline benchmark suite for the FAQ service, with JSON output for comparing
+commits.
+
+1. Microbenchmarks (microseconds per call): ``clean_text``, the exact and
+   near-duplicate matching tiers, ``Vocab.encode`` and ``forward_once`` (one
+   query, and per query in a batch) on the FAQ questions and their
+   bench_clean_text variants.
+2. Search: for each ``--sizes`` corpus (synthetic FAQs: the real embeddings
+   plus noisy copies, so real queries still have a true match), index build
+   time, single-query search and batched search per query, for every
+   ``--index`` kind. IVF also reports its recall@10.
+3. Load: for each ``--load-sizes`` corpus, a synthetic snapshot is installed
+   in the Flask app's registry and ``--concurrency`` threads post a mix of
+   FAQ variants, small talk and unanswerable queries to ``/api/faq`` through
+   the test client for ``--duration`` seconds. A few ``/api/faq/batch`` calls
+   follow. The answer cache is off unless ``--cache`` is given.
+
+Everything runs in-process and offline. ``--compare old.json`` lists the
+timings and rates that got worse by more than ``--tolerance``, and the
+script exits non-zero if there are any.
+
+    python bench_suite.py [--sizes 1000 100000 1000000] [--load-sizes 1000 100000 1000000]
+                          [--duration 5] [--concurrency 8] [--json results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# === Helpers ===
+
+def per_call_us(fn, items, repeat):
+    """Median and best microseconds per call of ``fn`` over ``items``."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        runs.append((time.perf_counter() - start) / len(items) * 1e6)
+    return {'median_us': statistics.median(runs), 'min_us': min(runs)}
+
+
+def percentiles_ms(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                                    capture_output=True, text=True, timeout=10).stdout.strip())
+    except Exception:
+        commit, dirty = None, None
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+# === Synthetic corpora ===
+
+class CyclicFAQs:
+    """``n`` FAQ entries backed by the real ones (entry ``i`` is ``faq_data[i % len]``)."""
+
+    def __init__(self, faq_data, n):
+        self.faq_data = faq_data
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return self.faq_data[i % len(self.faq_data)]
+
+
+def synthetic_embeddings(embeddings, n, noise=0.05, seed=0, chunk=1 << 18):
+    """``n`` normalized rows: the real embeddings first, then noisy copies of them."""
+    from retrieval import normalize_rows
+    base = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    rng = np.random.default_rng(seed)
+    out = np.empty((n, base.shape[1]), dtype=np.float32)
+    out[:min(n, len(base))] = base[:n]
+    for start in range(len(base), n, chunk):
+        stop = min(start + chunk, n)
+        rows = base[np.arange(start, stop) % len(base)]
+        out[start:stop] = normalize_rows(rows + rng.normal(0, noise, rows.shape).astype(np.float32))
+    return out
+
+
+def query_mix(questions, seed=0):
+    """FAQ variants, small talk and queries the FAQ cannot answer."""
+    from bench_clean_text import make_corpus
+    from faq_model_utils import NORMALIZED_PHRASES
+    rng = random.Random(seed)
+    words = sorted({w for q in questions for w in q.lower().split()})
+    unanswerable = [' '.join(rng.sample(words, rng.randint(3, 8))) for _ in range(len(questions))]
+    return make_corpus(questions) + list(NORMALIZED_PHRASES) + unanswerable
+
+
+# === Benchmarks ===
+
+def micro_benchmarks(artifacts, texts, repeat, batch_size):
+    from faq_model_utils import batch_tensor, clean_text
+    from fast_match import exact_match, near_match
+    model, vocab, max_len = artifacts.model, artifacts.vocab, artifacts.max_len
+    cleaned = [clean_text(t) for t in texts]
+    singles = [batch_tensor(model, [vocab.encode(t)], max_len) for t in cleaned[:200]]
+    batches = [batch_tensor(model, [vocab.encode(t) for t in cleaned[i:i + batch_size]], max_len)
+               for i in range(0, len(cleaned) - batch_size + 1, batch_size)][:10]
+    with torch.inference_mode():
+        results = {
+            'texts': len(texts),
+            'clean_text': per_call_us(clean_text, texts, repeat),
+            'fast_match_exact': per_call_us(lambda t: exact_match(t, artifacts.matcher), cleaned, repeat),
+            'fast_match_near': per_call_us(lambda t: near_match(t, artifacts.matcher), cleaned, repeat),
+            'vocab_encode': per_call_us(vocab.encode, cleaned, repeat),
+            'forward_once_single': per_call_us(model.forward_once, singles, repeat),
+        }
+        if batches:
+            batch = per_call_us(model.forward_once, batches, repeat)
+            results[f'forward_once_batch{batch_size}_per_query'] = {k: v / batch_size for k, v in batch.items()}
+    return results
+
+
+def search_benchmarks(embeddings, n, kinds, repeat, n_queries=256, batch_size=64):
+    from retrieval import build_index, make_eval_queries, measure_recall
+    corpus = synthetic_embeddings(embeddings, n)
+    queries = make_eval_queries(corpus, n_queries=n_queries, seed=1)
+    results = {}
+    for kind in kinds:
+        start = time.perf_counter()
+        try:
+            index = build_index(corpus, kind)
+        except ImportError as e:
+            results[kind] = {'error': str(e)}
+            continue
+        row = {'build_s': time.perf_counter() - start}
+        row['search_single'] = per_call_us(lambda q: index.search(q, k=1), queries[:64], repeat)
+        batch = per_call_us(lambda b: index.search_batch(b, k=1), [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)], repeat)
+        row[f'search_batch{batch_size}_per_query'] = {k: v / batch_size for k, v in batch.items()}
+        if kind != 'flat':
+            row['recall_at_10'] = measure_recall(index, queries, k=10)
+        results[kind] = row
+        del index
+    return results
+
+
+def load_test(service, artifacts, n, texts, duration, concurrency, batch_size, seed=0):
+    from model_registry import ModelArtifacts
+    from retrieval import SimilarityIndex
+    embeddings = synthetic_embeddings(artifacts.embeddings, n)
+    snapshot = ModelArtifacts(
+        artifacts.model, artifacts.vocab, CyclicFAQs(artifacts.faq_data, n), embeddings,
+        artifacts.max_len, artifacts.device, artifacts.version, SimilarityIndex(embeddings, normalized=True),
+        artifacts.backend, threshold=artifacts.threshold,
+    )
+    service.registry.install(snapshot)
+    service.query_cache.clear()
+
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client_loop(worker):
+        client, rng = service.app.test_client(), random.Random(seed * 1000 + worker)
+        local, codes = [], Counter()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            response = client.post('/api/faq', json={'message': rng.choice(texts)})
+            local.append(time.perf_counter() - start)
+            codes[response.status_code] += 1
+        with lock:
+            latencies.extend(local)
+            statuses.update(codes)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    client = service.app.test_client()
+    batch_start, messages = time.perf_counter(), 0
+    for i in range(0, min(len(texts), 4 * batch_size), batch_size):
+        chunk = texts[i:i + batch_size]
+        client.post('/api/faq/batch', json={'messages': chunk})
+        messages += len(chunk)
+    batch_elapsed = time.perf_counter() - batch_start
+
+    return dict(
+        requests=len(latencies),
+        rps=len(latencies) / elapsed,
+        errors=sum(c for s, c in statuses.items() if s >= 400),
+        statuses={str(s): c for s, c in sorted(statuses.items())},
+        batch_messages_per_sec=messages / batch_elapsed if batch_elapsed else 0.0,
+        **percentiles_ms(latencies),
+    )
+
+
+# === Comparison ===
+
+def _flatten(tree, prefix=''):
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def _direction(path):
+    """+1 when higher is better, -1 when lower is better, 0 for counts/metadata."""
+    name = path.rsplit('.', 1)[-1]
+    if name.endswith(('_us', '_ms', '_s')):
+        return -1
+    if name in ('rps', 'recall_at_10') or name.endswith('per_sec'):
+        return 1
+    return 0
+
+
+def compare(old, new, tolerance):
+    """Metrics in ``new`` that are worse than in ``old`` by more than ``tolerance`` (relative)."""
+    before = dict(_flatten(old.get('results', {})))
+    regressions = []
+    for path, value in _flatten(new.get('results', {})):
+        sign, base = _direction(path), before.get(path)
+        if not sign or not base:
+            continue
+        change = (value - base) / abs(base)
+        if sign * change < -tolerance:
+            regressions.append({'metric': path, 'before': base, 'after': value, 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline microbenchmarks, search scaling and load test")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 100000, 1000000],
+                        help="Synthetic corpus sizes for the search benchmarks")
+    parser.add_argument('--index', nargs='*', default=['flat'], help="Index kinds to benchmark (flat, ivf, faiss-*)")
+    parser.add_argument('--load-sizes', type=int, nargs='*', default=[1000, 100000, 1000000],
+                        help="Synthetic corpus sizes served during the load test")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds of load per corpus size")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument('--cache', action='store_true', help="Keep the answer cache on during the load test")
+    parser.add_argument('--skip', nargs='*', default=[], choices=['micro', 'search', 'load'])
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Earlier results JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative slowdown for --compare")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # Measure the model and search, not cache hits; no reloads mid-run
+    if not args.cache:
+        os.environ['FAQ_CACHE_SIZE'] = '0'
+    os.environ['FAQ_RELOAD_INTERVAL'] = '0'
+    import app as service
+    service.registry.reload_interval = 0
+    # The service logs every query at DEBUG, which would dominate the load test
+    logging.getLogger().setLevel(logging.WARNING)
+    artifacts = service.registry.load()
+
+    from bench_clean_text import make_corpus
+    questions = [item['question'] for item in artifacts.faq_data]
+    results = {}
+    if 'micro' not in args.skip:
+        results['micro'] = micro_benchmarks(artifacts, make_corpus(questions), args.repeat, args.batch_size)
+        print('micro', json.dumps(results['micro']))
+    if 'search' not in args.skip:
+        results['search'] = {}
+        for n in args.sizes:
+            results['search'][str(n)] = search_benchmarks(artifacts.embeddings, n, args.index, args.repeat)
+            print('search', n, json.dumps(results['search'][str(n)]))
+    if 'load' not in args.skip:
+        results['load'] = {}
+        texts = query_mix(questions)
+        for n in args.load_sizes:
+            results['load'][str(n)] = load_test(service, artifacts, n, texts, args.duration, args.concurrency, args.batch_size)
+            print('load', n, json.dumps(results['load'][str(n)]))
+        service.registry.install(artifacts)
+
+    report = {
+        'environment': environment(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('json', 'compare')},
+        'backend': artifacts.backend,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        print(f"Compared with {args.compare} (commit {baseline.get('environment', {}).get('commit')}): "
+              f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        for r in regressions:
+            print(f"  {r['metric']}: {r['before']:.4g} -> {r['after']:.4g} ({r['change']:+.1%})")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_training_data.py
+"""
+Throughput of the training data pipeline, in pairs per second.
+
+For synthetic corpora of increasing size (questions built from the FAQ
+vocabulary) it times one epoch of:
+
+- ``legacy``: ``create_pairs`` + ``FAQPairsDataset`` + a batch-16 DataLoader
+  (only up to ``--legacy-max`` questions, since pair building is slow)
+- ``pipeline``: ``training_data.pair_loader`` with 0 and ``--workers`` workers
+
+With ``--train`` it also runs one training epoch through ``train_siamese``
+on the pipeline so the data rate can be compared with the model's.
+
+    python bench_training_data.py [--sizes 1000 10000 100000] [--workers 2] [--train] [--json results.json]
+"""
+import argparse
+import json
+import random
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from faq_model_utils import FAQPairsDataset, SiameseNetwork, Vocab, clean_text, create_pairs, train_siamese
+from model_registry import BASE_DIR
+from training_data import EncodedCorpus, SynonymTable, pair_loader
+
+
+def synthetic_questions(n, seed=0):
+    with open(f"{BASE_DIR}/faq_data.json", 'r', encoding='utf-8') as f:
+        words = sorted({w for item in json.load(f) for w in clean_text(item['question']).split()})
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(words, k=rng.randint(2, 12))) for _ in range(n)]
+
+
+def pairs_per_sec(loader):
+    start, pairs = time.perf_counter(), 0
+    for _, _, labels in loader:
+        pairs += len(labels)
+    return pairs / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training data pipeline throughput")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--legacy-max', type=int, default=10000)
+    parser.add_argument('--train', action='store_true', help="Also time one training epoch")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for n in args.sizes:
+        texts = synthetic_questions(n)
+        vocab = Vocab()
+        for t in texts:
+            vocab.add_sentence(t)
+        max_len = max(len(t.split()) for t in texts) + 2
+        row = {}
+
+        if n <= args.legacy_max:
+            start = time.perf_counter()
+            left, right, labels = create_pairs(texts)
+            dataset = FAQPairsDataset(left, right, labels, vocab, max_len)
+            row['legacy_setup_s'] = time.perf_counter() - start
+            row['legacy_pairs_per_sec'] = pairs_per_sec(DataLoader(dataset, batch_size=16, shuffle=True))
+
+        start = time.perf_counter()
+        corpus, synonym_table = EncodedCorpus(texts, vocab), SynonymTable(vocab)
+        row['pipeline_setup_s'] = time.perf_counter() - start
+        for workers in sorted({0, args.workers}):
+            loader = pair_loader(corpus, synonym_table, batch_size=16, workers=workers)
+            row[f'pipeline_pairs_per_sec_w{workers}'] = pairs_per_sec(loader)
+
+        if args.train:
+            model = SiameseNetwork(len(vocab), 50, 64, packed=True)
+            loader = pair_loader(corpus, synonym_table, batch_size=16, workers=args.workers)
+            row['train_pairs_per_sec'] = train_siamese(model, loader, torch.optim.Adam(model.parameters()), epochs=1)
+
+        results[n] = row
+        print(n, json.dumps(row))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# bench_workers.py
+"""
+Throughput benchmark of the gunicorn deployment against worker count.
+
+For each worker count a gunicorn server is started with gunicorn.conf.py
+(preloaded model, per-worker torch thread cap), warmed up, and hammered
+with concurrent ``/api/faq`` requests for a fixed duration, with the model
+preloaded in the master (``FAQ_PRELOAD=1``) and loaded by each worker
+(``FAQ_PRELOAD=0``). Requests per second, latency percentiles and the
+memory of the whole process tree (master plus workers) are printed as a
+Markdown table and can be written to JSON. Run it on the target machine;
+the numbers only mean something on a box with several cores.
+
+    python bench_workers.py --workers 1 2 4 8 --duration 20 --concurrency 32
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUERIES = [
+    "How can I track my order?",
+    "What payment methods do you accept?",
+    "Can I cancel my order?",
+    "How do I return a product?",
+    "Do you ship internationally?",
+    "my package never arrived what should i do",
+]
+
+
+def wait_ready(port, path='/readyz', timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', path)
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Server on port {port} did not become ready")
+
+
+def _children(pid):
+    try:
+        tasks = os.listdir(f'/proc/{pid}/task')
+    except OSError:
+        return []
+    children = []
+    for tid in tasks:
+        try:
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+def _memory_kb(pid):
+    # Pss splits shared pages between the processes mapping them, so the
+    # sum over the tree counts the preloaded model once
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    fields[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return fields
+
+
+def tree_memory_mb(pid):
+    """``(pss, rss)`` in MB summed over ``pid`` and its children; None off Linux."""
+    pids = [pid, *_children(pid)]
+    usage = [_memory_kb(p) for p in pids]
+    if not any(usage):
+        return None
+    return (sum(u.get('Pss', 0) for u in usage) / 1024,
+            sum(u.get('Rss', 0) for u in usage) / 1024)
+
+
+def load_generator(port, duration, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        i = offset
+        local = []
+        while time.monotonic() < stop_at:
+            body = json.dumps({'message': QUERIES[i % len(QUERIES)]})
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request('POST', '/api/faq', body, {'Content-Type': 'application/json'})
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except OSError:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            if ok:
+                local.append((time.perf_counter() - start) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+
+def run_config(n_workers, preload, args, port):
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(n_workers),
+               FAQ_PRELOAD='1' if preload else '0', FAQ_RELOAD_INTERVAL='0', FAQ_CACHE_SIZE='0')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # Without preload each worker loads the model on its first request
+        # (during the warm-up), so only wait for the server to be up
+        wait_ready(port, '/readyz' if preload else '/healthz')
+        load_generator(port, min(3, args.duration), args.concurrency)  # warm-up
+        latencies, errors = load_generator(port, args.duration, args.concurrency)
+        # Measured after the run, once every worker has its model and buffers
+        memory = tree_memory_mb(proc.pid)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+    return {
+        'workers': n_workers,
+        'preload': preload,
+        'pss_mb': memory[0] if memory else None,
+        'rss_mb': memory[1] if memory else None,
+        'rps': len(latencies) / args.duration,
+        'p50_ms': statistics.median(latencies) if latencies else 0.0,
+        'p99_ms': pct(0.99),
+        'requests': len(latencies),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RPS vs gunicorn worker count for the FAQ service")
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help="Worker counts to try (default: 1, 2, 4, ... up to the core count)")
+    parser.add_argument('--preload', choices=['on', 'off', 'both'], default='both',
+                        help="Preload the model in the master, load it per worker, or compare both")
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    cores = multiprocessing.cpu_count()
+    worker_counts = args.workers or sorted({min(cores, 2 ** i) for i in range(cores.bit_length() + 1)})
+
+    preloads = {'on': [True], 'off': [False], 'both': [True, False]}[args.preload]
+
+    results = [run_config(n, preload, args, args.port) for n in worker_counts for preload in preloads]
+
+    mb = lambda value: f"{value:.0f}" if value is not None else "n/a"
+    print(f"Cores: {cores}, concurrency: {args.concurrency}, duration: {args.duration}s\n")
+    print("| workers | preload | RPS | p50 ms | p99 ms | PSS MB | RSS MB | errors |")
+    print("|--------:|:-------:|----:|-------:|-------:|-------:|-------:|-------:|")
+    for r in results:
+        print(f"| {r['workers']} | {'yes' if r['preload'] else 'no'} | {r['rps']:.1f} | {r['p50_ms']:.1f} "
+              f"| {r['p99_ms']:.1f} | {mb(r['pss_mb'])} | {mb(r['rss_mb'])} | {r['errors']} |")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'cores': cores, 'concurrency': args.concurrency,
+                       'duration': args.duration, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
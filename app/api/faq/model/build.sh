@@ -14,7 +14,13 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 
-echo "📁 Downloading NLTK resources..."
-python3 -m nltk.downloader punkt
+echo "📁 Bundling NLTK resources into ./nltk_data..."
+# The service reads NLTK data from ./nltk_data and never downloads at runtime
+python3 -m nltk.downloader -d nltk_data punkt stopwords wordnet
+# Only needed by newer NLTK releases; older ones don't know these packages
+python3 -m nltk.downloader -d nltk_data punkt_tab omw-1.4 || true
+
+echo "🗜️  Packing model artifacts into a memory-mappable bundle..."
+python3 artifact_bundle.py build
 
 echo "✅ Build completed successfully!"
@@ -0,0 +1,365 @@
+# bulk_score.py
+"""
+Offline re-scoring of archived user messages with the service's matcher.
+
+Messages are streamed from a JSONL or CSV file (``-`` for stdin), scored in
+batches by a pool of worker processes that each load the model once, and
+written in input order as JSONL or CSV with the best ``--top-k`` matches,
+their scores, the matching tier and the threshold decision
+(``small_talk``, ``answered`` or ``forwarded``). Matching is the same as
+``/api/faq``: exact and near-duplicate tiers (fast_match.py), then batched
+encoding and hybrid search (lexical.py).
+
+At most ``2 * --workers`` batches are in flight, so memory stays bounded
+whatever the input size. Every ``--checkpoint-every`` batches the output is
+flushed and ``<output>.ckpt`` records how many input records it covers; if
+the run stops, the same command continues from there (``--restart``
+discards the checkpoint). Throughput is logged every ``--progress`` seconds
+and a summary is printed at the end (and written to ``--report``).
+
+    python bulk_score.py chat_logs.jsonl scored.jsonl [--field message] [--top-k 3]
+                         [--workers 4] [--batch-size 512] [--threshold 0.8]
+"""
+import os
+import io
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import logging
+import itertools
+import multiprocessing
+from collections import Counter, deque
+
+import torch
+
+from faq_model_utils import clean_text, encode_texts
+from fast_match import exact_match, near_match
+from model_registry import BASE_DIR, load_artifacts
+from atomic_write import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = '.ckpt'
+
+
+# === Input ===
+
+def _format(path, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def _open_text(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_records(path, fmt=None, field='message', id_field='id', start=0):
+    """Yield ``(position, id, text)`` per input record, skipping the first ``start``.
+
+    ``position`` counts records (JSONL lines, CSV rows) from 0 and is what
+    checkpoints refer to. Records without a string ``field`` yield ``None``
+    as text so they still count.
+    """
+    fmt = _format(path, fmt)
+    with _open_text(path) as f:
+        if fmt == 'csv':
+            rows = csv.DictReader(f)
+            for position, row in enumerate(rows):
+                if position >= start:
+                    yield position, row.get(id_field), row.get(field)
+            return
+        for position, line in enumerate(f):
+            if position < start:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield position, None, None
+                continue
+            if not isinstance(record, dict):
+                yield position, None, None
+                continue
+            text = record.get(field)
+            yield position, record.get(id_field), text if isinstance(text, str) else None
+
+
+def batched(records, size):
+    iterator = iter(records)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# === Scoring (runs in the worker processes) ===
+
+_artifacts = None
+_identity = None
+
+
+def model_identity(artifacts):
+    """Digest of what the scores depend on: weights, FAQs, threshold and backend.
+
+    Stored in the checkpoint so a resumed run refuses to mix outputs of two models.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(artifacts.weights_sha256).encode())
+    digest.update(json.dumps(artifacts.faq_data, sort_keys=True).encode('utf-8'))
+    digest.update(repr((artifacts.threshold, artifacts.backend)).encode())
+    return digest.hexdigest()[:16]
+
+
+def _init_worker(base_dir, backend, threads):
+    global _artifacts, _identity
+    torch.set_num_threads(threads)
+    _artifacts = load_artifacts(base_dir, torch.device('cpu'), backend=backend)
+    _identity = model_identity(_artifacts)
+
+
+def _matches(artifacts, pairs):
+    return [
+        {'index': int(row), 'question': artifacts.faq_data[row]['question'], 'score': round(float(score), 6)}
+        for row, score in pairs
+    ]
+
+
+def score_batch(batch, top_k, threshold, artifacts=None):
+    """Score one batch of ``(position, id, text)``; returns ``(model_identity, results)``.
+
+    ``threshold`` None uses the snapshot's, as the service does.
+    """
+    identity = model_identity(artifacts) if artifacts is not None else _identity
+    artifacts = artifacts or _artifacts
+    threshold = artifacts.threshold if threshold is None else threshold
+    results, pending = [], []
+    for position, record_id, text in batch:
+        result = {'position': position, 'id': record_id, 'message': text}
+        results.append(result)
+        if text is None:
+            result.update(tier=None, decision='skipped', matches=[])
+            continue
+        cleaned = clean_text(text)
+        # As in app.get_faq_responses: FAQ fast-path hits carry a single match,
+        # so with top_k > 1 only small talk is taken from the fast tiers
+        matcher = artifacts.matcher if top_k <= 1 else None
+        match = exact_match(cleaned, matcher) or near_match(cleaned, matcher)
+        if match is None:
+            pending.append((result, cleaned))
+        elif match.kind == 'small_talk':
+            result.update(tier=match.tier, decision='small_talk', matches=[], answer=match.response)
+        else:
+            result.update(tier=match.tier, matches=_matches(artifacts, [(match.row, match.score)]))
+
+    if pending:
+        texts = [cleaned for _, cleaned in pending]
+        embeddings = encode_texts(artifacts.model, texts, artifacts.vocab, artifacts.max_len, clean=False)
+        for (result, _), pairs in zip(pending, artifacts.search_batch(embeddings, texts, k=top_k)):
+            result.update(tier='model', matches=_matches(artifacts, pairs))
+
+    for result in results:
+        if 'decision' in result:
+            continue
+        best = result['matches'][0] if result['matches'] else None
+        # Exact and near hits passed their own cutoff; the threshold gates the model tier
+        answered = best is not None and (result['tier'] != 'model' or best['score'] >= threshold)
+        result['decision'] = 'answered' if answered else 'forwarded'
+        result['answer'] = artifacts.faq_data[best['index']]['answer'] if answered else None
+    return identity, results
+
+
+# === Output ===
+
+class OutputWriter:
+    """Appends results as JSONL or CSV (one row with ``top_k`` match column groups)."""
+
+    def __init__(self, path, fmt, top_k, offset=None):
+        self.fmt = fmt
+        self.top_k = top_k
+        self.file = open(path, 'r+' if offset is not None else 'w', encoding='utf-8', newline='')
+        if offset is not None:
+            # Drop anything written after the last checkpoint
+            self.file.seek(offset)
+            self.file.truncate()
+        self.csv = None
+        if fmt == 'csv':
+            columns = ['position', 'id', 'message', 'tier', 'decision', 'answer']
+            for i in range(1, top_k + 1):
+                columns += [f'index_{i}', f'question_{i}', f'score_{i}']
+            self.csv = csv.DictWriter(self.file, fieldnames=columns)
+            if offset is None:
+                self.csv.writeheader()
+
+    def write(self, result):
+        if self.csv is None:
+            self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            return
+        row = {k: result.get(k) for k in ('position', 'id', 'message', 'tier', 'decision', 'answer')}
+        for i, match in enumerate(result['matches'][:self.top_k], start=1):
+            row.update({f'index_{i}': match['index'], f'question_{i}': match['question'], f'score_{i}': match['score']})
+        self.csv.writerow(row)
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, state):
+    write_json_atomic(path, state)
+
+
+# === Driver ===
+
+class Progress:
+    """Counts and throughput for the log lines and the final report."""
+
+    def __init__(self, done, interval):
+        self.start = time.perf_counter()
+        self.resumed_at = done
+        self.done = done
+        self.interval = interval
+        self.last_log = self.start
+        self.tiers = Counter()
+        self.decisions = Counter()
+
+    def add(self, results):
+        self.done += len(results)
+        for result in results:
+            self.tiers[result['tier'] or 'none'] += 1
+            self.decisions[result['decision']] += 1
+        now = time.perf_counter()
+        if self.interval and now - self.last_log >= self.interval:
+            self.last_log = now
+            logger.info(f"{self.done} records scored, {self.rate():.0f} records/s")
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return (self.done - self.resumed_at) / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        return {
+            'records': self.done,
+            'scored_this_run': self.done - self.resumed_at,
+            'seconds': round(time.perf_counter() - self.start, 3),
+            'records_per_sec': round(self.rate(), 1),
+            'tiers': dict(self.tiers),
+            'decisions': dict(self.decisions),
+        }
+
+
+def run(args):
+    settings = {
+        'input': os.path.abspath(args.input) if args.input != '-' else '-',
+        'field': args.field,
+        'top_k': args.top_k,
+        'threshold': args.threshold,
+    }
+    out_fmt = _format(args.output, args.output_format)
+    checkpoint_path = args.output + CHECKPOINT_SUFFIX
+    checkpoint = None if args.restart else read_checkpoint(checkpoint_path)
+    if checkpoint is not None:
+        if checkpoint['settings'] != settings:
+            raise SystemExit(f"{checkpoint_path} was written with different settings; use --restart to start over")
+        if args.input == '-':
+            raise SystemExit("Cannot resume from stdin; use --restart")
+        logger.info(f"Resuming after {checkpoint['records']} records")
+    start = checkpoint['records'] if checkpoint else 0
+    identity = checkpoint.get('model') if checkpoint else None
+
+    writer = OutputWriter(args.output, out_fmt, args.top_k, checkpoint['output_bytes'] if checkpoint else None)
+    progress = Progress(start, args.progress)
+    batches = batched(read_records(args.input, args.input_format, args.field, args.id_field, start), args.batch_size)
+    since_checkpoint = 0
+
+    def completed(batch_identity, results):
+        nonlocal identity, since_checkpoint
+        if identity is None:
+            identity = batch_identity
+        elif batch_identity != identity:
+            raise SystemExit(f"Model, FAQs or threshold changed since the output was started "
+                             f"({identity} -> {batch_identity}); use --restart")
+        for result in results:
+            writer.write(result)
+        progress.add(results)
+        since_checkpoint += 1
+        if since_checkpoint >= args.checkpoint_every:
+            save()
+
+    def save():
+        nonlocal since_checkpoint
+        since_checkpoint = 0
+        write_checkpoint(checkpoint_path, {
+            'settings': settings, 'model': identity, 'records': progress.done, 'output_bytes': writer.flush(),
+        })
+
+    try:
+        if args.workers == 0:
+            _init_worker(args.base_dir, args.backend, args.threads or torch.get_num_threads())
+            for batch in batches:
+                completed(*score_batch(batch, args.top_k, args.threshold))
+        else:
+            with multiprocessing.Pool(args.workers, _init_worker, (args.base_dir, args.backend, args.threads or 1)) as pool:
+                in_flight = deque()
+                for batch in batches:
+                    in_flight.append(pool.apply_async(score_batch, (batch, args.top_k, args.threshold)))
+                    # Bounded read-ahead; results are written in input order
+                    while len(in_flight) >= 2 * args.workers:
+                        completed(*in_flight.popleft().get())
+                while in_flight:
+                    completed(*in_flight.popleft().get())
+    finally:
+        save()
+        writer.close()
+    return progress.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score archived messages offline with the FAQ matcher")
+    parser.add_argument('input', help="JSONL or CSV file of messages, or - for stdin")
+    parser.add_argument('output', help="JSONL or CSV file for the scored messages")
+    parser.add_argument('--input-format', choices=['jsonl', 'csv'], help="Default: from the file extension")
+    parser.add_argument('--output-format', choices=['jsonl', 'csv'], help="Default: from the file extension")
+    parser.add_argument('--field', default='message', help="JSON key or CSV column holding the message")
+    parser.add_argument('--id-field', default='id', help="JSON key or CSV column copied to the output as the id")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--threshold', type=float,
+                        help="Confidence cutoff (default: the service's, calibrated or FAQ_CONFIDENCE_THRESHOLD)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Scoring processes, each with its own model (0: score in this process)")
+    parser.add_argument('--threads', type=int, help="torch threads per worker (default 1; all cores with --workers 0)")
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--checkpoint-every', type=int, default=20, help="Batches between checkpoints")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start over")
+    parser.add_argument('--progress', type=float, default=10.0, help="Seconds between throughput log lines (0: off)")
+    parser.add_argument('--backend', default='eager', help="Inference backend (see inference_export.py)")
+    parser.add_argument('--base-dir', default=BASE_DIR, help="Artifact directory (default: this directory)")
+    parser.add_argument('--report', help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+# calibration.py
+"""
+Confidence threshold calibration and evaluation over the FAQ dataset.
+
+Queries are generated from every FAQ question with the training
+augmentation (``augment_text``/``get_synonym``), one per ``--variants`` kind:
+
+- ``synonym``: one word replaced by a synonym, as in the training positives
+- ``two_synonyms``: ``augment_text`` applied twice
+- ``drop``: one word dropped and another replaced by a synonym, as in
+  ``validation_queries`` (training_loop.py)
+
+Each query is scored once through the service's matching path (exact and
+near tiers from fast_match.py, then batched encoding and hybrid search) and
+read two ways. ``answerable``: against all FAQs, where the top match should
+share the question's answer. ``unanswerable``: with the question's answer
+group held out, where the right outcome is to forward to the helpdesk.
+
+For every threshold on a 0.01 grid the report gives precision (correct
+answers among all answers), recall (correct answers among answerable
+queries), the share of answerable queries forwarded and of unanswerable
+ones answered, and the expected cost of a query when a wrong answer costs
+``--wrong-answer-cost`` helpdesk escalations. ``--unanswerable-share`` sets
+the traffic mix. The chosen threshold is the cheapest one, or the lowest
+reaching ``--target-precision`` if given. It is written to
+``faq_threshold.json`` with the digest of the evaluated weights; the service
+loads it with the model (see model_registry.py) and ignores it for other
+weights.
+
+    python calibration.py [--wrong-answer-cost 3] [--target-precision 0.95] [--report calibration.json]
+"""
+import os
+import json
+import time
+import random
+import argparse
+import logging
+
+import numpy as np
+import torch
+
+from faq_model_utils import augment_text, clean_text, encode_texts, get_synonym
+from fast_match import exact_match, near_match
+from lexical import HYBRID_WEIGHT
+from model_registry import BASE_DIR, load_artifacts
+from artifact_bundle import THRESHOLD_FILE
+from training_loop import answer_groups
+from atomic_write import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = ('synonym', 'two_synonyms', 'drop')
+GRID = np.round(np.arange(0, 101) / 100, 2)
+
+
+# === Queries ===
+
+def _drop_and_replace(text):
+    tokens = text.split()
+    if len(tokens) < 2:
+        return text
+    del tokens[random.randrange(len(tokens))]
+    pos = random.randrange(len(tokens))
+    tokens[pos] = get_synonym(tokens[pos])
+    return ' '.join(tokens)
+
+
+_GENERATORS = {
+    'synonym': augment_text,
+    'two_synonyms': lambda text: augment_text(augment_text(text)),
+    'drop': _drop_and_replace,
+}
+
+
+def generate_queries(faq_data, variants=VARIANTS, seed=0):
+    """``(queries, targets, kinds)`` for the FAQ questions, cleaned as the service would.
+
+    Seeds the module-level ``random`` that ``augment_text`` draws from.
+    Variants that leave a question unchanged are skipped: they are exact-tier
+    repeats and always score 1.0.
+    """
+    random.seed(seed)
+    queries, targets, kinds = [], [], []
+    for row, item in enumerate(faq_data):
+        text = clean_text(item['question'])
+        seen = {text}
+        for kind in variants:
+            # WordNet joins multi-word lemmas with '_'; users would type spaces
+            query = clean_text(_GENERATORS[kind](text).replace('_', ' '))
+            if query and query not in seen:
+                seen.add(query)
+                queries.append(query)
+                targets.append(row)
+                kinds.append(kind)
+    return queries, np.array(targets, dtype=np.int64), kinds
+
+
+# === Scoring ===
+
+def score_queries(artifacts, queries, targets, groups, k=3, batch_size=256):
+    """Top ``k`` matches of every query as the service computes them, with and without its answer group.
+
+    Returns ``{'answerable': (rows, scores), 'unanswerable': (rows, scores)}``
+    with ``[n, k]`` arrays (rows -1 and scores 0 where fewer matches exist; exact
+    and near hits, which no threshold gates, score ``inf``),
+    plus ``tiers`` (the tier that answered each answerable query) and
+    ``small_talk`` (a mask of queries taken for small talk, which no threshold
+    gates).
+    """
+    n = len(queries)
+    held_out = groups[targets]
+    # Enough extra matches that k remain once the largest answer group is removed
+    depth = k + int(np.bincount(groups).max())
+    cases = {case: (np.full((n, k), -1, dtype=np.int64), np.zeros((n, k), dtype=np.float32))
+             for case in ('answerable', 'unanswerable')}
+    tiers = np.array(['model'] * n, dtype=object)
+    small_talk = np.zeros(n, dtype=bool)
+    searched = {case: [] for case in cases}
+    for i, query in enumerate(queries):
+        match = exact_match(query, artifacts.matcher) or near_match(query, artifacts.matcher)
+        if match is not None and match.kind == 'small_talk':
+            small_talk[i] = True
+            continue
+        if match is None:
+            searched['answerable'].append(i)
+            searched['unanswerable'].append(i)
+            continue
+        tiers[i] = match.tier
+        # Exact and near hits are answered on their own cutoff whatever the
+        # threshold, so they score above every point of the curve
+        cases['answerable'][0][i, 0], cases['answerable'][1][i, 0] = match.row, np.inf
+        if groups[match.row] == held_out[i]:
+            # The matched question is held out, so the model tier answers instead
+            searched['unanswerable'].append(i)
+        else:
+            cases['unanswerable'][0][i, 0], cases['unanswerable'][1][i, 0] = match.row, np.inf
+
+    pending = sorted(set(searched['answerable']) | set(searched['unanswerable']))
+    if pending:
+        embs = encode_texts(artifacts.model, [queries[i] for i in pending], artifacts.vocab, artifacts.max_len,
+                            batch_size, artifacts.device, clean=False)
+        answerable, unanswerable = set(searched['answerable']), set(searched['unanswerable'])
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            found = artifacts.search_batch(embs[start:start + batch_size], [queries[i] for i in chunk], k=depth)
+            for i, matches in zip(chunk, found):
+                if i in answerable:
+                    _fill(cases['answerable'], i, matches[:k])
+                if i in unanswerable:
+                    _fill(cases['unanswerable'], i, [m for m in matches if groups[m[0]] != held_out[i]][:k])
+    return dict(cases, tiers=tiers, small_talk=small_talk)
+
+
+def _fill(case, i, matches):
+    rows, scores = case
+    for j, (row, score) in enumerate(matches):
+        rows[i, j], scores[i, j] = row, score
+
+
+# === Metrics ===
+
+def threshold_curve(correct, top_scores, unanswerable_scores, wrong_answer_cost=3.0, unanswerable_share=0.5):
+    """Per-threshold metrics on ``GRID`` (vectorized over queries and thresholds).
+
+    ``correct`` and ``top_scores`` describe the answerable queries' top
+    match; ``unanswerable_scores`` are the top scores with the answer held
+    out. Rates are shares of the respective query set; ``precision`` and
+    ``cost`` weight the two sets by ``unanswerable_share``.
+    """
+    answered = top_scores[:, None] >= GRID[None, :]
+    correct_rate = (answered & correct[:, None]).mean(axis=0)
+    wrong_rate = (answered & ~correct[:, None]).mean(axis=0)
+    forwarded_rate = (~answered).mean(axis=0)
+    false_rate = (unanswerable_scores[:, None] >= GRID[None, :]).mean(axis=0)
+    share = unanswerable_share
+    answers = (1 - share) * (correct_rate + wrong_rate) + share * false_rate
+    precision = np.divide((1 - share) * correct_rate, answers, out=np.ones_like(answers), where=answers > 0)
+    wrong = (1 - share) * wrong_rate + share * false_rate
+    cost = (1 - share) * forwarded_rate + wrong_answer_cost * wrong
+    return {
+        'threshold': GRID,
+        'precision': precision,
+        'recall': correct_rate,
+        'wrong_answered': wrong_rate,
+        'forwarded_answerable': forwarded_rate,
+        'answered_unanswerable': false_rate,
+        'cost': cost,
+    }
+
+
+def choose_threshold(curve, target_precision=None):
+    """``(threshold, objective)``: the cheapest threshold, or the lowest reaching ``target_precision``."""
+    if target_precision is not None:
+        reached = np.flatnonzero(curve['precision'] >= target_precision)
+        if len(reached):
+            return float(curve['threshold'][reached[0]]), f'precision>={target_precision}'
+        logger.warning(f"No threshold reaches precision {target_precision}; using the cheapest one")
+    return float(curve['threshold'][int(np.argmin(curve['cost']))]), 'min_cost'
+
+
+def _at(curve, threshold):
+    i = int(np.argmin(np.abs(curve['threshold'] - threshold)))
+    return {name: round(float(values[i]), 4) for name, values in curve.items()}
+
+
+def evaluate(artifacts, queries, targets, kinds, k=3, wrong_answer_cost=3.0, unanswerable_share=0.5,
+             target_precision=None, batch_size=256):
+    """Accuracy, threshold curve and chosen threshold for generated queries."""
+    groups = answer_groups(artifacts.faq_data)
+    scored = score_queries(artifacts, queries, targets, groups, k, batch_size)
+    keep = ~scored['small_talk']
+    rows, scores = (a[keep] for a in scored['answerable'])
+    held_out_scores = scored['unanswerable'][1][keep][:, 0]
+    target_groups = groups[targets[keep]]
+    hits = (rows >= 0) & (groups[np.maximum(rows, 0)] == target_groups[:, None])
+    correct = hits[:, 0]
+    kinds = np.array(kinds, dtype=object)[keep]
+    tiers = scored['tiers'][keep]
+
+    curve = threshold_curve(correct, scores[:, 0], held_out_scores, wrong_answer_cost, unanswerable_share)
+    threshold, objective = choose_threshold(curve, target_precision)
+    return {
+        'queries': int(keep.sum()),
+        'small_talk_skipped': int((~keep).sum()),
+        'top_1': round(float(correct.mean()), 4) if len(correct) else 0.0,
+        f'top_{k}': round(float(hits.any(axis=1).mean()), 4) if len(correct) else 0.0,
+        'top_1_by_variant': {kind: round(float(correct[kinds == kind].mean()), 4) for kind in sorted(set(kinds))},
+        'tiers': {tier: int((tiers == tier).sum()) for tier in sorted(set(tiers))},
+        'threshold': threshold,
+        'objective': objective,
+        'at_threshold': _at(curve, threshold),
+        'at_current_threshold': dict(_at(curve, artifacts.threshold), source=artifacts.threshold_source),
+        'curve': [{name: round(float(values[i]), 4) for name, values in curve.items()} for i in range(len(GRID))],
+    }
+
+
+# === CLI ===
+
+def write_threshold_file(path, artifacts, result, settings):
+    """Write the threshold the service will load, atomically (the registry watches this file)."""
+    payload = {
+        'threshold': result['threshold'],
+        'weights_sha256': artifacts.weights_sha256,
+        'hybrid_weight': HYBRID_WEIGHT,
+        'objective': result['objective'],
+        'faqs': len(artifacts.faq_data),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'settings': settings,
+        'metrics': result['at_threshold'],
+    }
+    write_json_atomic(path, payload, indent=2)
+
+
+def print_summary(result, k):
+    print(f"queries {result['queries']}  top-1 {result['top_1']:.3f}  top-{k} {result[f'top_{k}']:.3f}  "
+          f"by variant {result['top_1_by_variant']}  tiers {result['tiers']}")
+    print(f"{'threshold':>9} {'precision':>9} {'recall':>7} {'fwd_ans':>8} {'ans_unans':>9} {'cost':>6}")
+    for point in result['curve']:
+        if round(point['threshold'] * 100) % 5 == 0 or point['threshold'] == result['threshold']:
+            mark = '  <- chosen' if point['threshold'] == result['threshold'] else ''
+            print(f"{point['threshold']:>9.2f} {point['precision']:>9.3f} {point['recall']:>7.3f} "
+                  f"{point['forwarded_answerable']:>8.3f} {point['answered_unanswerable']:>9.3f} "
+                  f"{point['cost']:>6.3f}{mark}")
+    current = result['at_current_threshold']
+    print(f"current threshold {current['threshold']:.2f} ({current['source']}): cost {current['cost']:.3f}, "
+          f"precision {current['precision']:.3f}, recall {current['recall']:.3f}")
+    print(f"chosen threshold {result['threshold']:.2f} ({result['objective']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the FAQ confidence threshold on generated queries")
+    parser.add_argument('--base-dir', default=BASE_DIR)
+    parser.add_argument('--variants', nargs='*', default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top-k', type=int, default=3, help="Also report top-k accuracy for this k")
+    parser.add_argument('--wrong-answer-cost', type=float, default=3.0,
+                        help="Cost of a wrong answer in helpdesk escalations")
+    parser.add_argument('--unanswerable-share', type=float, default=0.5,
+                        help="Share of traffic with no matching FAQ")
+    parser.add_argument('--target-precision', type=float,
+                        help="Choose the lowest threshold reaching this precision instead of the cheapest")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--backend', default='eager', help="Inference backend (see inference_export.py)")
+    parser.add_argument('--output', help=f"Threshold file to write (default: <base-dir>/{THRESHOLD_FILE})")
+    parser.add_argument('--dry-run', action='store_true', help="Report only; do not write the threshold file")
+    parser.add_argument('--report', help="Write the full evaluation, curve included, to this JSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    artifacts = load_artifacts(args.base_dir, torch.device('cpu'), backend=args.backend)
+    queries, targets, kinds = generate_queries(artifacts.faq_data, args.variants, args.seed)
+    result = evaluate(artifacts, queries, targets, kinds, args.top_k, args.wrong_answer_cost,
+                      args.unanswerable_share, args.target_precision, args.batch_size)
+    print_summary(result, args.top_k)
+
+    settings = {k: v for k, v in vars(args).items() if k not in ('base_dir', 'output', 'dry_run', 'report', 'batch_size')}
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(dict(result, settings=settings), f, indent=2)
+    if not args.dry_run:
+        path = args.output or os.path.join(args.base_dir, THRESHOLD_FILE)
+        write_threshold_file(path, artifacts, result, settings)
+        print(f"Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# faq_admin.py
+
+"""
+Incremental FAQ edits without retraining.
+
+Adding, changing or deleting FAQs keeps the trained model and vocabulary:
+only questions whose cleaned text is not already embedded are encoded (with
+the fp32 model), every other row of the embedding matrix is reused, and the
+search index is updated rather than rebuilt (see ``updated`` in
+retrieval.py). The result is written as a new bundle version sharing the
+model files with the current one (``derive_bundle``), or over the legacy
+files when there is no bundle. Either way the ``ModelRegistry`` of every
+running worker notices the change and hot-reloads it.
+
+Question words missing from the vocabulary are encoded as ``<UNK>``; they are
+reported with every edit (and by ``oov``) so a retrain can be scheduled.
+
+    python faq_admin.py list
+    python faq_admin.py add --question "..." --answer "..."
+    python faq_admin.py update 12 [--question "..."] [--answer "..."]
+    python faq_admin.py delete 12
+    python faq_admin.py sync new_faq_data.json   # replace all FAQs, encoding only the changes
+    python faq_admin.py oov
+"""
+import os
+import sys
+import json
+import argparse
+import logging
+import threading
+
+import numpy as np
+import torch
+
+from faq_model_utils import clean_text, encode_texts
+from model_registry import (
+    ARTIFACT_FILES, BASE_DIR, BUNDLE_DIR, INDEX_FILE, load_artifacts,
+)
+from artifact_bundle import MODEL_CONFIG_FILE, current_bundle_dir, derive_bundle, read_model_config
+from retrieval import make_eval_queries, measure_recall, save_index
+from atomic_write import atomic_path, write_atomic, write_json_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: edits from one process at a time only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = '.faq_admin.lock'
+
+
+class FAQEditError(ValueError):
+    """An edit was rejected; ``status`` is the matching HTTP status code."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# === Locking ===
+
+_thread_lock = threading.Lock()
+
+
+class _EditLock:
+    """Serializes edits across threads and (where fcntl exists) processes."""
+
+    def __init__(self, base_dir):
+        self.path = os.path.join(base_dir, LOCK_FILE)
+
+    def __enter__(self):
+        _thread_lock.acquire()
+        self.file = open(self.path, 'a') if fcntl else None
+        if self.file:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        _thread_lock.release()
+
+
+# === Core ===
+
+def oov_words(questions, vocab):
+    """``{word: [question, ...]}`` for cleaned question words missing from ``vocab``."""
+    report = {}
+    for question in questions:
+        for word in clean_text(question).split():
+            if word not in vocab.word2idx:
+                report.setdefault(word, []).append(question)
+    return report
+
+
+def _validate(faq_data):
+    for position, item in enumerate(faq_data):
+        if not isinstance(item, dict) or not all(
+            isinstance(item.get(key), str) and item[key].strip() for key in ('question', 'answer')
+        ):
+            raise FAQEditError(f"FAQ {position} needs a non-empty 'question' and 'answer'")
+        if not clean_text(item['question']):
+            raise FAQEditError(f"FAQ {position} has no words left after cleaning: {item['question']!r}")
+    if not faq_data:
+        raise FAQEditError("At least one FAQ is required")
+
+
+def _write_legacy(base_dir, artifacts, faq_data, embeddings, index):
+    # Pin max_len/packed first so the reload does not derive max_len from the new questions
+    config = dict(read_model_config(base_dir), packed=bool(getattr(artifacts.model, 'packed', False)),
+                  max_len=artifacts.max_len)
+    write_json_atomic(os.path.join(base_dir, MODEL_CONFIG_FILE), config)
+    if index.kind != 'flat' or os.path.exists(os.path.join(base_dir, INDEX_FILE)):
+        with atomic_path(os.path.join(base_dir, INDEX_FILE)) as tmp:
+            save_index(index, tmp)
+    write_atomic(os.path.join(base_dir, ARTIFACT_FILES['embeddings']), lambda f: np.save(f, embeddings))
+    write_json_atomic(os.path.join(base_dir, ARTIFACT_FILES['faq_data']), faq_data, indent=4)
+
+
+def apply_faq_data(base_dir, faq_data, artifacts=None):
+    """Make ``faq_data`` the FAQ set, encoding only questions not embedded yet.
+
+    ``artifacts`` is the current eager snapshot (loaded when omitted). Returns
+    a report with the counts of encoded and reused rows, the new version and
+    the out-of-vocabulary words of the encoded questions.
+    """
+    _validate(faq_data)
+    artifacts = artifacts or load_artifacts(base_dir, torch.device('cpu'), backend='eager')
+    old_cleaned = [clean_text(item['question']) for item in artifacts.faq_data]
+    old_rows = {}
+    for row, text in enumerate(old_cleaned):
+        old_rows.setdefault(text, row)
+
+    cleaned = [clean_text(item['question']) for item in faq_data]
+    kept = np.array([old_rows.get(text, -1) for text in cleaned], dtype=np.int64)
+    new_texts = sorted({text for text, row in zip(cleaned, kept) if row < 0})
+
+    old = np.asarray(artifacts.embeddings)
+    embeddings = np.empty((len(faq_data), old.shape[1]), dtype=np.float32)
+    embeddings[kept >= 0] = old[kept[kept >= 0]]
+    if new_texts:
+        encoded = encode_texts(artifacts.model, new_texts, artifacts.vocab, artifacts.max_len, clean=False)
+        position = {text: i for i, text in enumerate(new_texts)}
+        for i in np.flatnonzero(kept < 0):
+            embeddings[i] = encoded[position[cleaned[i]]]
+
+    index = artifacts.index.updated(embeddings, kept)
+    if index.kind != 'flat':
+        measure_recall(index, make_eval_queries(embeddings), k=10)
+
+    bundle_dir = current_bundle_dir(os.path.join(base_dir, BUNDLE_DIR))
+    if bundle_dir is not None:
+        version = os.path.basename(derive_bundle(os.path.join(base_dir, BUNDLE_DIR), bundle_dir, faq_data, embeddings, index))
+    else:
+        _write_legacy(base_dir, artifacts, faq_data, embeddings, index)
+        version = None
+
+    oov = oov_words([item['question'] for item, row in zip(faq_data, kept) if row < 0], artifacts.vocab)
+    if oov:
+        logger.warning(f"FAQ edit added {len(oov)} out-of-vocabulary words, consider retraining: {sorted(oov)}")
+    return {
+        'faq_count': len(faq_data),
+        'encoded': len(new_texts),
+        'reused': int((kept >= 0).sum()),
+        'removed': len(set(old_cleaned) - set(cleaned)),
+        'index': index.kind,
+        'index_recall': index.recall,
+        'bundle_version': version,
+        'oov_words': oov,
+        'retrain_recommended': bool(oov),
+    }
+
+
+def edit_faqs(base_dir, change):
+    """Apply ``change(faq_data) -> new_faq_data`` to the current FAQs under the edit lock."""
+    with _EditLock(base_dir):
+        artifacts = load_artifacts(base_dir, torch.device('cpu'), backend='eager')
+        faq_data = change([dict(item) for item in artifacts.faq_data])
+        return apply_faq_data(base_dir, faq_data, artifacts)
+
+
+def _check_position(position):
+    if not isinstance(position, int) or isinstance(position, bool):
+        raise FAQEditError(f"'position' must be an integer, got {position!r}")
+
+
+def _check_text(field, value, required=True):
+    """Reject a missing (when ``required``), non-string or blank field before any edit."""
+    if value is None and not required:
+        return
+    if not isinstance(value, str) or not value.strip():
+        raise FAQEditError(f"'{field}' must be a non-empty string")
+
+
+def _position(faq_data, position):
+    _check_position(position)
+    if not 0 <= position < len(faq_data):
+        raise FAQEditError(f"No FAQ at position {position!r}", status=404)
+    return position
+
+
+def _check_duplicate(faq_data, question, skip=None):
+    cleaned = clean_text(question)
+    for i, item in enumerate(faq_data):
+        if i != skip and clean_text(item['question']) == cleaned:
+            raise FAQEditError(f"FAQ {i} already asks this question", status=409)
+
+
+def add_faq(base_dir, question, answer):
+    _check_text('question', question)
+    _check_text('answer', answer)
+
+    def change(faq_data):
+        _check_duplicate(faq_data, question)
+        return faq_data + [{'question': question, 'answer': answer}]
+    report = edit_faqs(base_dir, change)
+    report['position'] = report['faq_count'] - 1
+    return report
+
+
+def update_faq(base_dir, position, question=None, answer=None):
+    _check_position(position)
+    _check_text('question', question, required=False)
+    _check_text('answer', answer, required=False)
+    if question is None and answer is None:
+        raise FAQEditError("Nothing to update: give a 'question' and/or an 'answer'")
+
+    def change(faq_data):
+        i = _position(faq_data, position)
+        if question is not None:
+            _check_duplicate(faq_data, question, skip=i)
+            faq_data[i]['question'] = question
+        if answer is not None:
+            faq_data[i]['answer'] = answer
+        return faq_data
+    report = edit_faqs(base_dir, change)
+    report['position'] = position
+    return report
+
+
+def delete_faq(base_dir, position):
+    _check_position(position)
+
+    def change(faq_data):
+        del faq_data[_position(faq_data, position)]
+        return faq_data
+    return edit_faqs(base_dir, change)
+
+
+def sync_faqs(base_dir, faq_data):
+    return edit_faqs(base_dir, lambda _: [dict(item) for item in faq_data])
+
+
+# === CLI ===
+
+def main():
+    parser = argparse.ArgumentParser(description="Add, update or delete FAQs without retraining")
+    parser.add_argument('--base-dir', default=BASE_DIR, help="Artifact directory (default: this directory)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="Print the FAQs with their positions")
+    add = sub.add_parser('add', help="Append a FAQ")
+    add.add_argument('--question', required=True)
+    add.add_argument('--answer', required=True)
+    update = sub.add_parser('update', help="Change the question and/or answer of a FAQ")
+    update.add_argument('position', type=int)
+    update.add_argument('--question')
+    update.add_argument('--answer')
+    delete = sub.add_parser('delete', help="Remove a FAQ")
+    delete.add_argument('position', type=int)
+    sync = sub.add_parser('sync', help="Replace all FAQs with a faq_data.json-style file")
+    sync.add_argument('path')
+    sub.add_parser('oov', help="List question words missing from the model's vocabulary")
+    args = parser.parse_args()
+
+    if args.command in ('list', 'oov'):
+        artifacts = load_artifacts(args.base_dir, torch.device('cpu'), backend='eager')
+        if args.command == 'list':
+            for i, item in enumerate(artifacts.faq_data):
+                print(f"{i}\t{item['question']}")
+        else:
+            report = oov_words([item['question'] for item in artifacts.faq_data], artifacts.vocab)
+            print(json.dumps(report, indent=2))
+        return
+
+    try:
+        if args.command == 'add':
+            report = add_faq(args.base_dir, args.question, args.answer)
+        elif args.command == 'update':
+            report = update_faq(args.base_dir, args.position, args.question, args.answer)
+        elif args.command == 'delete':
+            report = delete_faq(args.base_dir, args.position)
+        else:
+            with open(args.path, 'r', encoding='utf-8') as f:
+                report = sync_faqs(args.base_dir, json.load(f))
+    except FAQEditError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
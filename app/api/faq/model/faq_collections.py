@@ -0,0 +1,328 @@
+# faq_collections.py
+
+"""
+Per-tenant FAQ collections served by the resident model.
+
+A collection is a directory ``collections/<id>/`` holding its own
+``faq_data.json``, plus ``faq_embeddings.npy`` and ``collection.json``
+(the SHA-256 of the weights that produced the embeddings). An optional
+``faq_index.pkl`` is used like the default one. Every collection shares
+the default snapshot's SiameseNetwork, vocabulary and threshold; only the
+FAQ rows, embeddings, search index and lookup tables are per collection.
+
+``CollectionStore.get(id, base)`` returns a ``ModelArtifacts`` view of one
+collection on top of ``base`` (the registry's snapshot). Collections load
+on first use. Embeddings that are missing or were encoded by other weights
+are re-encoded and saved on the way. Loaded collections are kept in LRU
+order. Once their estimated footprint exceeds ``FAQ_COLLECTION_MEMORY_MB``,
+the least recently used ones are evicted and load again on their next
+request. Changed collection files are noticed every ``FAQ_RELOAD_INTERVAL``
+seconds, as for the default FAQs.
+
+    python faq_collections.py add store-eu faqs_eu.json   # create or replace a collection
+    python faq_collections.py list
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from faq_model_utils import clean_text, encode_texts
+from retrieval import SimilarityIndex, load_index, normalize_rows
+from atomic_write import write_atomic
+from model_registry import (
+    BASE_DIR, DEFAULT_RELOAD_INTERVAL, INDEX_FILE, ModelArtifacts, build_lookups, load_artifacts,
+)
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS_DIR = os.environ.get('FAQ_COLLECTIONS_DIR', os.path.join(BASE_DIR, 'collections'))
+MEMORY_BUDGET = int(float(os.environ.get('FAQ_COLLECTION_MEMORY_MB', '512')) * 1024 * 1024)
+
+COLLECTION_FILE = 'collection.json'
+FAQ_FILE = 'faq_data.json'
+EMBEDDINGS_FILE = 'faq_embeddings.npy'
+# Python objects per FAQ (rows, cleaned texts, exact and near-duplicate
+# tables) take a few times the JSON size; used only for the memory estimate
+OBJECT_OVERHEAD = 4
+
+_ID_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+
+class UnknownCollectionError(KeyError):
+    """No collection with this id exists (or the id is not a valid name)."""
+
+
+# === Files ===
+
+def collection_dir(collection_id, root=COLLECTIONS_DIR):
+    if not isinstance(collection_id, str) or not _ID_RE.match(collection_id):
+        raise UnknownCollectionError(collection_id)
+    path = os.path.join(root, collection_id)
+    if not os.path.isfile(os.path.join(path, FAQ_FILE)):
+        raise UnknownCollectionError(collection_id)
+    return path
+
+
+def _file_signature(path):
+    sig = []
+    for fname in (FAQ_FILE, EMBEDDINGS_FILE, COLLECTION_FILE, INDEX_FILE):
+        try:
+            st = os.stat(os.path.join(path, fname))
+            sig.append((fname, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append((fname, None, None))
+    return tuple(sig)
+
+
+def encode_collection(path, base, faq_data=None, faq_texts=None):
+    """Encode a collection's questions with ``base``'s model and save them; returns the embeddings."""
+    if faq_data is None:
+        with open(os.path.join(path, FAQ_FILE), 'r', encoding='utf-8') as f:
+            faq_data = json.load(f)
+    if faq_texts is None:
+        faq_texts = [clean_text(item['question']) for item in faq_data]
+    embeddings = encode_texts(base.model, faq_texts, base.vocab, base.max_len, device=base.device, clean=False)
+    write_atomic(os.path.join(path, EMBEDDINGS_FILE), lambda f: np.save(f, embeddings))
+    meta = {'weights_sha256': base.weights_sha256, 'faqs': len(faq_data)}
+    write_atomic(os.path.join(path, COLLECTION_FILE), lambda f: f.write(json.dumps(meta, indent=2).encode('utf-8')))
+    return embeddings
+
+
+def _read_embeddings(path, base, faq_data):
+    try:
+        with open(os.path.join(path, COLLECTION_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE))
+    except FileNotFoundError:
+        return None
+    if meta.get('weights_sha256') != base.weights_sha256 or len(embeddings) != len(faq_data):
+        return None
+    return embeddings
+
+
+def _array_bytes(obj, skip=None):
+    return sum(v.nbytes for v in vars(obj).values() if isinstance(v, np.ndarray) and v is not skip)
+
+
+# === Store ===
+
+class _Collection:
+    """Loaded rows, embeddings and lookup tables of one collection."""
+
+    def __init__(self, collection_id, path, base):
+        self.id = collection_id
+        self.signature = _file_signature(path)
+        with open(os.path.join(path, FAQ_FILE), 'r', encoding='utf-8') as f:
+            self.faq_data = json.load(f)
+        faq_texts = [clean_text(item['question']) for item in self.faq_data]
+        embeddings = _read_embeddings(path, base, self.faq_data)
+        if embeddings is None:
+            logger.info(f"Encoding {len(self.faq_data)} FAQs of collection {collection_id}")
+            try:
+                embeddings = encode_collection(path, base, self.faq_data, faq_texts)
+            except OSError as e:
+                logger.warning(f"Could not save embeddings of collection {collection_id}: {e}")
+                embeddings = encode_texts(base.model, faq_texts, base.vocab, base.max_len, device=base.device,
+                                          clean=False)
+            # Saving changed the files; record the new ones so they don't look modified
+            self.signature = _file_signature(path)
+        # Normalized once and shared with the flat index, so there is one copy per collection
+        self.embeddings = normalize_rows(embeddings)
+        self.index = None
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.environ.get('FAQ_INDEX', 'auto') != 'flat' and os.path.exists(index_path):
+            try:
+                self.index = load_index(index_path, self.embeddings, normalized=True)
+            except Exception as e:
+                logger.warning(f"Ignoring {index_path}, falling back to exact search: {e}")
+        if self.index is None:
+            self.index = SimilarityIndex(self.embeddings, normalized=True)
+        self.matcher, self.lexical = build_lookups(self.faq_data, faq_texts)
+        self.weights_sha256 = base.weights_sha256
+        self.checked_at = time.monotonic()
+        self.nbytes = self._footprint(path)
+        self._view = None
+
+    def _footprint(self, path):
+        nbytes = self.embeddings.nbytes + _array_bytes(self.index, skip=self.embeddings)
+        if self.lexical is not None:
+            weights = self.lexical.weights
+            nbytes += weights.data.nbytes + weights.indices.nbytes + weights.indptr.nbytes
+        return nbytes + OBJECT_OVERHEAD * os.path.getsize(os.path.join(path, FAQ_FILE))
+
+    def view(self, base):
+        """A ModelArtifacts answering from this collection with ``base``'s model."""
+        view = self._view
+        if view is None or view[0] is not base:
+            artifacts = ModelArtifacts(
+                base.model, base.vocab, self.faq_data, self.embeddings, base.max_len, base.device, base.version,
+                self.index, base.backend, self.matcher, self.lexical, base.threshold, base.threshold_source,
+                base.weights_sha256,
+            )
+            # Distinct per collection and per file version, so cached answers never cross over
+            digest = hashlib.sha1(repr(self.signature).encode()).hexdigest()[:8]
+            artifacts.fingerprint = f"{base.fingerprint}/{self.id}/{digest}"
+            artifacts.collection = self.id
+            view = self._view = (base, artifacts)
+        return view[1]
+
+
+class CollectionStore:
+    """Loads collections on demand and keeps the most recently used ones within a memory budget."""
+
+    def __init__(self, root=COLLECTIONS_DIR, memory_budget=MEMORY_BUDGET, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.reload_interval = reload_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per collection id being loaded, so concurrent first
+        # requests load it once; removed again once the load is done
+        self._load_locks = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def _current(self, collection_id, base):
+        with self._lock:
+            entry = self._entries.get(collection_id)
+            if entry is not None:
+                self._entries.move_to_end(collection_id)
+        if entry is None:
+            return None
+        stale = entry.weights_sha256 != base.weights_sha256
+        if not stale and self.reload_interval > 0 and time.monotonic() - entry.checked_at >= self.reload_interval:
+            entry.checked_at = time.monotonic()
+            try:
+                stale = _file_signature(collection_dir(collection_id, self.root)) != entry.signature
+            except UnknownCollectionError:
+                self.discard(collection_id)
+                raise
+        if stale:
+            # Dropped here so the reload below does not find it again
+            self.discard(collection_id)
+            return None
+        return entry
+
+    def get(self, collection_id, base):
+        """The ``ModelArtifacts`` of ``collection_id`` on top of ``base``; raises UnknownCollectionError."""
+        # Checked before any lookup or lock, so arbitrary request values
+        # (lists, unknown names) never reach the dicts below
+        path = collection_dir(collection_id, self.root)
+        entry = self._current(collection_id, base)
+        if entry is None:
+            with self._lock:
+                load_lock = self._load_locks.setdefault(collection_id, threading.Lock())
+            try:
+                with load_lock:
+                    entry = self._current(collection_id, base)
+                    if entry is None:
+                        start = time.perf_counter()
+                        entry = _Collection(collection_id, path, base)
+                        self.loads += 1
+                        logger.info(f"Loaded collection {collection_id}: {len(entry.faq_data)} FAQs, "
+                                    f"{entry.nbytes / 1e6:.1f} MB in {time.perf_counter() - start:.2f}s")
+                        self._insert(entry)
+            finally:
+                with self._lock:
+                    if self._load_locks.get(collection_id) is load_lock:
+                        del self._load_locks[collection_id]
+        return entry.view(base)
+
+    def _insert(self, entry):
+        with self._lock:
+            self._entries[entry.id] = entry
+            self._entries.move_to_end(entry.id)
+            total = sum(e.nbytes for e in self._entries.values())
+            # The collection just loaded stays even if it alone exceeds the budget
+            while total > self.memory_budget and len(self._entries) > 1:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                total -= evicted.nbytes
+                self.evictions += 1
+                logger.info(f"Evicted collection {evicted_id} ({evicted.nbytes / 1e6:.1f} MB)")
+
+    def discard(self, collection_id):
+        with self._lock:
+            self._entries.pop(collection_id, None)
+
+    def available(self):
+        """Ids of the collections on disk, loaded or not."""
+        try:
+            names = sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return []
+        return [n for n in names if _ID_RE.match(n) and os.path.isfile(os.path.join(self.root, n, FAQ_FILE))]
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            'loaded': len(entries),
+            'bytes': sum(e.nbytes for e in entries),
+            'memory_budget': self.memory_budget,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'collections': {e.id: {'faqs': len(e.faq_data), 'bytes': e.nbytes} for e in reversed(entries)},
+        }
+
+
+# === CLI ===
+
+def add_collection(collection_id, faq_path, base, root=COLLECTIONS_DIR):
+    """Create or replace a collection from a JSON list of ``{"question", "answer"}`` objects."""
+    if not _ID_RE.match(collection_id):
+        raise ValueError(f"Invalid collection id {collection_id!r}: use letters, digits, '-' and '_'")
+    with open(faq_path, 'r', encoding='utf-8') as f:
+        faq_data = json.load(f)
+    if not isinstance(faq_data, list) or not all(
+            isinstance(item, dict) and item.get('question') and item.get('answer') for item in faq_data):
+        raise ValueError(f"{faq_path} must be a JSON list of objects with a question and an answer")
+    path = os.path.join(root, collection_id)
+    os.makedirs(path, exist_ok=True)
+    # Embeddings first: a reader seeing the new faq_data.json re-encodes if they are not there yet
+    encode_collection(path, base, faq_data)
+    write_atomic(os.path.join(path, FAQ_FILE), lambda f: f.write(json.dumps(faq_data, indent=2).encode('utf-8')))
+    stale_index = os.path.join(path, INDEX_FILE)
+    if os.path.exists(stale_index):
+        os.remove(stale_index)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage per-tenant FAQ collections")
+    parser.add_argument('--root', default=COLLECTIONS_DIR)
+    parser.add_argument('--base-dir', default=BASE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="Create or replace a collection and encode its questions")
+    add.add_argument('id')
+    add.add_argument('faqs', help="JSON list of {\"question\", \"answer\"} objects")
+    sub.add_parser('list', help="List collections and their FAQ counts")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'list':
+        store = CollectionStore(args.root)
+        for collection_id in store.available():
+            with open(os.path.join(args.root, collection_id, FAQ_FILE), 'r', encoding='utf-8') as f:
+                print(f"{collection_id}\t{len(json.load(f))} FAQs")
+        return
+
+    base = load_artifacts(args.base_dir, torch.device('cpu'), backend='eager')
+    try:
+        path = add_collection(args.id, args.faqs, base, args.root)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
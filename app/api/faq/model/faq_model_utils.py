@@ -1,8 +1,11 @@
 # faq_model_utils.py
 
+import os
 import re
+import time
 import random
 import json
+import logging
 import numpy as np
 import torch
 import torch.nn as nn
@@ -11,19 +14,76 @@ from nltk.corpus import stopwords, wordnet
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer
 import difflib
+import bisect
+import heapq
+from typing import Optional
 
-# Ensure nltk data is downloaded only once
 import nltk
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
+
+logger = logging.getLogger(__name__)
+
+# === NLTK Resources ===
+
+# NLTK data is read from a directory bundled with the service (filled by
+# build.sh) instead of being downloaded on every import, so workers boot
+# quickly and without network access.
+NLTK_DATA_DIR = os.environ.get(
+    'FAQ_NLTK_DATA', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')
+)
+if NLTK_DATA_DIR not in nltk.data.path:
+    nltk.data.path.insert(0, NLTK_DATA_DIR)
+
+# Newer NLTK releases ship the Punkt tokenizer as 'punkt_tab'
+NLTK_RESOURCES = {
+    'punkt': ('tokenizers/punkt', 'tokenizers/punkt_tab'),
+    'stopwords': ('corpora/stopwords',),
+    'wordnet': ('corpora/wordnet',),
+}
+
+def missing_nltk_resources():
+    missing = []
+    for name, paths in NLTK_RESOURCES.items():
+        for path in paths:
+            try:
+                nltk.data.find(path)
+                break
+            except LookupError:
+                continue
+        else:
+            missing.append(name)
+    return missing
+
+def ensure_nltk_resources(download=None):
+    """Check the bundled NLTK data; download missing pieces only if allowed.
+
+    Downloading is opt-in (``FAQ_NLTK_DOWNLOAD=1``) and goes to ``NLTK_DATA_DIR``.
+    Raises ``RuntimeError`` naming the resources that are still missing:
+    text cleaning cannot work without them.
+    """
+    if download is None:
+        download = os.environ.get('FAQ_NLTK_DOWNLOAD', '0') == '1'
+    missing = missing_nltk_resources()
+    if missing and download:
+        for name in missing:
+            packages = ['punkt', 'punkt_tab'] if name == 'punkt' else [name]
+            for package in packages:
+                nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
+        missing = missing_nltk_resources()
+    if missing:
+        raise RuntimeError(
+            f"Missing NLTK resources {missing} in {NLTK_DATA_DIR} (FAQ_NLTK_DATA). Bundle them with build.sh "
+            f"(python -m nltk.downloader -d nltk_data punkt punkt_tab stopwords wordnet) or set FAQ_NLTK_DOWNLOAD=1"
+        )
+
+ensure_nltk_resources()
 
 STOPWORDS = set(stopwords.words('english'))
 lemmatizer = WordNetLemmatizer()
 
 # === Text Processing ===
 
-def clean_text(text):
+def clean_text_reference(text):
+    """Original NLTK pipeline; ``clean_text`` must produce identical output."""
     text = text.lower().strip()
     text = re.sub(r'\s+', ' ', text)
     tokens = word_tokenize(text)
@@ -31,13 +91,60 @@ def clean_text(text):
     tokens = [lemmatizer.lemmatize(t) for t in tokens if t not in STOPWORDS]
     return ' '.join(tokens)
 
+_WHITESPACE_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+# Inputs made only of ASCII words, spaces, '?', '!', commas not followed by a
+# digit or another comma and at most one final period are split by
+# word_tokenize exactly at the non-alphanumeric characters, so a regex split
+# gives the same tokens. (",," glues to the next word: ",,how" -> ",", ",how".)
+_FAST_PATH_RE = re.compile(r'(?:[a-z0-9 ?!]|,(?![\d,]))*(?<!\.)\.?')
+# Words the Treebank tokenizer splits without any punctuation ("cannot" ->
+# "can not"); these always take the NLTK path.
+_SPLIT_WORDS_RE = re.compile(r'\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b')
+
+_LEMMA_CACHE = {}
+LEMMA_CACHE_LIMIT = 100000
+clean_text_stats = {'fast_path': 0, 'nltk_path': 0}
+
+def _tokenize(text):
+    if _FAST_PATH_RE.fullmatch(text) and not _SPLIT_WORDS_RE.search(text):
+        clean_text_stats['fast_path'] += 1
+        return _WORD_RE.findall(text)
+    clean_text_stats['nltk_path'] += 1
+    return [t for t in word_tokenize(text) if t.isalnum()]
+
+def lemmatize(token):
+    lemma = _LEMMA_CACHE.get(token)
+    if lemma is None:
+        lemma = lemmatizer.lemmatize(token)
+        if len(_LEMMA_CACHE) < LEMMA_CACHE_LIMIT:
+            _LEMMA_CACHE[token] = lemma
+    return lemma
+
+def warm_lemma_cache(words):
+    """Pre-compute lemmas, e.g. for the vocabulary and raw FAQ question words."""
+    for word in words:
+        lemmatize(word)
+
+def clean_text(text):
+    text = text.lower().strip()
+    text = _WHITESPACE_RE.sub(' ', text)
+    return ' '.join(lemmatize(t) for t in _tokenize(text) if t not in STOPWORDS)
+
+_SYNONYM_CACHE = {}
+
+def synonyms(word):
+    """Lemma names of ``word``'s first WordNet synset (minus the word), memoized."""
+    lemmas = _SYNONYM_CACHE.get(word)
+    if lemmas is None:
+        syns = wordnet.synsets(word)
+        lemmas = [lemma.name() for lemma in syns[0].lemmas() if lemma.name() != word] if syns else []
+        _SYNONYM_CACHE[word] = lemmas
+    return lemmas
+
 def get_synonym(word):
-    syns = wordnet.synsets(word)
-    if syns:
-        lemmas = [lemma.name() for lemma in syns[0].lemmas() if lemma.name() != word]
-        if lemmas:
-            return random.choice(lemmas)
-    return word
+    lemmas = synonyms(word)
+    return random.choice(lemmas) if lemmas else word
 
 def augment_text(text):
     tokens = text.split()
@@ -67,11 +174,53 @@ class Vocab:
     def __len__(self):
         return self.count
 
+    def words(self):
+        """Words ordered by id, so position ``i`` holds the word with id ``i``."""
+        return [self.idx2word[i] for i in range(self.count)]
+
+    @classmethod
+    def from_words(cls, words):
+        vocab = cls()
+        vocab.idx2word = dict(enumerate(words))
+        vocab.word2idx = {word: i for i, word in vocab.idx2word.items()}
+        vocab.count = len(vocab.idx2word)
+        return vocab
+
 # === Utility ===
 
 def pad_sequence(seq, max_len):
     return seq + [0]*(max_len - len(seq)) if len(seq) < max_len else seq[:max_len]
 
+# Upper bound on tokens for packed models, which are not tied to max_len
+MAX_TOKENS = int(os.environ.get('FAQ_MAX_TOKENS', '256'))
+
+def padded_length(model, seqs, max_len):
+    """Length a batch of encoded ``seqs`` is padded to for ``model``.
+
+    Fixed-padding models were trained on exactly ``max_len`` positions (the
+    pads take part in the LSTM and the pooling), so they keep it; packed
+    models only need the longest sequence in the batch.
+    """
+    if getattr(model, 'packed', False):
+        return max(1, min(MAX_TOKENS, max((len(s) for s in seqs), default=1)))
+    return max_len
+
+def batch_tensor(model, seqs, max_len):
+    length = padded_length(model, seqs, max_len)
+    return torch.tensor([pad_sequence(s, length) for s in seqs], dtype=torch.long)
+
+def length_buckets(lengths, batch_size, shuffle=False):
+    """Split indices into batches of similar length (shuffled batch order if ``shuffle``)."""
+    if shuffle:
+        # Random tie-breaking so equal-length items don't always share a batch
+        order = sorted(range(len(lengths)), key=lambda i: (lengths[i], random.random()))
+    else:
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    if shuffle:
+        random.shuffle(batches)
+    return batches
+
 def load_dataset(filepath):
     with open(filepath, 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -81,7 +230,9 @@ def create_pairs(texts):
     left_texts, right_texts, labels = [], [], []
     for i in range(len(texts)):
         pos = texts[i]
-        neg = random.choice([texts[j] for j in range(len(texts)) if j != i])
+        # Uniform over j != i without building the list of candidates
+        j = random.randrange(len(texts) - 1)
+        neg = texts[j + (j >= i)]
         aug = augment_text(pos)
         left_texts += [pos, pos]
         right_texts += [aug, neg]
@@ -91,39 +242,97 @@ def create_pairs(texts):
 # === Dataset ===
 
 class FAQPairsDataset(Dataset):
-    def __init__(self, left_texts, right_texts, labels, vocab, max_len):
-        self.left_texts = left_texts
-        self.right_texts = right_texts
-        self.labels = labels
-        self.vocab = vocab
+    """Text pairs encoded once up front.
+
+    With ``max_len`` items are padded to it (fixed-padding models); with
+    ``max_len=None`` they keep their length and batches are padded by
+    ``collate_pairs``, ideally drawn from a ``LengthBucketSampler``.
+    """
+
+    def __init__(self, left_texts, right_texts, labels, vocab, max_len=None):
         self.max_len = max_len
+        self.left = [self._encode(vocab, t) for t in left_texts]
+        self.right = [self._encode(vocab, t) for t in right_texts]
+        self.labels = torch.tensor(labels, dtype=torch.float)
+
+    def _encode(self, vocab, text):
+        seq = vocab.encode(text)
+        if self.max_len is not None:
+            seq = pad_sequence(seq, self.max_len)
+        return torch.tensor(seq or [0], dtype=torch.long)
 
     def __len__(self):
         return len(self.labels)
 
     def __getitem__(self, idx):
-        left_encoded = pad_sequence(self.vocab.encode(self.left_texts[idx]), self.max_len)
-        right_encoded = pad_sequence(self.vocab.encode(self.right_texts[idx]), self.max_len)
-        label = self.labels[idx]
-        return torch.tensor(left_encoded), torch.tensor(right_encoded), torch.tensor(label, dtype=torch.float)
+        return self.left[idx], self.right[idx], self.labels[idx]
+
+    def lengths(self):
+        return [max(len(l), len(r)) for l, r in zip(self.left, self.right)]
+
+def collate_pairs(batch):
+    """Pad each side of a batch of pairs to its longest sequence."""
+    left, right, labels = zip(*batch)
+    return (
+        nn.utils.rnn.pad_sequence(left, batch_first=True),
+        nn.utils.rnn.pad_sequence(right, batch_first=True),
+        torch.stack(labels),
+    )
+
+class LengthBucketSampler(torch.utils.data.Sampler):
+    """Batch sampler that groups pairs of similar length to minimise padding."""
+
+    def __init__(self, lengths, batch_size, shuffle=True):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        return iter(length_buckets(self.lengths, self.batch_size, self.shuffle))
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
 
 # === Model ===
 
 class SiameseNetwork(nn.Module):
-    def __init__(self, vocab_size, embedding_dim, hidden_dim):
+    """BiLSTM encoder with mean+max pooling.
+
+    ``packed=False`` is the original model: inputs are padded to ``max_len``
+    and the pads run through the LSTM and the pooling. With ``packed=True``
+    the LSTM only sees real tokens (``pack_padded_sequence``) and pooling is
+    masked to them, so inputs can be padded to any length. The weights are
+    the same shape either way, but a model must be served in the mode it
+    was trained in.
+    """
+
+    def __init__(self, vocab_size, embedding_dim, hidden_dim, packed=False):
         super(SiameseNetwork, self).__init__()
+        self.packed = packed
         self.embedding = nn.Embedding(vocab_size, embedding_dim, padding_idx=0)
         self.lstm = nn.LSTM(embedding_dim, hidden_dim, batch_first=True, bidirectional=True)
         self.fc = nn.Linear(hidden_dim * 2 * 2, hidden_dim)
 
-    def forward_once(self, x):
+    def forward_once(self, x, lengths: Optional[torch.Tensor] = None):
         embedded = self.embedding(x)
-        output, _ = self.lstm(embedded)
-        avg_pool = torch.mean(output, dim=1)
-        max_pool, _ = torch.max(output, dim=1)
+        # Without padding (e.g. a single query) packing and masking are no-ops
+        if self.packed and (lengths is not None or not bool(x[:, -1].all())):
+            if lengths is None:
+                lengths = (x != 0).sum(dim=1)
+            lengths = lengths.clamp(min=1)
+            packed = nn.utils.rnn.pack_padded_sequence(embedded, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            output, _ = self.lstm(packed)
+            output, _ = nn.utils.rnn.pad_packed_sequence(output, batch_first=True, total_length=x.size(1))
+            mask = (torch.arange(x.size(1), device=x.device).unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(2)
+            avg_pool = (output * mask).sum(dim=1) / lengths.unsqueeze(1).to(output.dtype)
+            max_pool, _ = torch.max(output.masked_fill(~mask, float('-inf')), dim=1)
+        else:
+            output, _ = self.lstm(embedded)
+            avg_pool = torch.mean(output, dim=1)
+            max_pool, _ = torch.max(output, dim=1)
         concat = torch.cat((avg_pool, max_pool), dim=1)
         out = torch.relu(self.fc(concat))
-        return nn.functional.normalize(out, p=2, dim=1)
+        return nn.functional.normalize(out, p=2.0, dim=1)
 
     def forward(self, x1, x2):
         out1 = self.forward_once(x1)
@@ -137,28 +346,80 @@ def contrastive_loss(y_pred, y_true, margin=0.5):
     loss_neg = (1 - y_true) * torch.clamp(y_pred - margin, min=0.0).pow(2)
     return torch.mean(loss_pos + loss_neg)
 
-def train_siamese(model, dataloader, optimizer, epochs=20, device='cpu'):
+def in_batch_softmax_loss(left, right, y_true, temperature=0.05):
+    """Softmax (InfoNCE) loss over a whole pair batch.
+
+    ``left``/``right`` are normalized embeddings. Each positive pair's question
+    must pick its own right-hand side out of every right-hand side in the
+    batch: the other questions' positives and all the negatives.
+    """
+    positives = torch.nonzero(y_true > 0.5).squeeze(1)
+    logits = left[positives] @ right.T / temperature
+    return nn.functional.cross_entropy(logits, positives)
+
+def train_epoch(model, dataloader, optimizer, device='cpu', loss='contrastive', temperature=0.05):
+    """One pass over ``(left, right, labels)`` batches; returns ``(mean_loss, pairs, seconds)``.
+
+    ``loss`` is ``'contrastive'`` (per-pair ``contrastive_loss``) or
+    ``'in-batch'`` (``in_batch_softmax_loss``).
+    """
     model.train()
+    total_loss, n_batches, n_pairs = 0.0, 0, 0
+    start = time.perf_counter()
+    for left, right, labels in dataloader:
+        # non_blocking only overlaps the copy when the loader pins memory
+        left = left.to(device, non_blocking=True)
+        right = right.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+        optimizer.zero_grad()
+        if loss == 'in-batch':
+            batch_loss = in_batch_softmax_loss(model.forward_once(left), model.forward_once(right), labels, temperature)
+        else:
+            batch_loss = contrastive_loss(model(left, right), labels)
+        batch_loss.backward()
+        optimizer.step()
+        total_loss += batch_loss.item()
+        n_batches += 1
+        n_pairs += len(labels)
+    return total_loss / max(1, n_batches), n_pairs, time.perf_counter() - start
+
+def train_siamese(model, dataloader, optimizer, epochs=20, device='cpu'):
+    """Train on ``(left, right, labels)`` batches; returns the overall pairs/second."""
+    total_pairs, total_time = 0, 0.0
     for epoch in range(epochs):
-        total_loss = 0.0
-        for left, right, labels in dataloader:
-            left, right, labels = left.to(device), right.to(device), labels.to(device)
-            optimizer.zero_grad()
-            outputs = model(left, right)
-            loss = contrastive_loss(outputs, labels)
-            loss.backward()
-            optimizer.step()
-            total_loss += loss.item()
-        print(f"Epoch {epoch+1}/{epochs} Loss: {total_loss/len(dataloader):.4f}")
+        mean_loss, n_pairs, elapsed = train_epoch(model, dataloader, optimizer, device)
+        total_pairs, total_time = total_pairs + n_pairs, total_time + elapsed
+        print(f"Epoch {epoch+1}/{epochs} Loss: {mean_loss:.4f} ({n_pairs/elapsed:.0f} pairs/s)")
+    return total_pairs / total_time if total_time else 0.0
 
 def encode_text(model, text, vocab, max_len, device='cpu'):
     model.eval()
     with torch.no_grad():
-        encoded = pad_sequence(vocab.encode(text), max_len)
-        seq_tensor = torch.tensor([encoded], dtype=torch.long).to(device)
+        seq_tensor = batch_tensor(model, [vocab.encode(text)], max_len).to(device)
         embedding = model.forward_once(seq_tensor)
     return embedding.cpu().numpy()[0]
 
+def encode_texts(model, texts, vocab, max_len, batch_size=256, device='cpu', clean=True):
+    """Encode many texts as padded batches; returns an ``[n, hidden_dim]`` array.
+
+    Packed models get length-bucketed batches padded only to their longest
+    member; fixed-padding models keep input order and ``max_len`` padding.
+    """
+    model.eval()
+    if clean:
+        texts = [clean_text(t) for t in texts]
+    encoded = [vocab.encode(t) for t in texts]
+    if getattr(model, 'packed', False):
+        batches = length_buckets([len(s) for s in encoded], batch_size)
+    else:
+        batches = [list(range(start, min(start + batch_size, len(encoded)))) for start in range(0, len(encoded), batch_size)]
+    outputs = np.zeros((len(encoded), model.fc.out_features), dtype=np.float32)
+    with torch.inference_mode():
+        for positions in batches:
+            seq_tensor = batch_tensor(model, [encoded[i] for i in positions], max_len).to(device)
+            outputs[positions] = model.forward_once(seq_tensor).cpu().numpy()
+    return outputs
+
 def cosine_sim(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-8)
 
@@ -198,18 +459,90 @@ SMALL_TALK_RESPONSES = {
     "bye": "Thank you for reaching out. Have a great day."
 }
 
-def check_small_talk(user_input):
-    text = clean_text(user_input).strip().lower()
-    
-    # Exact match
-    if text in NORMALIZED_PHRASES:
-        key = NORMALIZED_PHRASES[text]
-        return SMALL_TALK_RESPONSES[key]
-
-    # Optional: Fuzzy match for very close inputs
-    close_match = difflib.get_close_matches(text, NORMALIZED_PHRASES.keys(), n=1, cutoff=0.75)
-    if close_match:
-        key = NORMALIZED_PHRASES[close_match[0]]
-        return SMALL_TALK_RESPONSES[key]
-
-    return None
+class NearDuplicateIndex:
+    """Closest text by ``difflib`` ratio without scoring every text.
+
+    Only texts whose length allows a ratio of ``cutoff`` are considered (the
+    ratio ``2 * matches / (len(a) + len(b))`` is at most
+    ``2 * min(len) / (len(a) + len(b))``); rows are kept sorted by length so
+    that window is found by bisection. With ``exhaustive`` (the default up to
+    ``BRUTE_FORCE_LIMIT`` texts) the whole window is scored, which gives the
+    same result as ``difflib.get_close_matches(text, texts, n=1,
+    cutoff=cutoff)``. Otherwise an inverted index of words narrows it to the
+    ``max_candidates`` texts sharing the most words with the query, missing
+    at most one of them (a typo or a changed word); words found in more than
+    ``max_posting`` texts are not indexed.
+    """
+
+    BRUTE_FORCE_LIMIT = 256
+
+    def __init__(self, texts, cutoff=0.75, max_candidates=8, max_posting=None, exhaustive=None):
+        self.texts = list(texts)
+        self.cutoff = cutoff
+        self.max_candidates = max_candidates
+        self.lengths = [len(t) for t in self.texts]
+        self.by_length = sorted(range(len(self.texts)), key=self.lengths.__getitem__)
+        self.sorted_lengths = [self.lengths[row] for row in self.by_length]
+        self.postings = None
+        if not (exhaustive if exhaustive is not None else len(self.texts) <= self.BRUTE_FORCE_LIMIT):
+            max_posting = max_posting or max(256, len(self.texts) // 1000)
+            postings = {}
+            for row, text in enumerate(self.texts):
+                for word in set(text.split()):
+                    postings.setdefault(word, []).append(row)
+            self.postings = {word: rows for word, rows in postings.items() if len(rows) <= max_posting}
+
+    def _candidates(self, text):
+        n = len(text)
+        lo, hi = n * self.cutoff / (2 - self.cutoff), n * (2 - self.cutoff) / self.cutoff
+        if self.postings is None:
+            return self.by_length[bisect.bisect_left(self.sorted_lengths, lo):bisect.bisect_right(self.sorted_lengths, hi)]
+        lists = [self.postings[word] for word in set(text.split()) if word in self.postings]
+        shared = {}
+        for rows in lists:
+            for row in rows:
+                shared[row] = shared.get(row, 0) + 1
+        need = max(1, len(lists) - 1)
+        rows = [row for row, count in shared.items() if count >= need and lo <= self.lengths[row] <= hi]
+        return heapq.nlargest(self.max_candidates, rows, key=shared.__getitem__)
+
+    def matches(self, text):
+        """Every ``(row, ratio)`` with ``ratio >= cutoff`` among the candidates, closest first."""
+        candidates = self._candidates(text) if text else ()
+        if not candidates:
+            return []
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(text)
+        hits = []
+        for row in candidates:
+            matcher.set_seq1(self.texts[row])
+            if matcher.quick_ratio() >= self.cutoff:
+                ratio = matcher.ratio()
+                if ratio >= self.cutoff:
+                    hits.append((row, ratio))
+        # Ties go to the larger string, as in get_close_matches (the sort is
+        # stable, so equal texts keep candidate order)
+        hits.sort(key=lambda hit: (hit[1], self.texts[hit[0]]), reverse=True)
+        return hits
+
+    def match(self, text):
+        """``(row, ratio)`` of the closest text with ``ratio >= cutoff``, or ``None``."""
+        hits = self.matches(text)
+        return hits[0] if hits else None
+
+
+SMALL_TALK_INDEX = NearDuplicateIndex(NORMALIZED_PHRASES, cutoff=0.75)
+
+def small_talk_exact(text):
+    key = NORMALIZED_PHRASES.get(text)
+    return SMALL_TALK_RESPONSES[key] if key is not None else None
+
+def small_talk_near(text):
+    # Fuzzy match for very close inputs
+    match = SMALL_TALK_INDEX.match(text)
+    return SMALL_TALK_RESPONSES[NORMALIZED_PHRASES[SMALL_TALK_INDEX.texts[match[0]]]] if match else None
+
+def check_small_talk(user_input, cleaned=None):
+    # Callers that already cleaned the input pass it in to avoid a second pass
+    text = (cleaned if cleaned is not None else clean_text(user_input)).strip().lower()
+    return small_talk_exact(text) or small_talk_near(text)
@@ -0,0 +1,83 @@
+# fast_match.py
+
+"""
+Cheap matching tiers in front of the SiameseNetwork.
+
+Queries are answered by the first tier that matches their cleaned text:
+
+1. ``exact``: hash lookup in the small-talk phrases and the cleaned FAQ
+   questions. A repeated FAQ question scores 1.0, as the model would.
+2. ``near``: ``NearDuplicateIndex`` (length bound plus an inverted index of
+   shared words, verified with ``difflib``) over the same two sets. Small
+   talk keeps its 0.75 cutoff; FAQ questions need
+   ``FAQ_NEAR_DUPLICATE_CUTOFF`` (default 0.9) and score the ratio. A FAQ
+   near match is only taken when every question above the cutoff has the
+   same answer; otherwise the query is ambiguous and goes to the model.
+3. ``model``: encoder plus similarity search in app.py, only for queries that
+   miss both.
+
+The FAQ tables are built per model snapshot (``FAQMatcher``, attached by
+``load_artifacts``), so a reload swaps them together with the embeddings.
+Small talk needs no snapshot and is answered even before the model loads.
+"""
+import os
+from collections import namedtuple
+
+from faq_model_utils import NearDuplicateIndex, clean_text, small_talk_exact, small_talk_near
+
+FAST_MATCH_ENABLED = os.environ.get('FAQ_FAST_MATCH', '1') == '1'
+NEAR_DUPLICATE_CUTOFF = float(os.environ.get('FAQ_NEAR_DUPLICATE_CUTOFF', '0.9'))
+
+TIERS = ('exact', 'near', 'model')
+
+# ``kind`` is 'small_talk' (``response`` set) or 'faq' (``row`` and ``score`` set)
+Match = namedtuple('Match', ['tier', 'kind', 'response', 'row', 'score'])
+
+
+class FAQMatcher:
+    """Exact and near-duplicate lookup tables for the questions of one snapshot."""
+
+    def __init__(self, faq_data, faq_texts=None, near_cutoff=NEAR_DUPLICATE_CUTOFF):
+        if faq_texts is None:
+            faq_texts = [clean_text(item['question']) for item in faq_data]
+        self.exact = {}
+        for row, text in enumerate(faq_texts):
+            if text:
+                self.exact.setdefault(text, row)
+        # Rows with the same answer form one group (duplicated questions)
+        self.answer_group = [item.get('answer') for item in faq_data]
+        self.near = None
+        if near_cutoff < 1:
+            self.near = NearDuplicateIndex(faq_texts, cutoff=near_cutoff, exhaustive=False)
+
+    def exact_row(self, text):
+        return self.exact.get(text)
+
+    def near_row(self, text):
+        """Closest ``(row, ratio)``, or ``None`` when none or several answer groups are within the cutoff."""
+        hits = self.near.matches(text) if self.near is not None else []
+        if not hits or len({self.answer_group[row] for row, _ in hits}) > 1:
+            return None
+        return hits[0]
+
+
+def exact_match(text, matcher=None):
+    """Tier 1 for a cleaned query; ``matcher`` is the snapshot's FAQMatcher (if loaded)."""
+    response = small_talk_exact(text)
+    if response is not None:
+        return Match('exact', 'small_talk', response, None, 1.0)
+    row = matcher.exact_row(text) if matcher is not None else None
+    if row is not None:
+        return Match('exact', 'faq', None, row, 1.0)
+    return None
+
+
+def near_match(text, matcher=None):
+    """Tier 2 for a cleaned query."""
+    response = small_talk_near(text)
+    if response is not None:
+        return Match('near', 'small_talk', response, None, 1.0)
+    hit = matcher.near_row(text) if matcher is not None else None
+    if hit is not None:
+        return Match('near', 'faq', None, hit[0], hit[1])
+    return None
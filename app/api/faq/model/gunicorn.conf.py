@@ -0,0 +1,53 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings for the FAQ service.
+
+The app is preloaded in the master (model loaded once, shared copy-on-write
+by the workers) and every worker caps torch's intra-op threads to its share
+of the cores so N workers don't each spawn one thread per core.
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('FAQ_GUNICORN_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.environ.get('FAQ_GUNICORN_TIMEOUT', '120'))
+preload_app = True
+
+
+def torch_threads_per_worker(n_workers):
+    configured = os.environ.get('FAQ_TORCH_THREADS')
+    if configured:
+        return max(1, int(configured))
+    return max(1, multiprocessing.cpu_count() // max(1, n_workers))
+
+
+def post_fork(server, worker):
+    import torch
+
+    # server.cfg reflects -w/--workers given on the command line too
+    n_threads = torch_threads_per_worker(server.cfg.workers)
+    torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already fixed once the inter-op pool has started
+        pass
+    server.log.info(f"Worker {worker.pid}: torch intra-op threads = {n_threads}")
+
+    # Warm up in the worker (never in the master, where starting OpenMP
+    # threads before fork can deadlock the children)
+    from app import registry
+    from faq_model_utils import encode_texts
+    if registry.ready:
+        artifacts = registry.get()
+        encode_texts(artifacts.model, ['warm up'], artifacts.vocab, artifacts.max_len,
+                     device=artifacts.device, clean=False)
+
+    # Whisper workers are threads, so they have to be started after fork
+    from app import transcription_pool
+    from transcription import WHISPER_PRELOAD
+    if WHISPER_PRELOAD:
+        transcription_pool.start()
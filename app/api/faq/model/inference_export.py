@@ -0,0 +1,299 @@
+# inference_export.py
+
+"""
+Optimized CPU inference variants of ``SiameseNetwork.forward_once``.
+
+Backends (selected with ``FAQ_INFERENCE_BACKEND`` or ``load_model(backend=...)``):
+
+- ``eager``             fp32 PyTorch module (default)
+- ``int8``              dynamic int8 quantization of the LSTM and Linear layers
+- ``torchscript``       TorchScript-compiled fp32 module
+- ``torchscript-int8``  TorchScript-compiled int8 module
+- ``onnx``              ONNX Runtime session (needs ``onnx``/``onnxruntime``)
+
+``siamese_faq_train.py`` writes the compiled exports (``encoder.ts``,
+``encoder_int8.ts``, ``encoder.onnx``) next to the weights, with an
+``exports.json`` recording which weights they were built from. At load time
+a missing or stale TorchScript export is rebuilt in memory from the fp32
+weights; ONNX has no such fallback and reverts to ``eager``. Every non-eager
+model is checked against the fp32 model on the FAQ questions before it is
+used (see ``parity_report``).
+"""
+import os
+import json
+import types
+import hashlib
+import logging
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+
+from faq_model_utils import batch_tensor
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'int8', 'torchscript', 'torchscript-int8', 'onnx')
+DEFAULT_BACKEND = os.environ.get('FAQ_INFERENCE_BACKEND', 'eager')
+
+# Minimum share of FAQ questions whose top-1 match must agree with fp32
+MIN_TOP1_AGREEMENT = float(os.environ.get('FAQ_INFERENCE_MIN_AGREEMENT', '0.98'))
+
+EXPORT_FILES = {
+    'torchscript': 'encoder.ts',
+    'torchscript-int8': 'encoder_int8.ts',
+    'onnx': 'encoder.onnx',
+}
+EXPORTS_MANIFEST = 'exports.json'
+
+
+def weights_fingerprint(model):
+    """SHA-1 over the fp32 state dict, used to detect stale exports."""
+    digest = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def quantize(model):
+    """Dynamic int8 quantization of the LSTM and Linear layers (CPU only)."""
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, which we don't depend on
+        warnings.simplefilter('ignore', DeprecationWarning)
+        warnings.simplefilter('ignore', UserWarning)
+        return torch.ao.quantization.quantize_dynamic(
+            model.cpu().eval(), {nn.LSTM, nn.Linear}, dtype=torch.qint8
+        )
+
+
+def script(model):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        # forward_once is compiled because forward calls it
+        return torch.jit.script(model.eval())
+
+
+class _Encoder(nn.Module):
+    """``forward_once`` as ``forward``, for exporters that only trace ``forward``."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.forward_once(x)
+
+
+class _PackedEncoder(nn.Module):
+    """Packing-free ``forward_once`` of a ``packed=True`` model, for ONNX export.
+
+    ``pack_padded_sequence`` and the data-dependent branch in ``forward_once``
+    don't survive tracing, so the bidirectional LSTM is split into its two
+    directions: the forward one runs over the right-padded rows as-is (pads
+    come after the real tokens), the backward one over each row reversed
+    within its length. Outputs at real positions match the packed model's and
+    pooling is masked to them, so any padding gives the same embedding.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        lstm = model.lstm
+        self.embedding = model.embedding
+        self.fc = model.fc
+        self.forward_lstm = nn.LSTM(lstm.input_size, lstm.hidden_size, batch_first=True)
+        self.backward_lstm = nn.LSTM(lstm.input_size, lstm.hidden_size, batch_first=True)
+        for name in ('weight_ih', 'weight_hh', 'bias_ih', 'bias_hh'):
+            getattr(self.forward_lstm, f'{name}_l0').data = getattr(lstm, f'{name}_l0').data
+            getattr(self.backward_lstm, f'{name}_l0').data = getattr(lstm, f'{name}_l0_reverse').data
+
+    def forward(self, x):
+        lengths = (x != 0).sum(dim=1).clamp(min=1)
+        positions = torch.arange(x.size(1), device=x.device).unsqueeze(0)
+        mask = positions < lengths.unsqueeze(1)
+        # Reverses the first ``length`` positions of each row; pads stay put
+        reverse = torch.where(mask, lengths.unsqueeze(1) - 1 - positions, positions)
+        embedded = self.embedding(x)
+        gather = reverse.unsqueeze(2).expand(-1, -1, embedded.size(2))
+        forward_out, _ = self.forward_lstm(embedded)
+        backward_out, _ = self.backward_lstm(torch.gather(embedded, 1, gather))
+        backward_out = torch.gather(backward_out, 1, reverse.unsqueeze(2).expand(-1, -1, backward_out.size(2)))
+        output = torch.cat((forward_out, backward_out), dim=2)
+        mask = mask.unsqueeze(2)
+        avg_pool = (output * mask).sum(dim=1) / lengths.unsqueeze(1).to(output.dtype)
+        max_pool, _ = torch.max(output.masked_fill(~mask, float('-inf')), dim=1)
+        out = torch.relu(self.fc(torch.cat((avg_pool, max_pool), dim=1)))
+        return nn.functional.normalize(out, p=2.0, dim=1)
+
+
+class OnnxEncoder:
+    """ONNX Runtime session exposing the slice of the module API the service uses.
+
+    ``packed`` mirrors the exported model, so ``batch_tensor`` pads packed
+    batches only to their longest row.
+    """
+
+    def __init__(self, path, out_features, threads=None, packed=False):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or torch.get_num_threads()
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.packed = packed
+        # encode_texts reads fc.out_features for empty batches
+        self.fc = types.SimpleNamespace(out_features=out_features)
+
+    def forward_once(self, x):
+        out = self.session.run(None, {self.input_name: x.cpu().numpy().astype(np.int64)})[0]
+        return torch.from_numpy(out)
+
+    def eval(self):
+        return self
+
+    def share_memory(self):
+        return self
+
+
+# === Export ===
+
+def export_onnx(model, path, max_len):
+    try:
+        import onnx  # noqa: F401  (required by torch.onnx)
+    except ImportError:
+        raise RuntimeError("ONNX export needs the 'onnx' package (pip install onnx onnxruntime)")
+    model = model.cpu().eval()
+    encoder = _PackedEncoder(model) if getattr(model, 'packed', False) else _Encoder(model)
+    # Two rows, one of them padded, so the example exercises the masking
+    example = torch.ones((2, max_len), dtype=torch.long)
+    example[1, max(1, max_len // 2):] = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        torch.onnx.export(
+            encoder.eval(), (example,), path,
+            input_names=['tokens'], output_names=['embedding'],
+            dynamic_axes={'tokens': {0: 'batch', 1: 'seq'}, 'embedding': {0: 'batch'}},
+            opset_version=17, dynamo=False,
+        )
+
+
+def write_exports(model, out_dir, max_len, backends=('torchscript', 'torchscript-int8')):
+    """Write the compiled exports for ``backends`` into ``out_dir``; returns the file names."""
+    written = {}
+    for backend in backends:
+        path = os.path.join(out_dir, EXPORT_FILES[backend])
+        if backend in ('torchscript', 'torchscript-int8'):
+            compiled = script(quantize(model) if backend == 'torchscript-int8' else model.cpu())
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', FutureWarning)
+                torch.jit.save(compiled, path)
+        elif backend == 'onnx':
+            export_onnx(model, path, max_len)
+        else:
+            raise ValueError(f"Backend {backend!r} has no export file")
+        written[backend] = EXPORT_FILES[backend]
+
+    with open(os.path.join(out_dir, EXPORTS_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({
+            'weights_sha1': weights_fingerprint(model),
+            'max_len': max_len,
+            'packed': bool(getattr(model, 'packed', False)),
+            'files': written,
+        }, f, indent=2)
+    return list(written.values()) + [EXPORTS_MANIFEST]
+
+
+def _read_export(artifact_dir, backend, fingerprint, packed=False):
+    """Path of a usable export for ``backend`` in ``artifact_dir``, or ``None``."""
+    path = os.path.join(artifact_dir, EXPORT_FILES[backend])
+    try:
+        with open(os.path.join(artifact_dir, EXPORTS_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if backend not in manifest.get('files', {}) or not os.path.exists(path):
+        return None
+    if manifest.get('weights_sha1') != fingerprint:
+        logger.warning(f"Ignoring stale {path}: built from different weights")
+        return None
+    if manifest.get('packed', False) != packed:
+        logger.warning(f"Ignoring stale {path}: exported for packed={manifest.get('packed', False)}")
+        return None
+    return path
+
+
+def build_inference_model(model, backend, artifact_dir=None):
+    """Return the ``backend`` variant of the fp32 ``model``.
+
+    Uses the export in ``artifact_dir`` when it matches the weights and
+    otherwise compiles it in memory. Raises ``RuntimeError`` when the
+    backend can't be built here (e.g. no onnxruntime or export file).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}; expected one of {BACKENDS}")
+    if backend == 'eager':
+        return model
+    if next(model.parameters()).device.type != 'cpu':
+        raise RuntimeError(f"Backend {backend!r} is CPU-only")
+    if backend == 'int8':
+        return quantize(model)
+
+    fingerprint = weights_fingerprint(model)
+    packed = bool(getattr(model, 'packed', False))
+    path = _read_export(artifact_dir, backend, fingerprint, packed) if artifact_dir else None
+    if backend == 'onnx':
+        if path is None:
+            raise RuntimeError(f"No up-to-date {EXPORT_FILES['onnx']} in {artifact_dir}")
+        return OnnxEncoder(path, model.fc.out_features, packed=packed)
+
+    if path is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            return torch.jit.load(path, map_location='cpu').eval()
+    logger.info(f"No {EXPORT_FILES[backend]} export for these weights; compiling in memory")
+    return script(quantize(model) if backend == 'torchscript-int8' else model)
+
+
+# === Parity ===
+
+def parity_report(reference, candidate, texts, vocab, max_len, faq_embeddings):
+    """Compare ``candidate`` with the fp32 ``reference`` on cleaned ``texts``.
+
+    Reports the largest embedding difference, the lowest cosine similarity
+    between the two embeddings of a text, and how often the top-1 FAQ match
+    (against ``faq_embeddings``) is the same.
+    """
+    seqs = batch_tensor(reference, [vocab.encode(t) for t in texts], max_len)
+    with torch.inference_mode():
+        ref = reference.forward_once(seqs).cpu().numpy()
+        out = candidate.forward_once(seqs).cpu().numpy()
+    faq_embeddings = np.asarray(faq_embeddings, dtype=np.float32)
+    agreement = float(np.mean(np.argmax(ref @ faq_embeddings.T, axis=1) == np.argmax(out @ faq_embeddings.T, axis=1)))
+    return {
+        'texts': len(texts),
+        'max_abs_diff': float(np.max(np.abs(ref - out))),
+        'min_cosine': float(np.min(np.sum(ref * out, axis=1))),
+        'top1_agreement': agreement,
+        'ok': agreement >= MIN_TOP1_AGREEMENT,
+    }
+
+
+def load_inference_model(model, backend, artifact_dir, vocab, max_len, faq_texts, faq_embeddings):
+    """Build ``backend`` and parity-check it, falling back to the fp32 model.
+
+    Returns ``(model, backend_actually_used)``.
+    """
+    if backend == 'eager':
+        return model, 'eager'
+    try:
+        candidate = build_inference_model(model, backend, artifact_dir)
+    except Exception as e:
+        logger.warning(f"Inference backend {backend!r} unavailable, using eager: {e}")
+        return model, 'eager'
+
+    report = parity_report(model, candidate, faq_texts, vocab, max_len, faq_embeddings)
+    if not report['ok']:
+        logger.warning(f"Inference backend {backend!r} failed the parity check, using eager: {report}")
+        return model, 'eager'
+    logger.info(f"Using {backend} inference backend (parity {report})")
+    return candidate, backend
@@ -0,0 +1,192 @@
+# lexical.py
+
+"""
+BM25 over the cleaned FAQ questions, fused with the dense cosine scores.
+
+``BM25Index`` is an inverted index stored as a term-major CSR matrix: row
+``t`` lists the FAQs containing term ``t`` with their precomputed BM25
+weights, so scoring a query sums a few rows. Terms come from the cleaned FAQ
+questions rather than the model vocabulary, so words added by FAQ edits
+after training still match.
+
+``hybrid_search`` combines the two signals:
+
+- A FAQ's BM25 score is divided by the query's attainable score (the sum of
+  its word idfs, counting words found in no FAQ), giving a ``coverage`` in
+  [0, 1] on the same scale as cosine similarity.
+- The fused score is ``max(cosine, (1 - w) * cosine + w * coverage)`` with
+  ``w = FAQ_HYBRID_WEIGHT``, so lexical evidence can only add confidence and
+  paraphrases that share no words keep their dense score.
+- Query words the model does not know are encoded as ``<UNK>`` and carry no
+  meaning in the dense score, so with a share ``s`` of them the result is
+  ``(1 - s) * fused + s * coverage``; a query made only of such words is
+  scored by coverage alone.
+- Up to ``FULL_SCORING_MAX`` FAQs every FAQ is scored both ways. Larger
+  corpora fuse the dense index's top matches with the best lexical ones,
+  and above ``FAQ_LEXICAL_PREFILTER`` FAQs queries with lexical hits skip
+  the dense index: only the BM25 shortlist is scored densely.
+"""
+import os
+
+import numpy as np
+from scipy import sparse
+
+from retrieval import normalize_rows, top_k
+
+HYBRID_WEIGHT = float(os.environ.get('FAQ_HYBRID_WEIGHT', '0.3'))
+PREFILTER_MIN_FAQS = int(os.environ.get('FAQ_LEXICAL_PREFILTER', '100000'))
+SHORTLIST_SIZE = int(os.environ.get('FAQ_LEXICAL_SHORTLIST', '1000'))
+# Dense and lexical matches each contribute this many candidates to fusion
+FUSION_CANDIDATES = 32
+# Below this many FAQs scoring all of them beats gathering candidates
+FULL_SCORING_MAX = 8192
+
+
+class BM25Index:
+    """Okapi BM25 over whitespace-separated cleaned texts."""
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.terms = {}
+        term_ids, docs = [], []
+        for doc, text in enumerate(texts):
+            for word in text.split():
+                term_ids.append(self.terms.setdefault(word, len(self.terms)))
+                docs.append(doc)
+        self.n_docs = len(texts)
+        counts = sparse.csr_matrix(
+            (np.ones(len(docs), dtype=np.float32), (term_ids, docs)), shape=(len(self.terms), self.n_docs)
+        )
+        counts.sum_duplicates()
+        doc_len = np.bincount(np.asarray(docs, dtype=np.int64), minlength=self.n_docs)
+        avg_len = doc_len.mean() if self.n_docs else 1.0
+        df = np.diff(counts.indptr)
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # idf of a word no FAQ contains; it still counts against coverage
+        self.unknown_idf = float(np.log1p((self.n_docs + 0.5) / 0.5))
+        tf = counts.data
+        norm = k1 * (1 - b + b * doc_len[counts.indices] / max(avg_len, 1e-9))
+        counts.data = (np.repeat(self.idf, df) * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+        self.weights = counts
+
+    def __len__(self):
+        return self.n_docs
+
+    def _postings(self, text):
+        words = set(text.split())
+        ids = [self.terms[w] for w in words if w in self.terms]
+        if not ids:
+            return None
+        attainable = float(self.idf[ids].sum()) + self.unknown_idf * (len(words) - len(ids))
+        indptr, indices, data = self.weights.indptr, self.weights.indices, self.weights.data
+        spans = [slice(indptr[i], indptr[i + 1]) for i in ids]
+        return np.concatenate([indices[s] for s in spans]), np.concatenate([data[s] for s in spans]), attainable
+
+    def coverage(self, text):
+        """Coverage of ``text`` for every FAQ (zeros when no word matches)."""
+        postings = self._postings(text)
+        if postings is None:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        docs, weights, attainable = postings
+        return np.minimum(np.bincount(docs, weights=weights, minlength=self.n_docs) / attainable, 1.0).astype(np.float32)
+
+    def match(self, text):
+        """``(rows, coverage)`` of the FAQs sharing at least one word with ``text``, rows ascending."""
+        postings = self._postings(text)
+        if postings is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs, weights, attainable = postings
+        if len(docs) * 100 < self.n_docs:
+            rows, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+        else:
+            # Long posting lists: accumulating densely beats sorting them
+            scores = np.bincount(docs, weights=weights, minlength=self.n_docs)
+            rows = np.flatnonzero(scores > 0)
+            scores = scores[rows]
+        return rows.astype(np.int64), np.minimum(scores / attainable, 1.0).astype(np.float32)
+
+
+def oov_share(text, vocab):
+    """Share of the words of a cleaned query missing from the model vocabulary."""
+    words = text.split()
+    if not words:
+        return 0.0
+    return sum(w not in vocab.word2idx for w in words) / len(words)
+
+
+def _fused(dense, lex, weight, unknown):
+    fused = np.maximum(dense, (1 - weight) * dense + weight * lex)
+    return (1 - unknown) * fused + unknown * lex
+
+
+def _fuse(index, query, lexical_rows, coverage, candidates, weight, unknown, k):
+    candidates = np.unique(np.asarray(candidates, dtype=np.int64))
+    dense = np.asarray(index.embeddings[candidates], dtype=np.float32) @ query
+    lex = np.zeros(len(candidates), dtype=np.float32)
+    if len(lexical_rows):
+        pos = np.minimum(np.searchsorted(lexical_rows, candidates), len(lexical_rows) - 1)
+        hit = lexical_rows[pos] == candidates
+        lex[hit] = coverage[pos[hit]]
+    fused = _fused(dense, lex, weight, unknown)
+    return [(int(candidates[i]), float(fused[i])) for i in top_k(fused, k)]
+
+
+def _fuse_all(index, lexical, queries, texts, vocab, weight, k):
+    dense = queries @ np.asarray(index.embeddings).T
+    results = []
+    for row, text in zip(dense, texts):
+        unknown = oov_share(text, vocab) if vocab is not None else 0.0
+        fused = _fused(row, lexical.coverage(text), weight, unknown)
+        results.append([(int(i), float(fused[i])) for i in top_k(fused, k)])
+    return results
+
+
+def _plan(lexical, text, vocab):
+    rows, coverage = lexical.match(text)
+    unknown = oov_share(text, vocab) if vocab is not None else 0.0
+    prefilter = len(rows) > 0 and len(lexical) > PREFILTER_MIN_FAQS
+    return rows, coverage, unknown, prefilter
+
+
+def _lexical_candidates(rows, coverage, size):
+    return rows[top_k(coverage, size)] if len(rows) else rows
+
+
+def hybrid_search(index, lexical, query_emb, text, k=1, vocab=None, weight=None):
+    """Top ``k`` ``(row, score)`` for one query; plain dense search when ``lexical`` is None."""
+    weight = HYBRID_WEIGHT if weight is None else weight
+    if lexical is None or weight <= 0:
+        return index.search(query_emb, k)
+    query = normalize_rows(query_emb)
+    if len(lexical) <= FULL_SCORING_MAX:
+        return _fuse_all(index, lexical, query[None, :], [text], vocab, weight, k)[0]
+    rows, coverage, unknown, prefilter = _plan(lexical, text, vocab)
+    if prefilter:
+        candidates = _lexical_candidates(rows, coverage, max(k, SHORTLIST_SIZE))
+    else:
+        dense = [i for i, _ in index.search(query_emb, max(k, FUSION_CANDIDATES))]
+        candidates = np.concatenate([dense, _lexical_candidates(rows, coverage, max(k, FUSION_CANDIDATES))])
+    return _fuse(index, query, rows, coverage, candidates, weight, unknown, k)
+
+
+def hybrid_search_batch(index, lexical, query_embs, texts, k=1, vocab=None, weight=None):
+    """``hybrid_search`` for many queries, with one batched dense search for those that need it."""
+    weight = HYBRID_WEIGHT if weight is None else weight
+    if lexical is None or weight <= 0:
+        return index.search_batch(query_embs, k)
+    queries = normalize_rows(np.atleast_2d(query_embs))
+    if len(lexical) <= FULL_SCORING_MAX:
+        return _fuse_all(index, lexical, queries, texts, vocab, weight, k)
+    plans = [_plan(lexical, text, vocab) for text in texts]
+    dense_rows = [i for i, plan in enumerate(plans) if not plan[3]]
+    dense = dict(zip(dense_rows, index.search_batch(queries[dense_rows], max(k, FUSION_CANDIDATES)))) if dense_rows else {}
+    results = []
+    for i, (rows, coverage, unknown, prefilter) in enumerate(plans):
+        if prefilter:
+            candidates = _lexical_candidates(rows, coverage, max(k, SHORTLIST_SIZE))
+        else:
+            candidates = np.concatenate([
+                [row for row, _ in dense[i]], _lexical_candidates(rows, coverage, max(k, FUSION_CANDIDATES)),
+            ])
+        results.append(_fuse(index, queries[i], rows, coverage, candidates, weight, unknown, k))
+    return results
@@ -0,0 +1,371 @@
+# model_registry.py
+
+"""
+Resident model registry for the FAQ service.
+
+The vocabulary, FAQ answers, SiameseNetwork weights and FAQ embeddings are
+loaded once and kept in memory as an immutable snapshot. Requests grab the
+current snapshot and use it for their whole lifetime, so a hot reload only
+swaps the reference and never disturbs a request that is already running.
+"""
+import os
+import re
+import json
+import hashlib
+import pickle
+import threading
+import time
+import logging
+
+import numpy as np
+import torch
+
+from faq_model_utils import SiameseNetwork, clean_text, warm_lemma_cache
+from retrieval import SimilarityIndex, load_index
+from artifact_bundle import (
+    CURRENT_FILE, MODEL_CONFIG_FILE, THRESHOLD_FILE, current_bundle_dir, load_bundle, read_model_config,
+    read_threshold, weights_digest,
+)
+from inference_export import DEFAULT_BACKEND, load_inference_model
+from fast_match import FAST_MATCH_ENABLED, FAQMatcher
+from lexical import HYBRID_WEIGHT, BM25Index, hybrid_search, hybrid_search_batch
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ARTIFACT_FILES = {
+    'vocab': 'vocab.pkl',
+    'faq_data': 'faq_data.json',
+    'model': 'siamese_faq_model.pt',
+    'embeddings': 'faq_embeddings.npy',
+}
+
+# Optional ANN index built offline by siamese_faq_train.py; exact search is
+# used when it is missing, stale, or FAQ_INDEX=flat.
+INDEX_FILE = 'faq_index.pkl'
+
+# A versioned bundle (see artifact_bundle.py) takes precedence over the
+# individual files above when bundles/CURRENT exists.
+BUNDLE_DIR = 'bundles'
+
+EMBEDDING_DIM = 50
+HIDDEN_DIM = 64
+
+# Seconds between on-disk change checks; 0 disables hot reload.
+DEFAULT_RELOAD_INTERVAL = float(os.environ.get('FAQ_RELOAD_INTERVAL', '5'))
+
+# Matches scoring below the threshold are forwarded to the helpdesk. A
+# faq_threshold.json written by calibration.py for the served weights replaces
+# the default; FAQ_CONFIDENCE_THRESHOLD overrides both.
+CONFIDENCE_THRESHOLD = float(os.environ.get('FAQ_CONFIDENCE_THRESHOLD', '0.87'))
+
+
+class ModelArtifacts:
+    """Immutable snapshot of everything needed to answer a FAQ query."""
+
+    def __init__(self, model, vocab, faq_data, embeddings, max_len, device, version, index=None, backend='eager',
+                 matcher=None, lexical=None, threshold=None, threshold_source='default', weights_sha256=None):
+        self.model = model
+        self.backend = backend
+        self.vocab = vocab
+        self.faq_data = faq_data
+        self.embeddings = embeddings
+        self.index = index if index is not None else SimilarityIndex(embeddings)
+        # Exact/near-duplicate question lookup (fast_match.py); None skips those tiers
+        self.matcher = matcher
+        # BM25 over the cleaned questions (lexical.py); None means dense-only search
+        self.lexical = lexical
+        # Confidence cutoff for these weights and where it came from (see _confidence_threshold)
+        self.threshold = CONFIDENCE_THRESHOLD if threshold is None else threshold
+        self.threshold_source = threshold_source
+        self.weights_sha256 = weights_sha256
+        # Set on per-tenant views built by faq_collections.py
+        self.collection = None
+        self.max_len = max_len
+        self.device = device
+        self.version = version
+        # Identifies the artifact files across processes (e.g. for shared caches)
+        self.fingerprint = str(version)
+        self.loaded_at = time.time()
+
+    def search(self, query_emb, text, k=1):
+        """Top ``k`` ``(row, score)`` for a query embedding and its cleaned text."""
+        return hybrid_search(self.index, self.lexical, query_emb, text, k, self.vocab)
+
+    def search_batch(self, query_embs, texts, k=1):
+        return hybrid_search_batch(self.index, self.lexical, query_embs, texts, k, self.vocab)
+
+
+def _warm_text_caches(vocab, faq_data):
+    # Memoize lemmas for every word we are likely to see before traffic arrives
+    warm_lemma_cache(list(vocab.word2idx)[2:])
+    warm_lemma_cache({w for item in faq_data for w in re.findall(r'[a-z0-9]+', item['question'].lower())})
+
+
+def _faq_matcher(faq_data, faq_texts):
+    return FAQMatcher(faq_data, faq_texts) if FAST_MATCH_ENABLED else None
+
+
+def _lexical_index(faq_texts):
+    return BM25Index(faq_texts) if HYBRID_WEIGHT > 0 else None
+
+
+def build_lookups(faq_data, faq_texts):
+    """``(matcher, lexical)`` for a FAQ set, each None when disabled (e.g. for faq_collections.py)."""
+    return _faq_matcher(faq_data, faq_texts), _lexical_index(faq_texts)
+
+
+def _confidence_threshold(base_dir, weights_sha256):
+    """``(threshold, source)`` for a snapshot; a calibration for other weights or scoring is ignored."""
+    if 'FAQ_CONFIDENCE_THRESHOLD' in os.environ:
+        return CONFIDENCE_THRESHOLD, 'env'
+    calibrated = read_threshold(base_dir)
+    if not calibrated:
+        return CONFIDENCE_THRESHOLD, 'default'
+    if calibrated.get('weights_sha256') != weights_sha256:
+        logger.warning(f"Ignoring {THRESHOLD_FILE}: calibrated for other model weights; re-run calibration.py")
+        return CONFIDENCE_THRESHOLD, 'default'
+    if calibrated.get('hybrid_weight') != HYBRID_WEIGHT:
+        logger.warning(f"Ignoring {THRESHOLD_FILE}: calibrated with FAQ_HYBRID_WEIGHT={calibrated.get('hybrid_weight')}")
+        return CONFIDENCE_THRESHOLD, 'default'
+    logger.info(f"Using calibrated confidence threshold {calibrated['threshold']} from {THRESHOLD_FILE}")
+    return float(calibrated['threshold']), 'calibrated'
+
+
+def load_artifacts(base_dir=BASE_DIR, device=None, version=0, backend=None):
+    """Read the training artifacts from ``base_dir`` into a new snapshot.
+
+    ``backend`` picks the inference variant of the model (see
+    inference_export.py); it defaults to ``FAQ_INFERENCE_BACKEND``.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    bundle_dir = current_bundle_dir(os.path.join(base_dir, BUNDLE_DIR))
+    if bundle_dir is not None:
+        verify = os.environ.get('FAQ_VERIFY_BUNDLE', '0') == '1'
+        bundle = load_bundle(bundle_dir, device, verify=verify)
+        logger.info(f"Loaded artifact bundle {bundle['manifest']['version']} from {bundle_dir}")
+        _warm_text_caches(bundle['vocab'], bundle['faq_data'])
+        index = bundle['index']
+        if index is None or os.environ.get('FAQ_INDEX', 'auto') == 'flat':
+            index = SimilarityIndex(bundle['embeddings'], normalized=True)
+        faq_texts = [clean_text(item['question']) for item in bundle['faq_data']]
+        model, backend = load_inference_model(
+            bundle['model'], backend, bundle_dir, bundle['vocab'], bundle['max_len'],
+            faq_texts, bundle['embeddings'],
+        )
+        digest = bundle['manifest']['files']['weights.pt']['sha256']
+        threshold, source = _confidence_threshold(base_dir, digest)
+        return ModelArtifacts(
+            model, bundle['vocab'], bundle['faq_data'], bundle['embeddings'],
+            bundle['max_len'], device, version, index, backend, _faq_matcher(bundle['faq_data'], faq_texts),
+            _lexical_index(faq_texts), threshold, source, digest,
+        )
+
+    paths = {name: os.path.join(base_dir, fname) for name, fname in ARTIFACT_FILES.items()}
+
+    with open(paths['vocab'], 'rb') as f:
+        vocab = pickle.load(f)
+
+    with open(paths['faq_data'], 'r', encoding='utf-8') as f:
+        faq_data = json.load(f)
+
+    # max_len is saved with the model (FAQ edits must not change it); older
+    # artifacts derive it from the questions the model was trained on
+    config = read_model_config(base_dir)
+    max_len = config.get('max_len') or max(len(item['question'].split()) for item in faq_data) + 2
+
+    _warm_text_caches(vocab, faq_data)
+
+    model = SiameseNetwork(len(vocab), EMBEDDING_DIM, HIDDEN_DIM, packed=config.get('packed', False)).to(device)
+    model.load_state_dict(torch.load(paths['model'], map_location=device))
+    model.eval()
+
+    embeddings = np.load(paths['embeddings'])
+    if len(embeddings) != len(faq_data):
+        raise ValueError(
+            f"faq_embeddings.npy has {len(embeddings)} rows but faq_data.json has {len(faq_data)} entries"
+        )
+
+    index = None
+    index_path = os.path.join(base_dir, INDEX_FILE)
+    if os.environ.get('FAQ_INDEX', 'auto') != 'flat' and os.path.exists(index_path):
+        try:
+            index = load_index(index_path, embeddings)
+            logger.info(f"Using {index.kind} index from {index_path} (recall@10 {index.recall})")
+        except Exception as e:
+            logger.warning(f"Ignoring {index_path}, falling back to exact search: {e}")
+
+    faq_texts = [clean_text(item['question']) for item in faq_data]
+    model, backend = load_inference_model(model, backend, base_dir, vocab, max_len, faq_texts, embeddings)
+    digest = weights_digest(base_dir)
+    threshold, source = _confidence_threshold(base_dir, digest)
+    return ModelArtifacts(
+        model, vocab, faq_data, embeddings, max_len, device, version, index, backend, _faq_matcher(faq_data, faq_texts),
+        _lexical_index(faq_texts), threshold, source, digest,
+    )
+
+
+class ModelRegistry:
+    """Holds the current ModelArtifacts and reloads them when files change.
+
+    ``get()`` loads lazily under a lock on first use. Afterwards it checks the
+    artifact files at most every ``reload_interval`` seconds and, once a change
+    has settled, reloads in a background thread while requests keep being
+    served from the previous snapshot.
+    """
+
+    def __init__(self, base_dir=BASE_DIR, reload_interval=DEFAULT_RELOAD_INTERVAL, device=None, backend=None):
+        self.base_dir = base_dir
+        self.reload_interval = reload_interval
+        self.device = device
+        self.backend = backend
+        self._lock = threading.Lock()
+        # Held around the first load only; load() takes _lock itself
+        self._first_load_lock = threading.Lock()
+        self._artifacts = None
+        self._signature = None
+        self._pending_signature = None
+        self._last_check = 0.0
+        self._reloading = False
+        self._error = None
+        self._listeners = []
+        self.reload_count = 0
+
+    # --- Loading ---
+
+    def _file_signature(self):
+        sig = []
+        watched = [INDEX_FILE, MODEL_CONFIG_FILE, THRESHOLD_FILE, os.path.join(BUNDLE_DIR, CURRENT_FILE)]
+        for fname in list(ARTIFACT_FILES.values()) + watched:
+            try:
+                st = os.stat(os.path.join(self.base_dir, fname))
+                sig.append((fname, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append((fname, None, None))
+        return tuple(sig)
+
+    def _swap(self, artifacts, signature):
+        self._artifacts = artifacts
+        self._signature = signature
+        self._error = None
+        for callback in list(self._listeners):
+            try:
+                callback(artifacts)
+            except Exception as e:
+                logger.error(f"Model reload listener failed: {e}")
+
+    def load(self):
+        """Load (or reload) the artifacts synchronously and return the snapshot."""
+        with self._lock:
+            signature = self._file_signature()
+            version = self._artifacts.version + 1 if self._artifacts else 1
+            logger.info(f"Loading FAQ model artifacts from {self.base_dir} (version {version})")
+            try:
+                artifacts = load_artifacts(self.base_dir, self.device, version, self.backend)
+            except Exception as e:
+                self._error = str(e)
+                logger.error(f"Error loading model: {e}")
+                raise
+            # Backends differ slightly numerically, so they must not share cache entries
+            artifacts.fingerprint = hashlib.sha1(repr((signature, artifacts.backend)).encode()).hexdigest()[:12]
+            self._swap(artifacts, signature)
+            self._last_check = time.monotonic()
+            if version > 1:
+                self.reload_count += 1
+            logger.info(f"Model loading completed successfully (version {version})")
+            return artifacts
+
+    def install(self, artifacts):
+        """Serve a snapshot built elsewhere (e.g. a synthetic corpus in bench_suite.py).
+
+        It stays current until the next ``load()`` or hot reload.
+        """
+        with self._lock:
+            artifacts.fingerprint = f"installed-{artifacts.version}-{id(artifacts):x}"
+            self._swap(artifacts, self._file_signature())
+            self._last_check = time.monotonic()
+        return artifacts
+
+    def get(self):
+        """Return the current snapshot, loading it on first use."""
+        artifacts = self._artifacts
+        if artifacts is None:
+            # Re-checked under the lock so concurrent first requests load once
+            with self._first_load_lock:
+                artifacts = self._artifacts
+                if artifacts is None:
+                    return self.load()
+        self._maybe_schedule_reload()
+        return artifacts
+
+    # --- Hot reload ---
+
+    def _maybe_schedule_reload(self):
+        if not self.reload_interval or self._reloading:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+
+        signature = self._file_signature()
+        if signature == self._signature:
+            self._pending_signature = None
+            return
+        # Files are still being written if the signature keeps moving; only
+        # reload once two consecutive checks agree.
+        if signature != self._pending_signature:
+            self._pending_signature = signature
+            return
+
+        self._pending_signature = None
+        self._reloading = True
+        threading.Thread(target=self._background_reload, name="faq-model-reload", daemon=True).start()
+
+    def _background_reload(self):
+        try:
+            self.load()
+        except Exception:
+            # Keep serving the previous snapshot; remember the failed files so
+            # we don't retry until they change again.
+            with self._lock:
+                self._signature = self._file_signature()
+        finally:
+            self._reloading = False
+
+    def add_listener(self, callback):
+        """Register ``callback(artifacts)`` to run after every successful (re)load."""
+        self._listeners.append(callback)
+
+    # --- Status ---
+
+    @property
+    def ready(self):
+        return self._artifacts is not None
+
+    def status(self):
+        artifacts = self._artifacts
+        status = {
+            'state': 'ready' if artifacts is not None else ('error' if self._error else 'not_loaded'),
+            'reloading': self._reloading,
+            'reload_count': self.reload_count,
+            'error': self._error,
+        }
+        if artifacts is not None:
+            status.update({
+                'version': artifacts.version,
+                'fingerprint': artifacts.fingerprint,
+                'loaded_at': artifacts.loaded_at,
+                'faq_count': len(artifacts.faq_data),
+                'device': str(artifacts.device),
+                'inference_backend': artifacts.backend,
+                'index': artifacts.index.kind,
+                'index_recall': artifacts.index.recall,
+                'confidence_threshold': artifacts.threshold,
+                'threshold_source': artifacts.threshold_source,
+            })
+        return status
@@ -0,0 +1,215 @@
+# observability.py
+
+"""
+Metrics and logging for the FAQ service.
+
+Metrics are kept in process memory and rendered in the Prometheus text
+exposition format by ``render()``, which ``/metrics`` serves. ``Counter`` and
+``Histogram`` are updated on the hot path (a lock and a few additions per
+call); ``CallbackMetric`` reads values that other components already keep
+(cache, micro-batcher, Whisper pool, model registry) at scrape time. Under
+gunicorn every worker has its own values and a scrape reaches whichever
+worker accepts it, so aggregate with ``sum``/``rate`` in queries.
+
+Logging is configured once by ``configure_logging()``:
+
+- ``FAQ_LOG_LEVEL`` (default ``INFO``) gates every logger.
+- ``FAQ_LOG_FORMAT=json`` emits one JSON object per line; the default
+  ``text`` format appends ``key=value`` fields to the message.
+- Per-request events go through ``log_event``, which returns before
+  building anything when the level is disabled, and only emits a
+  ``FAQ_LOG_SAMPLE_RATE`` share (default 0.01) of the enabled ones. Warnings
+  and errors are never sampled.
+"""
+import os
+import json
+import time
+import random
+import bisect
+import logging
+import threading
+
+# Seconds; spans sub-millisecond stages up to slow transcriptions
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+LOG_LEVEL = os.environ.get('FAQ_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('FAQ_LOG_FORMAT', 'text')
+LOG_SAMPLE_RATE = float(os.environ.get('FAQ_LOG_SAMPLE_RATE', '0.01'))
+
+_METRICS = []
+
+
+# === Metrics ===
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def inc(self, *labels, amount=1):
+        """Add ``amount``; ``labels`` are the label values in ``labelnames`` order."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def lines(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def since(self, start, *labels):
+        """Observe the seconds elapsed since ``start`` (a ``time.perf_counter()`` value)."""
+        self.observe(time.perf_counter() - start, *labels)
+
+    def snapshot(self, *labels):
+        """``{'count', 'sum'}`` for one label combination."""
+        series = self._series.get(labels)
+        return {'count': series[2], 'sum': series[1]} if series else {'count': 0, 'sum': 0.0}
+
+    def lines(self):
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_label_text(self.labelnames, labels, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_label_text(self.labelnames, labels)} {count}"
+
+
+class CallbackMetric:
+    """Counter or gauge whose value is read from ``fn()`` at scrape time.
+
+    ``fn`` returns a number, or a dict mapping label-value tuples to numbers;
+    ``None`` skips the metric.
+    """
+
+    def __init__(self, name, help, fn, kind='gauge', labelnames=()):
+        self.name, self.help, self.fn, self.kind, self.labelnames = name, help, fn, kind, tuple(labelnames)
+        _METRICS.append(self)
+
+    def lines(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}"
+
+
+def render():
+    """All registered metrics in the Prometheus text format (version 0.0.4)."""
+    out = []
+    for metric in _METRICS:
+        lines = list(metric.lines())
+        if not lines:
+            continue
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(lines)
+    return '\n'.join(out) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# === Logging ===
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f"{k}={v!r}" if isinstance(v, str) else f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """Install one root handler with the configured level and format."""
+    handler = logging.StreamHandler()
+    if (fmt or LOG_FORMAT) == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter('%(levelname)s:%(name)s:%(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or LOG_LEVEL)
+
+
+def log_event(logger, level, event, sampled=True, **fields):
+    """Log ``event`` with structured ``fields`` if ``level`` is enabled (and sampled in).
+
+    Callers pass raw values, so nothing is formatted for events that are
+    dropped.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sampled and level < logging.WARNING and random.random() >= LOG_SAMPLE_RATE:
+        return
+    logger.log(level, event, extra={'fields': fields})
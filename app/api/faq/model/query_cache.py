@@ -0,0 +1,188 @@
+# query_cache.py
+
+"""
+Bounded LRU + TTL cache for FAQ answers, keyed on the cleaned query text.
+
+Entries are tagged with the model fingerprint they were computed with, and
+the service clears the cache whenever the registry reloads, so answers never
+outlive the model or ``faq_data.json`` that produced them. An optional shared
+backend (Redis, or the in-process ``LocalBackend`` stand-in) lets several
+gunicorn workers reuse each other's results.
+"""
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    """In-process stand-in for a shared cache backend (``get``/``set`` with TTL)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Shared backend on Redis; requires the optional ``redis`` package."""
+
+    def __init__(self, url, prefix='faq:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def clear(self):
+        # Keys carry the model fingerprint, so stale entries simply expire
+        pass
+
+
+def make_backend(spec):
+    """Build a shared backend from ``FAQ_CACHE_BACKEND`` ('', 'local' or a redis:// URL)."""
+    if not spec:
+        return None
+    if spec == 'local':
+        return LocalBackend()
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            return RedisBackend(spec)
+        except ImportError:
+            logger.warning("FAQ_CACHE_BACKEND points at Redis but the redis package is not installed")
+            return None
+    raise ValueError(f"Unsupported cache backend: {spec}")
+
+
+class QueryCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_size=10000, ttl=300.0, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.shared_hits = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def make_key(fingerprint, cleaned):
+        return f"{fingerprint}:{cleaned}"
+
+    def get(self, fingerprint, cleaned):
+        """Return the cached value or ``None``."""
+        if not self.enabled:
+            return None
+        key = self.make_key(fingerprint, cleaned)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+
+        if self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache lookup failed: {e}")
+                value = None
+            if value is not None:
+                value = tuple(value)
+                self._store(key, value, now)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, fingerprint, cleaned, value):
+        if not self.enabled:
+            return
+        key = self.make_key(fingerprint, cleaned)
+        self._store(key, value, time.monotonic())
+        if self.backend is not None:
+            try:
+                self.backend.set(key, list(value), self.ttl)
+            except Exception as e:
+                logger.warning(f"Shared cache write failed: {e}")
+
+    def _store(self, key, value, now):
+        with self._lock:
+            self._data[key] = (value, now + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after the model or FAQ data was reloaded."""
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+        if self.backend is not None:
+            try:
+                self.backend.clear()
+            except Exception as e:
+                logger.warning(f"Shared cache clear failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'backend': type(self.backend).__name__ if self.backend is not None else None,
+            }
@@ -0,0 +1,388 @@
+# retrieval.py
+
+"""
+Vectorized similarity search over the FAQ embedding matrix.
+
+The embeddings are L2-normalized once when the index is built, so scoring a
+query against every FAQ is a single matrix-vector product and picking the
+best matches is an ``np.argpartition`` instead of a full sort.
+
+For large corpora the same ``search``/``search_batch`` interface is offered
+by an inverted-file (IVF) index in pure NumPy and, when ``faiss-cpu`` is
+installed, by faiss flat/IVF/HNSW indexes. Indexes are built offline by
+``siamese_faq_train.py`` and saved next to ``faq_embeddings.npy``.
+"""
+import hashlib
+import pickle
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+INDEX_KINDS = ('flat', 'ivf', 'faiss-flat', 'faiss-ivf', 'faiss-hnsw')
+
+
+def normalize_rows(matrix, eps=1e-8):
+    """Return a float32 copy of ``matrix`` with unit-length rows."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        return matrix / (np.linalg.norm(matrix) + eps)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / (norms + eps)
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` highest scores, best first."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+
+def top_k_rows(scores, k):
+    """Row-wise ``top_k`` for a 2-D score matrix; returns ``(indices, scores)``."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0), dtype=np.int64)
+        return empty, empty.astype(scores.dtype)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), scores.shape).copy()
+    part = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-part, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+# Upper bound on the number of float32 scores materialized at once by
+# ``search_batch`` (~64 MB), so large corpora don't blow up memory.
+MAX_SCORE_ELEMENTS = 1 << 24
+
+
+def unit_rows(embeddings, normalized=False):
+    """Rows an index searches: ``embeddings`` itself when already unit float32.
+
+    Pre-normalized rows (e.g. a memory-mapped bundle) are used as-is so every
+    worker shares the same pages instead of a copy.
+    """
+    if normalized and getattr(embeddings, 'dtype', None) == np.float32:
+        return embeddings
+    return normalize_rows(embeddings)
+
+
+def embeddings_checksum(embeddings):
+    """Fingerprint used to tell whether a saved index matches the embeddings."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    return hashlib.sha1(embeddings.tobytes()).hexdigest()
+
+
+class SimilarityIndex:
+    """Exact cosine-similarity search over a fixed embedding matrix."""
+
+    kind = 'flat'
+
+    def __init__(self, embeddings, normalized=False):
+        self.embeddings = unit_rows(embeddings, normalized)
+        self.recall = 1.0
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def scores(self, query_emb):
+        """Cosine similarity of one query against every FAQ row."""
+        return self.embeddings @ normalize_rows(query_emb)
+
+    def search(self, query_emb, k=1):
+        """Return the ``k`` best ``(index, score)`` pairs for one query."""
+        scores = self.scores(query_emb)
+        return [(int(i), float(scores[i])) for i in top_k(scores, k)]
+
+    def search_batch(self, query_embs, k=1):
+        """Top-k for many queries at once via matrix-matrix products.
+
+        Returns one ``[(index, score), ...]`` list per query row.
+        """
+        queries = normalize_rows(np.atleast_2d(query_embs))
+        chunk = max(1, MAX_SCORE_ELEMENTS // max(1, len(self.embeddings)))
+        results = []
+        for start in range(0, len(queries), chunk):
+            scores = queries[start:start + chunk] @ self.embeddings.T
+            idx, top = top_k_rows(scores, k)
+            results.extend(
+                [(int(i), float(s)) for i, s in zip(row_idx, row_scores)]
+                for row_idx, row_scores in zip(idx, top)
+            )
+        return results
+
+    def updated(self, embeddings, kept):
+        """Index over ``embeddings``; ``kept[i]`` is row i's old row or -1 if new."""
+        return SimilarityIndex(embeddings)
+
+    def state(self):
+        return {}
+
+
+FlatIndex = SimilarityIndex
+
+
+def _spherical_kmeans(data, n_clusters, n_iter, rng, chunk=65536):
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    assign = np.zeros(len(data), dtype=np.int64)
+    for _ in range(n_iter):
+        for start in range(0, len(data), chunk):
+            assign[start:start + chunk] = np.argmax(data[start:start + chunk] @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random points so every list is used
+            sums[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file ANN index: k-means lists, search only the closest ``n_probe``.
+
+    Rows are stored grouped by list so probing a list is a contiguous slice;
+    ``grouped`` passes that matrix in (e.g. memory-mapped from a bundle)
+    instead of gathering a private copy.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, embeddings, centroids, list_ids, list_offsets, n_probe, normalized=False, grouped=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.n_probe = min(n_probe, len(self.centroids))
+        self.embeddings = unit_rows(embeddings, normalized)
+        self._grouped = self.embeddings[self.list_ids] if grouped is None else grouped
+        self.recall = None
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, n_probe=8, n_iter=10, sample_size=100000, seed=0):
+        data = normalize_rows(embeddings)
+        n = len(data)
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+        rng = np.random.default_rng(seed)
+        sample = data if n <= sample_size else data[rng.choice(n, sample_size, replace=False)]
+        centroids = _spherical_kmeans(sample, n_lists, n_iter, rng)
+
+        assign = np.concatenate([
+            np.argmax(data[start:start + 65536] @ centroids.T, axis=1)
+            for start in range(0, n, 65536)
+        ]) if n else np.zeros(0, dtype=np.int64)
+        list_ids = np.argsort(assign, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        return cls(embeddings, centroids, list_ids, list_offsets, n_probe)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def _search_probed(self, query, probe, k):
+        slices = [slice(self.list_offsets[l], self.list_offsets[l + 1]) for l in probe]
+        candidates = np.concatenate([self._grouped[s] for s in slices])
+        ids = np.concatenate([self.list_ids[s] for s in slices])
+        scores = candidates @ query
+        return [(int(ids[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    def search(self, query_emb, k=1):
+        query = normalize_rows(query_emb)
+        probe = top_k(self.centroids @ query, self.n_probe)
+        return self._search_probed(query, probe, k)
+
+    def search_batch(self, query_embs, k=1):
+        queries = normalize_rows(np.atleast_2d(query_embs))
+        probes, _ = top_k_rows(queries @ self.centroids.T, self.n_probe)
+        return [self._search_probed(q, p, k) for q, p in zip(queries, probes)]
+
+    def updated(self, embeddings, kept):
+        """Same centroids; kept rows stay in their list, new rows join the closest one."""
+        kept = np.asarray(kept, dtype=np.int64)
+        old_assign = np.empty(len(self.list_ids), dtype=np.int64)
+        old_assign[self.list_ids] = np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets))
+        assign = np.empty(len(kept), dtype=np.int64)
+        new = kept < 0
+        assign[~new] = old_assign[kept[~new]]
+        if new.any():
+            assign[new] = np.argmax(normalize_rows(np.asarray(embeddings)[new]) @ self.centroids.T, axis=1)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(self.centroids)))])
+        return IVFIndex(embeddings, self.centroids, np.argsort(assign, kind='stable'), list_offsets, self.n_probe)
+
+    def state(self):
+        return {
+            'centroids': self.centroids,
+            'list_ids': self.list_ids,
+            'list_offsets': self.list_offsets,
+            'n_probe': self.n_probe,
+        }
+
+    @classmethod
+    def from_state(cls, embeddings, state, normalized=False, grouped=None):
+        return cls(embeddings, state['centroids'], state['list_ids'], state['list_offsets'], state['n_probe'],
+                   normalized, grouped)
+
+
+class FaissIndex:
+    """Inner-product faiss index (flat, IVF or HNSW); requires ``faiss-cpu``."""
+
+    def __init__(self, embeddings, index, kind, normalized=False):
+        self.embeddings = unit_rows(embeddings, normalized)
+        self.index = index
+        self.kind = kind
+        self.recall = None
+
+    @classmethod
+    def build(cls, embeddings, kind='faiss-flat', n_lists=None, n_probe=8, hnsw_m=32, ef_search=64):
+        if faiss is None:
+            raise ImportError("faiss-cpu is not installed; pip install faiss-cpu or use the 'ivf' index")
+        data = normalize_rows(embeddings)
+        dim = data.shape[1]
+        if kind == 'faiss-flat':
+            index = faiss.IndexFlatIP(dim)
+        elif kind == 'faiss-ivf':
+            n_lists = max(1, min(n_lists or int(4 * np.sqrt(len(data))), len(data)))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, n_lists, faiss.METRIC_INNER_PRODUCT)
+            index.train(data)
+            index.nprobe = n_probe
+        elif kind == 'faiss-hnsw':
+            index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = ef_search
+        else:
+            raise ValueError(f"Unknown faiss index kind: {kind}")
+        index.add(data)
+        return cls(embeddings, index, kind)
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def search(self, query_emb, k=1):
+        return self.search_batch(query_emb, k)[0]
+
+    def search_batch(self, query_embs, k=1):
+        queries = normalize_rows(np.atleast_2d(query_embs))
+        scores, ids = self.index.search(queries, min(k, len(self)))
+        return [
+            [(int(i), float(s)) for i, s in zip(row_ids, row_scores) if i >= 0]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def updated(self, embeddings, kept):
+        """Re-add every row to a copy of the trained index (IVF keeps its quantizer)."""
+        index = faiss.clone_index(self.index)
+        index.reset()
+        index.add(normalize_rows(embeddings))
+        return FaissIndex(embeddings, index, self.kind)
+
+    def state(self):
+        return {'faiss_index': faiss.serialize_index(self.index)}
+
+    @classmethod
+    def from_state(cls, embeddings, state, kind, normalized=False):
+        if faiss is None:
+            raise ImportError("faiss-cpu is required to load a faiss index")
+        return cls(embeddings, faiss.deserialize_index(state['faiss_index']), kind, normalized)
+
+
+# === Building, evaluation and persistence ===
+
+def build_index(embeddings, kind='flat', **params):
+    """Build an index of the given ``kind`` (see ``INDEX_KINDS``)."""
+    if kind == 'flat':
+        return SimilarityIndex(embeddings)
+    if kind == 'ivf':
+        return IVFIndex.build(embeddings, **params)
+    if kind.startswith('faiss-'):
+        return FaissIndex.build(embeddings, kind, **params)
+    raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+
+
+def make_eval_queries(embeddings, n_queries=1000, noise=0.1, seed=0):
+    """Perturbed copies of random FAQ embeddings, standing in for paraphrases."""
+    rng = np.random.default_rng(seed)
+    data = normalize_rows(embeddings)
+    rows = rng.choice(len(data), min(n_queries, len(data)), replace=False)
+    return normalize_rows(data[rows] + rng.normal(0, noise, (len(rows), data.shape[1])).astype(np.float32))
+
+
+def measure_recall(index, queries, k=10, exact=None):
+    """Mean recall@k of ``index`` against exact flat search over the same rows."""
+    exact = exact or SimilarityIndex(index.embeddings)
+    truth = exact.search_batch(queries, k)
+    found = index.search_batch(queries, k)
+    hits = sum(len({i for i, _ in t} & {i for i, _ in f}) for t, f in zip(truth, found))
+    total = sum(len(t) for t in truth)
+    index.recall = hits / total if total else 1.0
+    return index.recall
+
+
+def save_index(index, path, checksum=None):
+    """Pickle the index structure (not the embeddings) alongside its metadata.
+
+    ``checksum`` is the ``embeddings_checksum`` of the index rows when the
+    caller already has it. Returns the checksum that was saved.
+    """
+    checksum = checksum or embeddings_checksum(index.embeddings)
+    payload = {
+        'kind': index.kind,
+        'n_rows': len(index.embeddings),
+        'embeddings_sha1': checksum,
+        'recall': index.recall,
+        'state': index.state(),
+    }
+    with open(path, 'wb') as f:
+        pickle.dump(payload, f)
+    return checksum
+
+
+def _checksum_matches(expected, embeddings):
+    if expected == embeddings_checksum(embeddings):
+        return True
+    # Stored embeddings are often already normalized; normalizing them again
+    # changes the low bits, so accept a match on the normalized matrix as well
+    return expected == embeddings_checksum(normalize_rows(embeddings))
+
+
+def load_index(path, embeddings, normalized=False, checksum=None, grouped=None):
+    """Load an index saved by ``save_index`` over ``embeddings``.
+
+    ``normalized`` marks ``embeddings`` as unit float32 rows the index can
+    search in place. ``checksum`` is their known ``embeddings_checksum``
+    (bundles record it in the manifest), which saves hashing the matrix;
+    ``grouped`` is the IVF list-ordered copy of the rows, when stored.
+    Raises ``ValueError`` if the file was built from different embeddings.
+    """
+    with open(path, 'rb') as f:
+        payload = pickle.load(f)
+    if payload['n_rows'] != len(embeddings):
+        raise ValueError(f"{path} was built from different embeddings")
+    if checksum is not None:
+        matches = payload['embeddings_sha1'] == checksum
+    else:
+        matches = _checksum_matches(payload['embeddings_sha1'], embeddings)
+    if not matches:
+        raise ValueError(f"{path} was built from different embeddings")
+    kind = payload['kind']
+    if kind == 'flat':
+        index = SimilarityIndex(embeddings, normalized)
+    elif kind == 'ivf':
+        index = IVFIndex.from_state(embeddings, payload['state'], normalized, grouped)
+    elif kind.startswith('faiss-'):
+        index = FaissIndex.from_state(embeddings, payload['state'], kind, normalized)
+    else:
+        raise ValueError(f"Unknown index kind '{kind}' in {path}")
+    index.recall = payload.get('recall')
+    return index
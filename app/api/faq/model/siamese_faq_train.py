@@ -1,17 +1,58 @@
 # siamese_faq_train.py
-from faq_model_utils import load_dataset, clean_text, Vocab, create_pairs, FAQPairsDataset, SiameseNetwork, encode_text, train_siamese
+from faq_model_utils import load_dataset, clean_text, Vocab, SiameseNetwork, encode_texts
+from retrieval import INDEX_KINDS, build_index, make_eval_queries, measure_recall, save_index
+from artifact_bundle import MODEL_CONFIG_FILE, write_bundle
+from training_data import EncodedCorpus, SynonymTable, default_workers, pair_loader
+from inference_export import EXPORT_FILES, build_inference_model, parity_report, write_exports
+from training_loop import (
+    VAL_METRICS, answer_groups, evaluate_retrieval, fit, load_validation_file, mine_hard_negatives,
+    validation_queries,
+)
+import argparse
 import torch
 import torch.optim as optim
 import numpy as np
 import pickle
 import json
-from torch.utils.data import DataLoader
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the Siamese FAQ model and build its search index")
+    parser.add_argument('--dataset', default=r'C:\Users\admin\Desktop\COLLEGE\SEM 6\NLP\PROJECT\Ecommerce_FAQ_Chatbot_dataset.json',
+                        help="FAQ dataset JSON with a top-level 'questions' list")
+    parser.add_argument('--index', choices=INDEX_KINDS, default='flat',
+                        help="Search index to build over the FAQ embeddings")
+    parser.add_argument('--n-lists', type=int, default=None, help="IVF lists (default 4*sqrt(n))")
+    parser.add_argument('--n-probe', type=int, default=8, help="IVF lists probed per query")
+    parser.add_argument('--fixed-padding', action='store_true',
+                        help="Train the original model that pads every input to max_len instead of packing sequences")
+    parser.add_argument('--epochs', type=int, default=20, help="Maximum epochs")
+    parser.add_argument('--loss', choices=['contrastive', 'in-batch'], default='contrastive',
+                        help="Per-pair contrastive loss, or softmax over every right-hand side in the batch")
+    parser.add_argument('--temperature', type=float, default=0.05, help="Softmax temperature for --loss in-batch")
+    parser.add_argument('--negatives', choices=['random', 'hard'], default='random',
+                        help="Uniform negatives, or ones mined from the current FAQ embedding similarities")
+    parser.add_argument('--hard-k', type=int, default=10, help="Nearest other-answer questions kept per question")
+    parser.add_argument('--hard-ratio', type=float, default=0.5, help="Share of negatives drawn from the mined ones")
+    parser.add_argument('--mine-every', type=int, default=2, help="Epochs between re-mining hard negatives")
+    parser.add_argument('--val-file', help="Held-out JSON list of {\"query\", \"question\"} (default: perturbed questions)")
+    parser.add_argument('--val-metric', choices=VAL_METRICS, default='mrr', help="Held-out metric for early stopping")
+    parser.add_argument('--patience', type=int, default=3, help="Epochs without improvement before stopping (0: never)")
+    parser.add_argument('--threshold', type=float, default=0.87,
+                        help="Serving confidence threshold used for the held-out 'answered' rate")
+    parser.add_argument('--batch-size', type=int, default=16, help="Pairs per batch")
+    parser.add_argument('--workers', type=int, default=default_workers(), help="DataLoader worker processes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--export', nargs='*', choices=list(EXPORT_FILES), default=['torchscript', 'torchscript-int8'],
+                        help="Compiled inference exports to write next to the weights and into the bundle")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    dataset_path = r'C:\Users\admin\Desktop\COLLEGE\SEM 6\NLP\PROJECT\Ecommerce_FAQ_Chatbot_dataset.json'  # Update path if needed
+    dataset_path = args.dataset
     faq_data = load_dataset(dataset_path)
     faq_questions = [clean_text(item['question']) for item in faq_data]
 
@@ -20,27 +61,76 @@ def main():
         vocab.add_sentence(q)
 
     max_len = max(len(q.split()) for q in faq_questions) + 2
-    left, right, labels = create_pairs(faq_questions)
-
-    dataset = FAQPairsDataset(left, right, labels, vocab, max_len)
-    dataloader = DataLoader(dataset, batch_size=16, shuffle=True)
+    # Encode once; pairs are sampled from the int arrays every epoch
+    packed = not args.fixed_padding
+    corpus = EncodedCorpus(faq_questions, vocab)
+    dataloader = pair_loader(
+        corpus, SynonymTable(vocab), batch_size=args.batch_size,
+        max_len=None if packed else max_len, workers=args.workers,
+        pin_memory=device.type == 'cuda', seed=args.seed, hard_ratio=args.hard_ratio,
+    )
 
-    model = SiameseNetwork(len(vocab), 50, 64).to(device)
+    model = SiameseNetwork(len(vocab), 50, 64, packed=packed).to(device)
     optimizer = optim.Adam(model.parameters(), lr=0.001)
 
-    train_siamese(model, dataloader, optimizer, epochs=20, device=device)
+    # Held-out queries scored against the current FAQ embeddings after every epoch
+    groups = answer_groups(faq_data)
+    if args.val_file:
+        val_queries, val_targets = load_validation_file(args.val_file, faq_questions)
+    else:
+        val_queries, val_targets = validation_queries(faq_questions, seed=args.seed)
+    print(f"Held-out queries: {len(val_queries)}")
+
+    def validate(m):
+        return evaluate_retrieval(m, val_queries, val_targets, faq_questions, vocab, max_len,
+                                  groups=groups, threshold=args.threshold, device=device)
+
+    def mine(m):
+        return mine_hard_negatives(m, faq_questions, vocab, max_len, k=args.hard_k, groups=groups, device=device)
 
-    faq_embeddings = [encode_text(model, q, vocab, max_len, device) for q in faq_questions]
-    faq_embeddings = np.array(faq_embeddings)
+    result = fit(model, dataloader, optimizer, epochs=args.epochs, device=device,
+                 loss=args.loss, temperature=args.temperature,
+                 mine=mine if args.negatives == 'hard' else None, mine_every=args.mine_every,
+                 validate=validate if len(val_queries) else None, metric=args.val_metric, patience=args.patience)
+    print(f"Training throughput: {result['pairs_per_sec']:.0f} pairs/s")
+    if result['best'] is not None:
+        print(f"Best held-out {args.val_metric}: {result['best']:.4f} at epoch {result['best_epoch']}")
+
+    faq_embeddings = encode_texts(model, faq_questions, vocab, max_len, device=device, clean=False)
+
+    # Build the search index offline and report its recall against exact search
+    index_params = {}
+    if args.index in ('ivf', 'faiss-ivf'):
+        index_params = {'n_lists': args.n_lists, 'n_probe': args.n_probe}
+    index = build_index(faq_embeddings, args.index, **index_params)
+    recall = measure_recall(index, make_eval_queries(faq_embeddings), k=10)
+    print(f"Index: {index.kind} recall@10 vs exact search: {recall:.4f}")
 
     # Save artifacts
     torch.save(model.state_dict(), "siamese_faq_model.pt")
+    with open(MODEL_CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump({'packed': packed, 'max_len': max_len}, f)
     with open("vocab.pkl", "wb") as f:
         pickle.dump(vocab, f)
     with open("faq_data.json", "w", encoding="utf-8") as f:
         json.dump(faq_data, f, indent=4)
     np.save("faq_embeddings.npy", faq_embeddings)
+    save_index(index, "faq_index.pkl")
+
+    # Optimized inference exports, each checked against the fp32 model
+    model = model.cpu().eval()
+    write_exports(model, ".", max_len, args.export)
+    for backend in ['int8'] + args.export:
+        report = parity_report(model, build_inference_model(model, backend, "."),
+                               faq_questions, vocab, max_len, faq_embeddings)
+        print(f"Inference backend {backend}: top-1 agreement {report['top1_agreement']:.4f}, "
+              f"max |diff| {report['max_abs_diff']:.5f}{'' if report['ok'] else '  (FAILED parity check)'}")
+
+    # Single versioned, memory-mappable bundle the service prefers over the files above
+    bundle_dir = write_bundle("bundles", model, vocab, faq_data, faq_embeddings, max_len, index,
+                              exports=args.export)
+    print(f"Wrote artifact bundle {bundle_dir}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
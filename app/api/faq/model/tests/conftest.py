@@ -0,0 +1,9 @@
+# conftest.py
+"""
+The service modules import each other by bare name (they run from this
+directory), so the tests put the model directory on ``sys.path`` first.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+# test_batching.py
+"""Micro-batched encoding must give every query the embedding it gets alone."""
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from app import encode_cleaned_batch
+from batching import MicroBatcher
+from faq_model_utils import SiameseNetwork, Vocab, encode_text
+
+MAX_LEN = 12
+QUERIES = [
+    "track order", "payment method accept", "cancel", "return product refund window",
+    "ship international", "package never arrived", "change delivery address order placed",
+    "gift card", "order", "contact support phone email chat",
+]
+
+
+def _snapshot(packed, seed):
+    torch.manual_seed(seed)
+    vocab = Vocab()
+    for query in QUERIES:
+        vocab.add_sentence(query)
+    model = SiameseNetwork(len(vocab), 16, 32, packed=packed).eval()
+    return SimpleNamespace(model=model, vocab=vocab, max_len=MAX_LEN, device='cpu')
+
+
+@pytest.mark.parametrize('packed', [True, False])
+def test_micro_batches_match_single_queries(packed):
+    snapshots = [_snapshot(packed, 0), _snapshot(packed, 1)]
+    items = [(snapshots[i % 2], query) for i, query in enumerate(QUERIES * 3)]
+    batcher = MicroBatcher(encode_cleaned_batch, max_batch_size=8, max_wait_ms=20)
+
+    results = [None] * len(items)
+    start = threading.Barrier(len(items))
+
+    def submit(i):
+        start.wait()
+        results[i] = batcher.submit(items[i], timeout=30)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(items))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Concurrent submits were coalesced, across both snapshots
+    assert batcher.stats.batches < len(items)
+    for (snapshot, query), emb in zip(items, results):
+        alone = encode_text(snapshot.model, query, snapshot.vocab, MAX_LEN)
+        np.testing.assert_allclose(emb, alone, atol=1e-5)
@@ -0,0 +1,70 @@
+# test_faq_collections.py
+"""Collections load on demand and the least recently used ones are evicted over budget."""
+import json
+import os
+
+import numpy as np
+import torch
+
+from faq_collections import CollectionStore
+from faq_model_utils import SiameseNetwork, Vocab
+from model_registry import ModelArtifacts
+
+QUESTIONS = ["how can i track my order", "what payment methods do you accept", "can i cancel my order",
+             "how do i return a product", "do you ship internationally"]
+
+
+def _base():
+    torch.manual_seed(0)
+    vocab = Vocab()
+    for question in QUESTIONS:
+        vocab.add_sentence(question)
+    model = SiameseNetwork(len(vocab), 16, 32).eval()
+    return ModelArtifacts(model, vocab, [], np.zeros((0, 32), dtype=np.float32), 12, 'cpu', 1,
+                          weights_sha256='weights-v1')
+
+
+def _write_collections(root, ids):
+    for collection_id in ids:
+        os.makedirs(root / collection_id)
+        faqs = [{'question': q, 'answer': f"{collection_id}: {q}"} for q in QUESTIONS]
+        (root / collection_id / 'faq_data.json').write_text(json.dumps(faqs), encoding='utf-8')
+
+
+def test_least_recently_used_collection_is_evicted(tmp_path):
+    _write_collections(tmp_path, ['store-a', 'store-b', 'store-c'])
+    base = _base()
+
+    # Equal collections, so the budget holds exactly two of them
+    probe = CollectionStore(str(tmp_path), reload_interval=0)
+    probe.get('store-a', base)
+    size = probe.stats()['bytes']
+    store = CollectionStore(str(tmp_path), memory_budget=2 * size, reload_interval=0)
+
+    for collection_id in ('store-a', 'store-b', 'store-a', 'store-c'):
+        view = store.get(collection_id, base)
+        assert view.collection == collection_id
+        assert view.faq_data[0]['answer'].startswith(collection_id)
+
+    stats = store.stats()
+    # store-b was used least recently when store-c arrived
+    assert list(stats['collections']) == ['store-c', 'store-a']
+    assert (stats['loads'], stats['evictions']) == (3, 1)
+
+    # An evicted collection loads again on its next request, evicting the next LRU one
+    store.get('store-b', base)
+    stats = store.stats()
+    assert list(stats['collections']) == ['store-b', 'store-c']
+    assert (stats['loads'], stats['evictions']) == (4, 2)
+    assert stats['bytes'] <= store.memory_budget
+
+
+def test_collection_over_budget_alone_stays_loaded(tmp_path):
+    _write_collections(tmp_path, ['store-a', 'store-b'])
+    base = _base()
+    store = CollectionStore(str(tmp_path), memory_budget=1, reload_interval=0)
+    store.get('store-a', base)
+    store.get('store-b', base)
+    stats = store.stats()
+    assert list(stats['collections']) == ['store-b']
+    assert stats['evictions'] == 1
@@ -0,0 +1,48 @@
+# test_inference_export.py
+"""Every inference backend must match the fp32 model, packed or padded."""
+import numpy as np
+import pytest
+import torch
+
+from faq_model_utils import SiameseNetwork, batch_tensor
+from inference_export import build_inference_model, write_exports
+
+MAX_LEN = 12
+# fp32 exports must be numerically equivalent; int8 only close
+TOLERANCE = {'torchscript': 1e-5, 'onnx': 1e-5, 'int8': 0.1, 'torchscript-int8': 0.1}
+
+
+def _backend_model(model, backend, tmp_path):
+    if backend == 'onnx':
+        pytest.importorskip('onnxruntime')
+        pytest.importorskip('onnx')
+        write_exports(model, str(tmp_path), MAX_LEN, ('onnx',))
+    return build_inference_model(model, backend, str(tmp_path))
+
+
+@pytest.mark.parametrize('backend', sorted(TOLERANCE))
+@pytest.mark.parametrize('packed', [True, False])
+def test_backend_matches_fp32(backend, packed, tmp_path):
+    torch.manual_seed(0)
+    model = SiameseNetwork(100, 50, 64, packed=packed).eval()
+    candidate = _backend_model(model, backend, tmp_path)
+    assert getattr(candidate, 'packed', packed) == packed
+
+    rng = np.random.default_rng(0)
+    seqs = [rng.integers(2, 100, n).tolist() for n in (1, 3, 7, MAX_LEN, 5)]
+    with torch.inference_mode():
+        ref = model.forward_once(batch_tensor(model, seqs, MAX_LEN)).numpy()
+        out = candidate.forward_once(batch_tensor(candidate, seqs, MAX_LEN)).numpy()
+    assert np.max(np.abs(ref - out)) < TOLERANCE[backend]
+
+
+@pytest.mark.parametrize('backend', sorted(TOLERANCE))
+def test_packed_backend_ignores_padding(backend, tmp_path):
+    torch.manual_seed(0)
+    model = SiameseNetwork(100, 50, 64, packed=True).eval()
+    candidate = _backend_model(model, backend, tmp_path)
+    seq = [5, 17, 42]
+    with torch.inference_mode():
+        alone = candidate.forward_once(torch.tensor([seq])).numpy()
+        padded = candidate.forward_once(torch.tensor([seq + [0] * (MAX_LEN - len(seq))])).numpy()
+    np.testing.assert_allclose(alone, padded, atol=1e-5)
@@ -0,0 +1,105 @@
+# test_lexical.py
+"""BM25 fusion: lexical evidence can only raise a FAQ, and every search path ranks alike."""
+import numpy as np
+import pytest
+
+import lexical
+from faq_model_utils import Vocab
+from lexical import BM25Index, hybrid_search, hybrid_search_batch
+from retrieval import SimilarityIndex, normalize_rows
+
+TEXTS = [
+    "track order",
+    "payment method accept",
+    "cancel order",
+    "return product",
+    "ship international",
+    "package never arrived",
+    "change delivery address",
+    "gift card balance",
+]
+
+
+def _index(dim=16, seed=0):
+    return SimilarityIndex(np.random.default_rng(seed).normal(size=(len(TEXTS), dim)).astype(np.float32))
+
+
+def _vocab(texts=TEXTS):
+    vocab = Vocab()
+    for text in texts:
+        vocab.add_sentence(text)
+    return vocab
+
+
+def test_coverage_is_highest_for_the_matching_question_and_zero_without_shared_words():
+    bm25 = BM25Index(TEXTS)
+    coverage = bm25.coverage("gift card balance")
+    assert 0.5 < coverage[7] <= 1.0
+    assert np.count_nonzero(coverage) == 1
+    assert not bm25.coverage("unrelated words").any()
+    rows, row_coverage = bm25.match("cancel order")
+    np.testing.assert_array_equal(rows, [0, 2])
+    assert row_coverage[1] > row_coverage[0]
+
+
+def test_shared_words_break_a_dense_tie():
+    # Every FAQ equally close to the query: the one sharing its words wins
+    index = SimilarityIndex(np.tile(np.eye(4, dtype=np.float32)[0], (len(TEXTS), 1)))
+    query = np.array([1, 1, 0, 0], dtype=np.float32)
+    results = hybrid_search(index, BM25Index(TEXTS), query, "return product", k=3, vocab=_vocab(), weight=0.3)
+    assert results[0][0] == 3
+    assert results[0][1] > results[1][1]
+
+
+def test_fusion_never_lowers_the_dense_score():
+    index, bm25 = _index(), BM25Index(TEXTS)
+    query = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    dense = dict(index.search(query, len(TEXTS)))
+    fused = hybrid_search(index, bm25, query, "track order cancel", k=len(TEXTS), vocab=_vocab(), weight=0.3)
+    assert all(score >= dense[row] - 1e-6 for row, score in fused)
+    assert [s for _, s in fused] == sorted((s for _, s in fused), reverse=True)
+
+
+def test_zero_weight_is_plain_dense_search():
+    index = _index()
+    query = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    assert hybrid_search(index, BM25Index(TEXTS), query, "track order", k=4, weight=0) == index.search(query, 4)
+
+
+def test_unknown_words_are_scored_by_coverage():
+    # Words missing from the model vocabulary carry no dense meaning
+    index, bm25 = _index(), BM25Index(TEXTS)
+    query = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    results = hybrid_search(index, bm25, query, "gift card balance", k=1, vocab=_vocab(TEXTS[:7]), weight=0.3)
+    assert results[0] == (7, pytest.approx(bm25.coverage("gift card balance")[7]))
+
+
+@pytest.mark.parametrize('prefilter', [False, True])
+def test_candidate_fusion_ranks_like_full_scoring(prefilter, monkeypatch):
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(60)]
+    texts = [' '.join(rng.choice(words, 4, replace=False)) for _ in range(300)]
+    index = SimilarityIndex(rng.normal(size=(len(texts), 16)).astype(np.float32))
+    bm25, vocab = BM25Index(texts), _vocab(texts)
+    queries = normalize_rows(index.embeddings[:20] + rng.normal(0, 0.3, (20, 16)).astype(np.float32))
+    query_texts = [' '.join(t.split()[:2]) for t in texts[:20]]
+
+    full = hybrid_search_batch(index, bm25, queries, query_texts, k=len(texts), vocab=vocab, weight=0.3)
+    if prefilter:
+        # The prefilter only scores FAQs sharing a word with the query
+        shortlists = [set(bm25.match(text)[0].tolist()) for text in query_texts]
+        full = [[(row, score) for row, score in ranked if row in shortlist]
+                for ranked, shortlist in zip(full, shortlists)]
+    full = [ranked[:3] for ranked in full]
+    # Force the large-corpus paths (dense plus lexical candidates, or the BM25
+    # shortlist) with candidate counts covering every FAQ that can compete
+    monkeypatch.setattr(lexical, 'FULL_SCORING_MAX', 0)
+    monkeypatch.setattr(lexical, 'PREFILTER_MIN_FAQS', 0 if prefilter else len(texts))
+    monkeypatch.setattr(lexical, 'FUSION_CANDIDATES', len(texts))
+    monkeypatch.setattr(lexical, 'SHORTLIST_SIZE', len(texts))
+    batched = hybrid_search_batch(index, bm25, queries, query_texts, k=3, vocab=vocab, weight=0.3)
+    single = [hybrid_search(index, bm25, q, t, k=3, vocab=vocab, weight=0.3) for q, t in zip(queries, query_texts)]
+
+    for expected, found, alone in zip(full, batched, single):
+        assert [row for row, _ in found] == [row for row, _ in expected] == [row for row, _ in alone]
+        np.testing.assert_allclose([s for _, s in found], [s for _, s in expected], atol=1e-5)
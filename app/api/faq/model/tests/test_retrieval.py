@@ -0,0 +1,113 @@
+# test_retrieval.py
+"""Top-k selection and the IVF index's incremental updates and persistence."""
+import numpy as np
+import pytest
+
+from retrieval import (
+    IVFIndex, SimilarityIndex, load_index, normalize_rows, save_index, top_k, top_k_rows,
+)
+
+
+def _embeddings(n=400, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _assignments(index):
+    assign = np.empty(len(index.list_ids), dtype=np.int64)
+    assign[index.list_ids] = np.repeat(np.arange(len(index.centroids)), np.diff(index.list_offsets))
+    return assign
+
+
+def _assert_same_results(found, expected):
+    # Batched and single-query products may differ in the last float bits
+    assert [[i for i, _ in r] for r in found] == [[i for i, _ in r] for r in expected]
+    np.testing.assert_allclose([[s for _, s in r] for r in found], [[s for _, s in r] for r in expected], atol=1e-6)
+
+
+# === top_k / top_k_rows ===
+
+@pytest.mark.parametrize('k', [0, 1, 5, 49, 50, 80])
+def test_top_k_rows_matches_full_sort(k):
+    rng = np.random.default_rng(k)
+    scores = rng.normal(size=(7, 50)).astype(np.float32)
+    idx, top = top_k_rows(scores, k)
+    expected = np.argsort(-scores, axis=1)[:, :k]
+    np.testing.assert_array_equal(idx, expected)
+    np.testing.assert_array_equal(top, np.take_along_axis(scores, expected, axis=1))
+    for row, row_idx in zip(scores, idx):
+        np.testing.assert_array_equal(top_k(row, k), row_idx)
+
+
+def test_top_k_rows_with_ties_returns_the_best_scores():
+    scores = np.random.default_rng(0).normal(size=(5, 40)).astype(np.float32)
+    scores[:, 10:20] = 0.5
+    idx, top = top_k_rows(scores, 12)
+    np.testing.assert_array_equal(top, -np.sort(-scores, axis=1)[:, :12])
+    np.testing.assert_array_equal(top, np.take_along_axis(scores, idx, axis=1))
+    assert all(len(set(row)) == 12 for row in idx)
+
+
+def test_flat_search_batch_matches_search():
+    data = _embeddings()
+    index = SimilarityIndex(data)
+    queries = _embeddings(20, seed=1)
+    _assert_same_results(index.search_batch(queries, 5), [index.search(q, 5) for q in queries])
+
+
+# === IVFIndex ===
+
+def test_ivf_updated_keeps_lists_and_places_new_rows():
+    data = _embeddings()
+    index = IVFIndex.build(data, n_lists=8, n_probe=8)
+    old_assign = _assignments(index)
+
+    # Delete every third row, move the rest around and append new rows
+    kept_rows = np.arange(len(data))[np.arange(len(data)) % 3 != 0][::-1]
+    new_rows = _embeddings(25, seed=2)
+    embeddings = np.concatenate([data[kept_rows], new_rows])
+    kept = np.concatenate([kept_rows, -np.ones(len(new_rows), dtype=np.int64)])
+    updated = index.updated(embeddings, kept)
+
+    assign = _assignments(updated)
+    np.testing.assert_array_equal(assign[:len(kept_rows)], old_assign[kept_rows])
+    closest = np.argmax(normalize_rows(new_rows) @ index.centroids.T, axis=1)
+    np.testing.assert_array_equal(assign[len(kept_rows):], closest)
+
+    # Probing every list is exact search over the new rows
+    queries = _embeddings(30, seed=3)
+    _assert_same_results(updated.search_batch(queries, 5), SimilarityIndex(embeddings).search_batch(queries, 5))
+
+
+def test_ivf_state_round_trip():
+    data = _embeddings()
+    index = IVFIndex.build(data, n_lists=8, n_probe=3)
+    restored = IVFIndex.from_state(data, index.state())
+    queries = _embeddings(30, seed=3)
+    _assert_same_results(restored.search_batch(queries, 5), index.search_batch(queries, 5))
+
+
+@pytest.mark.parametrize('normalized', [False, True])
+def test_ivf_save_load_round_trip(normalized, tmp_path):
+    data = _embeddings()
+    if normalized:
+        # As stored in a bundle
+        data = normalize_rows(data)
+    index = IVFIndex.build(data, n_lists=8, n_probe=3)
+    path = str(tmp_path / 'faq_index.pkl')
+    checksum = save_index(index, path)
+
+    queries = _embeddings(30, seed=3)
+    for kwargs in ({}, {'checksum': checksum}):
+        restored = load_index(path, data, normalized=normalized, **kwargs)
+        assert restored.kind == 'ivf'
+        _assert_same_results(restored.search_batch(queries, 5), index.search_batch(queries, 5))
+
+
+def test_load_index_rejects_other_embeddings(tmp_path):
+    data = _embeddings()
+    path = str(tmp_path / 'faq_index.pkl')
+    save_index(IVFIndex.build(data, n_lists=8), path)
+    with pytest.raises(ValueError):
+        load_index(path, _embeddings(seed=5))
+    with pytest.raises(ValueError):
+        load_index(path, data[:-1])
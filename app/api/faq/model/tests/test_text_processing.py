@@ -0,0 +1,57 @@
+# test_text_processing.py
+"""``clean_text`` (regex fast path, lemma memo) must match the NLTK pipeline."""
+import json
+import os
+
+import pytest
+
+import faq_model_utils
+from faq_model_utils import clean_text, clean_text_reference
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRICKY = [
+    "How can I track my order?",
+    "  What   payment\tmethods do you accept?!  ",
+    "hello, how are you",
+    "hello,,how are you",
+    "a , b ,, c",
+    "price 1,000 or 2,5",
+    "ends with a period.",
+    "two periods.. here",
+    "e.g. this one",
+    "Mr. Smith's order",
+    "I cannot log in",
+    "gimme my refund, wanna cancel",
+    "don't won't can't",
+    "\"quoted\" (parens) [brackets]",
+    "email me at a@b.com",
+    "café au lait",
+    "100% sure?",
+    "order #12345",
+    "",
+    "   ",
+    "?!,",
+    ".",
+]
+
+
+@pytest.mark.parametrize('text', TRICKY)
+def test_clean_text_matches_reference(text):
+    assert clean_text(text) == clean_text_reference(text)
+
+
+def test_clean_text_matches_reference_on_faq_questions():
+    with open(os.path.join(BASE_DIR, 'faq_data.json'), 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)]
+    for text in questions + [q.lower().rstrip('?') for q in questions]:
+        assert clean_text(text) == clean_text_reference(text), text
+
+
+def test_plain_questions_take_the_fast_path():
+    stats = faq_model_utils.clean_text_stats
+    before = dict(stats)
+    clean_text("how do i return a product?")
+    clean_text("hello,,how are you")
+    assert stats['fast_path'] == before['fast_path'] + 1
+    assert stats['nltk_path'] == before['nltk_path'] + 1
@@ -0,0 +1,192 @@
+# training_data.py
+
+"""
+Training data pipeline for the Siamese FAQ model.
+
+The corpus is encoded once into a flat int32 token array with offsets
+(``EncodedCorpus``) and WordNet synonyms are looked up once per vocabulary
+word (``SynonymTable``). Each epoch, ``PairBatchSampler`` plans batches of
+question indices (bucketed by length for packed models) and ``PairBatches``
+turns one plan into a ready-to-use batch inside a DataLoader worker: for
+every question one positive pair (question, augmented question) and one
+negative pair (question, other question), padded as tensors. Negatives are
+drawn uniformly in O(1), or, once ``hard_negatives`` has been set on the
+sampler (see training_loop.py), partly from each question's mined nearest
+neighbours. DataLoader therefore runs with ``batch_size=None`` and only moves
+finished batches, pinned when training on a GPU.
+
+This replaces ``create_pairs``/``FAQPairsDataset`` for training: the pairs
+follow the same recipe (same augmentation rule, same 1:1 positive/negative
+mix) but are resampled every epoch instead of fixed once.
+"""
+import os
+import itertools
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from faq_model_utils import MAX_TOKENS, synonyms
+
+# augment_text leaves texts with fewer tokens unchanged
+AUGMENT_MIN_TOKENS = 4
+
+
+class EncodedCorpus:
+    """Token ids of many texts stored as one flat int32 array plus offsets."""
+
+    def __init__(self, texts, vocab):
+        seqs = [vocab.encode(t) for t in texts]
+        self.lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+        self.offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.offsets[1:])
+        self.tokens = np.fromiter(itertools.chain.from_iterable(seqs), dtype=np.int32, count=int(self.offsets[-1]))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+
+class SynonymTable:
+    """Replacement token ids for every vocabulary id, in CSR form.
+
+    Synonyms come from ``lookup`` (WordNet by default) once per word instead
+    of once per augmented row; ones outside the vocabulary map to ``<UNK>``,
+    exactly as encoding an ``augment_text`` result would.
+    """
+
+    def __init__(self, vocab, lookup=synonyms):
+        unk = vocab.word2idx["<UNK>"]
+        candidates = [[] for _ in range(len(vocab))]
+        for word, idx in vocab.word2idx.items():
+            if idx > unk:
+                candidates[idx] = [vocab.word2idx.get(name, unk) for name in lookup(word)]
+        self.offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in candidates], out=self.offsets[1:])
+        self.ids = np.fromiter(itertools.chain.from_iterable(candidates), dtype=np.int32, count=int(self.offsets[-1]))
+
+    def augment_rows(self, rows, lengths, rng):
+        """Replace one random token of each padded row (in place) with a synonym.
+
+        Rows shorter than ``AUGMENT_MIN_TOKENS`` and tokens without synonyms
+        are left unchanged, as in ``augment_text``.
+        """
+        lengths = np.asarray(lengths)
+        row_ids = np.arange(len(rows))
+        positions = (rng.random(len(rows)) * np.maximum(lengths, 1)).astype(np.int64)
+        tokens = rows[row_ids, positions]
+        start = self.offsets[tokens]
+        count = self.offsets[tokens + 1] - start
+        picked = start + (rng.random(len(rows)) * count).astype(np.int64)
+        change = (lengths >= AUGMENT_MIN_TOKENS) & (count > 0)
+        rows[row_ids[change], positions[change]] = self.ids[picked[change]]
+
+
+class PairBatchSampler(Sampler):
+    """Yields ``(batch_seed, question_indices, negatives)`` plans, a new order every epoch.
+
+    ``hard_negatives`` is an optional ``[n, k]`` array of candidate negatives
+    per question (padded with -1); when set, each question's negative comes
+    from its row with probability ``hard_ratio`` and uniformly otherwise.
+    """
+
+    def __init__(self, lengths, questions_per_batch, bucket=True, seed=0, hard_ratio=0.5):
+        self.lengths = list(lengths)
+        self.questions_per_batch = questions_per_batch
+        self.bucket = bucket
+        self.seed = seed
+        self.hard_ratio = hard_ratio
+        self.hard_negatives = None
+        self.epoch = 0
+
+    def negatives(self, rng):
+        """One negative per question for this epoch, never the question itself."""
+        n = len(self.lengths)
+        if n < 2:
+            return np.arange(n)
+        negatives = rng.integers(n - 1, size=n)
+        negatives += negatives >= np.arange(n)
+        if self.hard_negatives is not None:
+            counts = (self.hard_negatives >= 0).sum(axis=1)
+            rows = np.flatnonzero((counts > 0) & (rng.random(n) < self.hard_ratio))
+            picks = (rng.random(len(rows)) * counts[rows]).astype(np.int64)
+            negatives[rows] = self.hard_negatives[rows, picks]
+        return negatives
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        if self.bucket:
+            # Shuffle, then stable-sort by length: random ties, similar lengths per batch
+            order = rng.permutation(len(self.lengths))
+            order = order[np.argsort(np.asarray(self.lengths)[order], kind='stable')]
+        else:
+            order = rng.permutation(len(self.lengths))
+        negatives = self.negatives(rng)
+        batches = [order[i:i + self.questions_per_batch] for i in range(0, len(order), self.questions_per_batch)]
+        rng.shuffle(batches)
+        seeds = rng.integers(2 ** 63, size=len(batches))
+        self.epoch += 1
+        return iter([(seed, batch, negatives[batch]) for seed, batch in zip(seeds.tolist(), batches)])
+
+    def __len__(self):
+        return (len(self.lengths) + self.questions_per_batch - 1) // self.questions_per_batch
+
+
+class PairBatches(Dataset):
+    """Builds one padded ``(left, right, labels)`` batch per sampler plan."""
+
+    def __init__(self, corpus, synonym_table, max_len=None):
+        self.corpus = corpus
+        self.synonyms = synonym_table
+        # Fixed-padding models need exactly max_len; packed ones the batch's longest
+        self.max_len = max_len
+
+    def _gather(self, ids):
+        """Padded ``[len(ids), length]`` int64 array of the given corpus rows."""
+        lengths = self.corpus.lengths[ids]
+        length = self.max_len or int(np.clip(lengths.max(initial=1), 1, MAX_TOKENS))
+        lengths = np.minimum(lengths, length)
+        columns = np.arange(length)
+        mask = columns < lengths[:, None]
+        out = np.zeros((len(ids), length), dtype=np.int64)
+        out[mask] = self.corpus.tokens[(self.corpus.offsets[ids][:, None] + columns)[mask]]
+        return out, lengths
+
+    def __getitem__(self, plan):
+        batch_seed, indices, negatives = plan
+        rng = np.random.default_rng(batch_seed)
+        indices = np.asarray(indices, dtype=np.int64)
+        negatives = np.asarray(negatives, dtype=np.int64)
+
+        # Pairs interleaved as (q, augmented q) -> 1, (q, negative) -> 0
+        left, _ = self._gather(np.repeat(indices, 2))
+        right, lengths = self._gather(np.stack([indices, negatives], axis=1).ravel())
+        self.synonyms.augment_rows(right[0::2], lengths[0::2], rng)
+        labels = torch.tensor([1.0, 0.0] * len(indices))
+        return torch.from_numpy(left), torch.from_numpy(right), labels
+
+
+def pair_loader(corpus, synonym_table, batch_size=16, max_len=None, workers=0, pin_memory=False, seed=0,
+                hard_ratio=0.5):
+    """DataLoader of pre-collated pair batches (``batch_size`` pairs each).
+
+    Each question yields two pairs per epoch, so batches hold
+    ``batch_size // 2`` questions. Mined negatives go on ``loader.sampler``.
+    """
+    sampler = PairBatchSampler(corpus.lengths, max(1, batch_size // 2), bucket=max_len is None, seed=seed,
+                               hard_ratio=hard_ratio)
+    return DataLoader(
+        PairBatches(corpus, synonym_table, max_len),
+        batch_size=None,
+        sampler=sampler,
+        num_workers=workers,
+        pin_memory=pin_memory,
+        persistent_workers=workers > 0,
+        prefetch_factor=4 if workers > 0 else None,
+    )
+
+
+def default_workers():
+    return min(4, max(0, (os.cpu_count() or 1) - 1))
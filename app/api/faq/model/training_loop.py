@@ -0,0 +1,180 @@
+# training_loop.py
+
+"""
+Training modes beyond random negatives, and early stopping.
+
+- Hard negatives: ``mine_hard_negatives`` encodes every question with the
+  current model and keeps each one's most similar questions that have a
+  different answer. ``fit`` re-mines every few epochs and hands the result to
+  the loader's ``PairBatchSampler``, so negatives stay hard as the model moves.
+- In-batch loss: ``fit(loss='in-batch')`` trains with
+  ``in_batch_softmax_loss``, which scores every question against every
+  right-hand side in its batch instead of one negative.
+- Early stopping: ``evaluate_retrieval`` scores a held-out query set (query ->
+  FAQ) against the current ``faq_embeddings``; ``fit`` keeps the weights of
+  the best epoch and stops once the chosen metric has not improved for
+  ``patience`` epochs.
+"""
+import copy
+import json
+import random
+
+import numpy as np
+
+from faq_model_utils import clean_text, encode_texts, synonyms, train_epoch
+from retrieval import MAX_SCORE_ELEMENTS, normalize_rows, top_k_rows
+
+VAL_METRICS = ('mrr', 'recall_at_1', 'answered')
+
+
+def answer_groups(faq_data):
+    """Group id per FAQ; questions sharing an answer are never each other's negatives."""
+    ids = {}
+    return np.array([ids.setdefault(item['answer'].strip(), len(ids)) for item in faq_data], dtype=np.int64)
+
+
+def _chunks(n, width):
+    step = max(1, MAX_SCORE_ELEMENTS // max(1, width))
+    for start in range(0, n, step):
+        yield np.arange(start, min(start + step, n))
+
+
+def mine_hard_negatives(model, texts, vocab, max_len, k=10, groups=None, device='cpu'):
+    """``[n, k]`` most similar other-answer questions per question (best first, -1 padded)
+    and the mean similarity of each question's hardest negative."""
+    embeddings = normalize_rows(encode_texts(model, texts, vocab, max_len, device=device, clean=False))
+    n = len(embeddings)
+    groups = np.arange(n) if groups is None else np.asarray(groups)
+    neighbours = np.full((n, k), -1, dtype=np.int64)
+    hardest = []
+    for rows in _chunks(n, n):
+        scores = embeddings[rows] @ embeddings.T
+        scores[groups[rows][:, None] == groups[None, :]] = -np.inf
+        idx, top = top_k_rows(scores, k)
+        idx[~np.isfinite(top)] = -1
+        neighbours[rows, :idx.shape[1]] = idx
+        if top.shape[1]:
+            hardest.append(top[np.isfinite(top[:, 0]), 0])
+    hardest = np.concatenate(hardest) if hardest else np.empty(0)
+    return neighbours, float(hardest.mean()) if len(hardest) else 0.0
+
+
+def validation_queries(texts, seed=0, lookup=synonyms):
+    """Held-out query per question: one token dropped and another replaced by a synonym.
+
+    Training positives only ever swap a synonym, so the dropped token makes
+    these queries unseen. Single-token questions are skipped. Returns
+    ``(queries, targets)`` with ``targets`` indexing ``texts``.
+    """
+    rng = random.Random(seed)
+    queries, targets = [], []
+    for i, text in enumerate(texts):
+        tokens = text.split()
+        if len(tokens) < 2:
+            continue
+        del tokens[rng.randrange(len(tokens))]
+        pos = rng.randrange(len(tokens))
+        options = lookup(tokens[pos])
+        if options:
+            tokens[pos] = rng.choice(options)
+        queries.append(' '.join(tokens))
+        targets.append(i)
+    return queries, np.array(targets, dtype=np.int64)
+
+
+def load_validation_file(path, texts):
+    """``(queries, targets)`` from a JSON list of ``{"query", "question"}`` objects.
+
+    ``question`` must match one of ``texts`` after ``clean_text``; other rows
+    are dropped.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = json.load(f)
+    position = {t: i for i, t in enumerate(texts)}
+    pairs = [(clean_text(r['query']), position.get(clean_text(r['question']))) for r in rows]
+    pairs = [(q, i) for q, i in pairs if i is not None]
+    return [q for q, _ in pairs], np.array([i for _, i in pairs], dtype=np.int64)
+
+
+def evaluate_retrieval(model, queries, targets, texts, vocab, max_len, groups=None, threshold=0.87, device='cpu'):
+    """Retrieval quality of ``queries`` against the model's embeddings of ``texts``.
+
+    A hit is any FAQ in the target's answer group. Returns ``recall_at_1``,
+    ``mrr``, ``answered`` (correct top-1 at or above ``threshold``, i.e. not
+    sent to the helpdesk), ``wrong_answered`` (wrong top-1 at or above it)
+    and ``margin`` (target score minus the best other-answer score).
+    """
+    if not len(queries):
+        return dict.fromkeys(('recall_at_1', 'mrr', 'answered', 'wrong_answered', 'margin'), 0.0)
+    faq = normalize_rows(encode_texts(model, texts, vocab, max_len, device=device, clean=False))
+    embs = normalize_rows(encode_texts(model, queries, vocab, max_len, device=device, clean=False))
+    groups = np.arange(len(texts)) if groups is None else np.asarray(groups)
+    targets = np.asarray(targets)
+    target_score = np.empty(len(queries))
+    best_other = np.empty(len(queries))
+    rank = np.empty(len(queries))
+    for rows in _chunks(len(queries), len(texts)):
+        scores = embs[rows] @ faq.T
+        same = groups[targets[rows]][:, None] == groups[None, :]
+        target_score[rows] = np.where(same, scores, -np.inf).max(axis=1)
+        others = np.where(same, -np.inf, scores)
+        best_other[rows] = others.max(axis=1)
+        rank[rows] = (others >= target_score[rows][:, None]).sum(axis=1)
+    correct = target_score > best_other
+    top1 = np.maximum(target_score, best_other)
+    return {
+        'recall_at_1': float(correct.mean()),
+        'mrr': float((1.0 / (rank + 1)).mean()),
+        'answered': float((correct & (top1 >= threshold)).mean()),
+        'wrong_answered': float((~correct & (top1 >= threshold)).mean()),
+        'margin': float(np.mean(target_score - best_other)),
+    }
+
+
+def fit(model, loader, optimizer, epochs=20, device='cpu', loss='contrastive', temperature=0.05,
+        mine=None, mine_every=2, validate=None, metric='mrr', patience=3, min_delta=1e-4):
+    """Train with optional hard-negative mining and early stopping.
+
+    ``mine(model)`` returns ``(neighbours, hardest_mean)`` as
+    ``mine_hard_negatives`` does; it runs after the first epoch and then every
+    ``mine_every`` epochs. ``validate(model)`` returns an
+    ``evaluate_retrieval`` dict; with it the best epoch's weights (by
+    ``metric``) are restored at the end and ``patience`` > 0 stops training
+    after that many epochs without an improvement of ``min_delta``.
+
+    Returns ``{'history', 'best_epoch', 'best', 'pairs_per_sec'}``.
+    """
+    history, best, best_epoch, best_state = [], None, 0, None
+    total_pairs, total_time = 0, 0.0
+    for epoch in range(1, epochs + 1):
+        row = {'epoch': epoch}
+        if mine is not None and epoch > 1 and (epoch - 2) % mine_every == 0:
+            loader.sampler.hard_negatives, row['hardest_negative_sim'] = mine(model)
+        row['loss'], n_pairs, elapsed = train_epoch(model, loader, optimizer, device, loss, temperature)
+        total_pairs, total_time = total_pairs + n_pairs, total_time + elapsed
+        line = f"Epoch {epoch}/{epochs} Loss: {row['loss']:.4f} ({n_pairs/elapsed:.0f} pairs/s)"
+        if 'hardest_negative_sim' in row:
+            line += f" hardest negative sim {row['hardest_negative_sim']:.3f}"
+        if validate is not None:
+            row['val'] = validate(model)
+            line += ' val ' + ' '.join(f"{k} {v:.4f}" for k, v in row['val'].items())
+        print(line)
+        history.append(row)
+
+        if validate is None:
+            continue
+        score = row['val'][metric]
+        if best is None or score > best + min_delta:
+            best, best_epoch, best_state = score, epoch, copy.deepcopy(model.state_dict())
+        elif patience and epoch - best_epoch >= patience:
+            print(f"Early stopping: no {metric} improvement in {patience} epochs (best {best:.4f} at epoch {best_epoch})")
+            break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    return {
+        'history': history,
+        'best_epoch': best_epoch or len(history),
+        'best': best,
+        'pairs_per_sec': total_pairs / total_time if total_time else 0.0,
+    }
@@ -0,0 +1,261 @@
+# transcription.py
+
+"""
+Concurrent-safe transcription subsystem.
+
+Uploads never touch a shared file on disk: audio is piped straight into an
+``ffmpeg`` process (``FFmpegDecodeStream`` receives the multipart body as it
+is parsed) and decoded to 16 kHz mono float32 samples in memory. Decoded
+audio goes into a bounded job queue served by a pool of worker threads,
+each holding its own preloaded Whisper model, so concurrent requests neither
+clobber each other nor serialize behind a single model.
+"""
+import os
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+
+import numpy as np
+
+from batching import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+READ_CHUNK = 64 * 1024
+
+WHISPER_MODEL = os.environ.get('FAQ_WHISPER_MODEL', 'base')
+WHISPER_WORKERS = int(os.environ.get('FAQ_WHISPER_WORKERS', '1'))
+WHISPER_QUEUE = int(os.environ.get('FAQ_WHISPER_QUEUE', '8'))
+WHISPER_TIMEOUT = float(os.environ.get('FAQ_WHISPER_TIMEOUT', '300'))
+# Window length for streamed (partial) transcripts; Whisper's own context is 30 s
+WHISPER_WINDOW_SECONDS = float(os.environ.get('FAQ_WHISPER_WINDOW_SECONDS', '30'))
+# Load the Whisper models at startup instead of on the first upload
+WHISPER_PRELOAD = os.environ.get('FAQ_WHISPER_PRELOAD', '0') == '1'
+
+
+class AudioDecodeError(RuntimeError):
+    pass
+
+
+# === Decoding ===
+
+class FFmpegDecodeStream:
+    """Writable stream that pipes bytes into ffmpeg while they arrive.
+
+    Werkzeug's form parser writes each uploaded chunk here (see the
+    ``stream_factory`` hook in app.py), so decoding overlaps with the upload.
+    ``finish()`` closes ffmpeg's stdin and returns the decoded samples.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        import ffmpeg
+        self.process = (
+            ffmpeg.input('pipe:0')
+            .output('pipe:1', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+            .global_args('-nostdin', '-loglevel', 'error')
+            .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+        )
+        self._stdout = []
+        self._stderr = []
+        # Drain stdout/stderr concurrently so ffmpeg never blocks on a full pipe
+        self._readers = [
+            threading.Thread(target=self._drain, args=(self.process.stdout, self._stdout), daemon=True),
+            threading.Thread(target=self._drain, args=(self.process.stderr, self._stderr), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+        self._closed = False
+
+    @staticmethod
+    def _drain(pipe, sink):
+        for chunk in iter(lambda: pipe.read(READ_CHUNK), b''):
+            sink.append(chunk)
+
+    def write(self, data):
+        try:
+            self.process.stdin.write(data)
+        except BrokenPipeError:
+            # ffmpeg gave up on the input; the error is reported by finish()
+            pass
+        return len(data)
+
+    # Werkzeug rewinds the container once the part is complete
+    def seek(self, *args):
+        return 0
+
+    def tell(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.process.wait()
+            for reader in self._readers:
+                reader.join()
+        if self.process.returncode != 0:
+            raise AudioDecodeError(b''.join(self._stderr).decode('utf-8', 'replace').strip() or 'ffmpeg failed')
+        pcm = np.frombuffer(b''.join(self._stdout), dtype=np.int16)
+        return pcm.astype(np.float32) / 32768.0
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.process.kill()
+            self.process.wait()
+
+
+def decode_audio(source, sample_rate=SAMPLE_RATE):
+    """Decode bytes or a readable file object to mono float32 samples."""
+    stream = FFmpegDecodeStream(sample_rate)
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            stream.write(bytes(source))
+        else:
+            for chunk in iter(lambda: source.read(READ_CHUNK), b''):
+                stream.write(chunk)
+        return stream.finish()
+    except Exception:
+        stream.close()
+        raise
+
+
+# === Whisper worker pool ===
+
+class TranscriptionPool:
+    """Pool of threads that each own a preloaded Whisper model.
+
+    Jobs (decoded audio arrays) go through one bounded queue; ``submit``
+    raises ``QueueFullError`` instead of letting the backlog grow.
+    """
+
+    def __init__(self, model_name=WHISPER_MODEL, workers=WHISPER_WORKERS, max_queue=WHISPER_QUEUE):
+        self.model_name = model_name
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._ready = threading.Event()
+        self._pid = None
+        self._loaded = 0
+        self._error = None
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self, wait=False):
+        """Start the workers (idempotent; restarted after fork)."""
+        with self._lock:
+            running = self._pid == os.getpid() and any(t.is_alive() for t in self._threads)
+            if not running:
+                self._pid = os.getpid()
+                self._ready.clear()
+                self._loaded = 0
+                self._error = None
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._threads = [
+                    threading.Thread(target=self._run, args=(i,), name=f"whisper-{i}", daemon=True)
+                    for i in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+        if wait:
+            self._ready.wait()
+
+    def _load_model(self, worker_id):
+        import whisper
+        logger.info(f"Whisper worker {worker_id}: loading '{self.model_name}' model")
+        try:
+            model = whisper.load_model(self.model_name)
+        except Exception as e:
+            logger.error(f"Whisper worker {worker_id}: failed to load model: {e}")
+            with self._lock:
+                self._error = e
+            model = None
+        with self._lock:
+            self._loaded += 1
+            if self._loaded == self.workers:
+                self._ready.set()
+        return model
+
+    def _run(self, worker_id):
+        import torch
+        model = self._load_model(worker_id)
+        fp16 = torch.cuda.is_available()
+
+        while True:
+            audio, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            future.timings['queue_ms'] = (started - future.timings.pop('enqueued_at')) * 1000
+            if model is None:
+                # Keep draining so callers fail fast instead of timing out
+                future.set_exception(RuntimeError(f"Whisper model unavailable: {self._error}"))
+                continue
+            try:
+                result = model.transcribe(audio, fp16=fp16)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                future.set_exception(e)
+            else:
+                future.timings['inference_ms'] = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    self.completed += 1
+                future.set_result(result)
+
+    def submit(self, audio):
+        """Queue decoded audio; returns a Future for Whisper's result dict."""
+        self.start()
+        future = Future()
+        # Filled in by the worker: time spent queued and inside Whisper
+        future.timings = {'enqueued_at': time.perf_counter()}
+        try:
+            self._queue.put_nowait((audio, future))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(f"Transcription queue is full ({self._queue.maxsize} jobs)")
+        return future
+
+    def transcribe(self, audio, timeout=WHISPER_TIMEOUT, timings=None):
+        """Transcribe ``audio``; per-stage times are added to ``timings`` if given."""
+        future = self.submit(audio)
+        result = future.result(timeout)
+        if timings is not None:
+            for stage, ms in future.timings.items():
+                timings[stage] = timings.get(stage, 0.0) + ms
+        return result
+
+    def transcribe_windows(self, audio, window_seconds=WHISPER_WINDOW_SECONDS, timeout=WHISPER_TIMEOUT, timings=None):
+        """Yield the text of each ``window_seconds`` slice of ``audio`` as soon as it is done.
+
+        Windows are submitted one at a time so a long recording doesn't take
+        over every worker.
+        """
+        window = max(1, int(window_seconds * SAMPLE_RATE))
+        for start in range(0, max(1, len(audio)), window):
+            yield self.transcribe(audio[start:start + window], timeout, timings)['text'].strip()
+
+    def stats(self):
+        return {
+            'model': self.model_name,
+            'workers': self.workers,
+            'ready': self._ready.is_set(),
+            'error': str(self._error) if self._error else None,
+            'queued': self._queue.qsize(),
+            'max_queue': self._queue.maxsize,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
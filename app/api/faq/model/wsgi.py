@@ -0,0 +1,23 @@
+# wsgi.py
+"""
+WSGI entry point for gunicorn:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With ``preload_app`` (see gunicorn.conf.py) this module is imported once in
+the gunicorn master, so the model is loaded a single time and the forked
+workers share its tensors and embeddings instead of loading their own copy.
+"""
+import os
+
+from app import app, registry
+
+if os.environ.get('FAQ_PRELOAD', '1') == '1':
+    artifacts = registry.load()
+    # Move the weights into shared memory so they stay shared even if a
+    # worker's allocator touches the pages; embeddings are never written
+    # after load, so fork's copy-on-write already keeps them shared.
+    artifacts.model.share_memory()
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))